@@ -19,26 +19,31 @@
 #
 from pathlib import Path
 import logging
-import subprocess
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from astropy.coordinates import Angle
 
 from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.PlateSolver import PlateSolver
 
-class ASTAP:
+class ASTAP(PlateSolver):
     """
     A wrapper of the astap local server  which allows
     plate solving of images.
 
     :param str exec_path: Path to the astap executable.
+    :param float timeout: Seconds allowed for a solve or None for no limit.
     """
 
-    def __init__(self, exec_path):
+    # output file is written next to the image
+    concurrent_solves = False
+
+    def __init__(self, exec_path, timeout=None):
         """
         Initialize object so it is ready to handle solve requests
 
         """
+        super().__init__(timeout=timeout)
         self.exec_path = exec_path
         self.solve_field_revision = None
 
@@ -100,17 +105,8 @@ class ASTAP:
 
 #/usr/bin/solve-field -O --no-plots --no-verify --resort --no-fits2fits --do^Csample 2 -3 310.521 -4 45.3511 -5 10 --config /etc/astrometry.cfg -W /tmp/solution.wcs plate_solve_image.fits
 
-        with subprocess.Popen(cmd_args,
-                              stdin=subprocess.PIPE,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE,
-                              universal_newlines=True) as ps_proc:
-
-            logging.debug('ASTAP_proc output:')
-            for l in ps_proc.stdout:
-                logging.debug(f'ASTAP: {l.strip()}')
-            logging.debug('end of output')
-
+        if not self.run_solver(cmd_args, 'ASTAP'):
+            return None
 
         try:
             out_file = open(outfile_path, 'r')
@@ -123,6 +119,7 @@ class ASTAP:
         dec_str = None
         ang_str = None
         pixelscale_str = None
+        wcs_values = {}
         for l in out_file.readlines():
 #            print('l', l)
             ll = l.strip()
@@ -134,6 +131,8 @@ class ASTAP:
             if len(fields) != 2:
                 continue
 
+            wcs_values[fields[0].strip()] = fields[1].strip()
+
             if 'CRVAL1' in ll:
                 # should look like:
                 # Field center RADec  2.101258 29.091103 deg
@@ -173,9 +172,20 @@ class ASTAP:
 
         logging.info(f'{solved_ra} {solved_dec} {solved_angle} {solved_scale}')
 
+        # keep the linear WCS if ASTAP wrote it
+        try:
+            wcs = {'crval' : (solved_ra, solved_dec),
+                   'crpix' : (float(wcs_values['CRPIX1']), float(wcs_values['CRPIX2'])),
+                   'cd' : ((float(wcs_values['CD1_1']), float(wcs_values['CD1_2'])),
+                           (float(wcs_values['CD2_1']), float(wcs_values['CD2_2'])))}
+        except (KeyError, ValueError):
+            logging.debug('No WCS in ASTAP solution')
+            wcs = {}
+
         radec = SkyCoord(ra=solved_ra*u.degree, dec=solved_dec*u.degree, frame='fk5', equinox='J2000')
         return PlateSolveSolution(radec, pixel_scale=solved_scale,
-                           angle=Angle(solved_angle*u.deg), binning=solve_params.bin_x)
+                           angle=Angle(solved_angle*u.deg), binning=solve_params.bin_x,
+                           **wcs)
 
 
 
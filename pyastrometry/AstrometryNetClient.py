@@ -0,0 +1,470 @@
+#
+# client for the astrometry.net web API
+#
+# Copyright 2019 Michael Fulbright
+#
+# Based on client.py from astrometry.net
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import http.client
+import uuid
+from urllib.parse import urlparse, urlencode, quote
+
+DEFAULT_API_URL = 'http://nova.astrometry.net/api/'
+
+# sessions are reused for this many seconds before logging in again
+SESSION_MAX_AGE = 24*3600
+
+# bytes sent to the socket at a time
+UPLOAD_BLOCK_SIZE = 256*1024
+
+def json2python(data):
+    try:
+        return json.loads(data)
+    except:
+        pass
+    return None
+python2json = json.dumps
+
+def _float_list(values):
+    # numpy values are not JSON serializable
+    return [float(v) for v in values]
+
+class MalformedResponse(Exception):
+    pass
+class RequestError(Exception):
+    pass
+class ServerBusy(RequestError):
+    """
+    Server asked the client to slow down (HTTP 429 or 503).
+
+    :param float retry_after: Seconds the server asked to wait or None.
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class MultipartFileBody:
+    """
+    multipart/form-data request body holding the request JSON and a file.
+
+    The file is read in chunks as the body is sent so it never has to be
+    held in memory.  The body is a file-like object which http.client
+    sends with read() and it can be rewound with seek(0) to send again.
+
+    :param str json_args: Request JSON.
+    :param str filename: Filename to send in the form data.
+    :param fileobj: Binary file object positioned at the start of the data.
+    """
+
+    def __init__(self, json_args, filename, fileobj):
+        """
+        Initialize object.
+
+        """
+        self.boundary = uuid.uuid4().hex
+        self.fileobj = fileobj
+        self._file_start = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        self._file_size = fileobj.tell() - self._file_start
+
+        self._head = (f'--{self.boundary}\r\n'
+                      f'Content-Type: text/plain\r\n'
+                      f'MIME-Version: 1.0\r\n'
+                      f'Content-disposition: form-data; name="request-json"\r\n'
+                      f'\r\n'
+                      f'{json_args}\r\n'
+                      f'--{self.boundary}\r\n'
+                      f'Content-Type: application/octet-stream\r\n'
+                      f'MIME-Version: 1.0\r\n'
+                      f'Content-disposition: form-data; name="file"; '
+                      f'filename="{filename}"\r\n'
+                      f'\r\n').encode()
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.seek(0)
+
+    def __len__(self):
+        return len(self._head) + self._file_size + len(self._tail)
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary="{self.boundary}"'
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if offset != 0 or whence != os.SEEK_SET:
+            raise ValueError('MultipartFileBody can only be rewound')
+        self.fileobj.seek(self._file_start)
+        self._pos = 0
+
+    def read(self, size=-1):
+        head_len = len(self._head)
+        file_end = head_len + self._file_size
+        if size is None or size < 0:
+            size = len(self) - self._pos
+
+        out = []
+        while size > 0 and self._pos < len(self):
+            if self._pos < head_len:
+                chunk = self._head[self._pos:self._pos + size]
+            elif self._pos < file_end:
+                chunk = self.fileobj.read(min(size, file_end - self._pos))
+                if not chunk:
+                    raise IOError('MultipartFileBody: file shorter than expected')
+            else:
+                offset = self._pos - file_end
+                chunk = self._tail[offset:offset + size]
+            out.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b''.join(out)
+
+class Client:
+    """
+    Client for the astrometry.net web API.
+
+    Requests are sent over a persistent HTTP/1.1 connection (one per
+    thread) so many requests only pay for connecting once.  Sessions from
+    :meth:`login` are cached in memory and, if session_cache_file is given,
+    on disk so later clients with the same API key skip logging in.  If the
+    server rejects a cached session the client logs in again and retries.
+
+    :param str apiurl: Base URL of API - can point at a local server.
+    :param str session_cache_file: JSON file to store sessions in.
+    :param float timeout: Socket timeout in seconds.
+    """
+
+    default_url = DEFAULT_API_URL
+
+    # sessions shared by all clients - (apiurl, apikey hash) -> (session, time)
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, apiurl=default_url, session_cache_file=None, timeout=60):
+        """
+        Create client - no connection is made until the first request.
+
+        """
+        self.session = None
+        self.apiurl = apiurl if apiurl.endswith('/') else apiurl + '/'
+        self.session_cache_file = session_cache_file
+        self.timeout = timeout
+        self._apikey = None
+        self._local = threading.local()
+
+        url = urlparse(self.apiurl)
+        if url.scheme not in ['http', 'https']:
+            raise ValueError(f'Client: unsupported API url {apiurl}')
+        self._scheme = url.scheme
+        self._netloc = url.netloc
+        self._path = url.path
+
+    def get_url(self, service):
+        return self.apiurl + service
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self._scheme == 'https':
+                conn = http.client.HTTPSConnection(self._netloc, timeout=self.timeout,
+                                                   blocksize=UPLOAD_BLOCK_SIZE)
+            else:
+                conn = http.client.HTTPConnection(self._netloc, timeout=self.timeout,
+                                                  blocksize=UPLOAD_BLOCK_SIZE)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """
+        Close connection used by the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _http_request(self, path, body, headers):
+        # a kept alive connection may have been closed by the server so
+        # retry once on a fresh connection
+        for attempt in range(2):
+            conn = self._get_connection()
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt > 0:
+                    raise
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                logging.debug('Client: connection closed by server - reconnecting')
+                continue
+            except OSError:
+                self.close()
+                raise
+
+            if response.will_close:
+                self.close()
+            return response.status, response.reason, response.headers, data
+
+    def _encode_request(self, json_args, file_args):
+        # If we're sending a file, format a multipart/form-data which
+        # streams the file from disk
+        if file_args is not None:
+            data = MultipartFileBody(json_args, *file_args)
+            headers = {'Content-type': data.content_type,
+                       'Content-Length': str(len(data))}
+        else:
+            # Else send x-www-form-encoded
+            data = urlencode({'request-json': json_args}).encode('utf-8')
+            headers = {'Content-type': 'application/x-www-form-urlencoded'}
+
+        return data, headers
+
+    def send_request(self, service, args={}, file_args=None):
+        '''
+        service: string
+        args: dict
+        file_args: (filename, binary file object) to upload
+        '''
+        args = dict(args)
+        if file_args is not None:
+            file_start = file_args[1].tell()
+        for attempt in range(2):
+            if self.session is not None:
+                args.update({'session':self.session})
+
+            json_args = python2json(args)
+            logging.debug(f'send_request: {service} {json_args}')
+
+            if file_args is not None:
+                file_args[1].seek(file_start)
+            data, headers = self._encode_request(json_args, file_args)
+            status, reason, resp_headers, txt = self._http_request(self._path + service,
+                                                                   data, headers)
+
+            if status in (429, 503):
+                retry_after = resp_headers.get('Retry-After')
+                try:
+                    retry_after = float(retry_after)
+                except (TypeError, ValueError):
+                    retry_after = None
+                raise ServerBusy(f'server busy {status} {reason}', retry_after)
+
+            if status >= 400:
+                logging.error(f'HTTPError {status} {reason}')
+                open('err.html', 'wb').write(txt)
+                logging.error('Wrote error text to err.html')
+                return None
+
+            result = json2python(txt)
+            if result is None:
+                raise MalformedResponse(f'invalid response from {service}')
+
+            stat = result.get('status')
+            if stat == 'error':
+                errstr = result.get('errormessage', '(none)')
+                # cached session may have expired on the server
+                if attempt == 0 and 'session' in errstr and \
+                   self._apikey is not None and service != 'login':
+                    logging.info(f'Session rejected ({errstr}) - logging in again')
+                    self.login(self._apikey, use_cache=False)
+                    continue
+                raise RequestError('server error message: ' + errstr)
+            return result
+
+    def _session_key(self, apikey):
+        return self.apiurl + ' ' + hashlib.sha256(apikey.encode()).hexdigest()
+
+    def _read_session_cache(self):
+        if self.session_cache_file is None:
+            return {}
+        try:
+            with open(self.session_cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_session_cache(self, key, session, login_time):
+        if self.session_cache_file is None:
+            return
+        cache = self._read_session_cache()
+        cache[key] = [session, login_time]
+        tmp_fname = self.session_cache_file + '.tmp'
+        try:
+            with open(tmp_fname, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_fname, self.session_cache_file)
+        except OSError:
+            logging.warning(f'Unable to write session cache {self.session_cache_file}')
+
+    def login(self, apikey, use_cache=True):
+        """
+        Log in to get a session.
+
+        A cached session for the same API url and key is used if one is
+        available and not older than SESSION_MAX_AGE.
+
+        :param str apikey: astrometry.net API key.
+        :param bool use_cache: If False always log in to the server.
+        """
+        self._apikey = apikey
+        key = self._session_key(apikey)
+
+        with Client._sessions_lock:
+            if use_cache:
+                cached = Client._sessions.get(key)
+                if cached is None:
+                    cached = self._read_session_cache().get(key)
+                if cached is not None and time.time() - cached[1] < SESSION_MAX_AGE:
+                    logging.debug('Using cached session')
+                    self.session = cached[0]
+                    Client._sessions[key] = tuple(cached)
+                    return
+
+            self.session = None
+            args = {'apikey' : apikey}
+            result = self.send_request('login', args)
+            sess = None if result is None else result.get('session')
+            logging.info(f'Got session: {sess}')
+            if not sess:
+                raise RequestError('no session in result')
+            self.session = sess
+
+            login_time = time.time()
+            Client._sessions[key] = (sess, login_time)
+            self._write_session_cache(key, sess, login_time)
+
+    def _get_upload_args(self, **kwargs):
+        args = {}
+        for key, default, typ in [('allow_commercial_use', 'd', str),
+                                  ('allow_modifications', 'd', str),
+                                  ('publicly_visible', 'y', str),
+                                  ('scale_units', None, str),
+                                  ('scale_type', None, str),
+                                  ('scale_lower', None, float),
+                                  ('scale_upper', None, float),
+                                  ('scale_est', None, float),
+                                  ('scale_err', None, float),
+                                  ('center_ra', None, float),
+                                  ('center_dec', None, float),
+                                  ('parity', None, int),
+                                  ('radius', None, float),
+                                  ('downsample_factor', None, int),
+                                  ('tweak_order', None, int),
+                                  ('crpix_center', None, bool),
+                                  ('x', None, _float_list),
+                                  ('y', None, _float_list),
+                                  ('image_width', None, int),
+                                  ('image_height', None, int),
+                                 ]:
+            if key in kwargs:
+                val = kwargs.pop(key)
+                val = typ(val)
+                args.update({key: val})
+            elif default is not None:
+                args.update({key: default})
+        return args
+
+    def url_upload(self, url, **kwargs):
+        args = dict(url=url)
+        args.update(self._get_upload_args(**kwargs))
+        result = self.send_request('url_upload', args)
+        return result
+
+    def upload(self, fn=None, fileobj=None, **kwargs):
+        """
+        Upload an image file.
+
+        The file is streamed to the server so it is not read into memory.
+
+        :param str fn: Filename of image.
+        :param fileobj: Binary file object to upload instead of opening fn,
+            for example an in memory copy of a reduced image.  fn is still
+            sent as the filename.
+        :return: Server response or None on HTTP error.
+        :rtype: dict
+        """
+        args = self._get_upload_args(**kwargs)
+        if fileobj is not None:
+            return self.send_request('upload', args, (fn, fileobj))
+        if fn is None:
+            return self.send_request('upload', args)
+        try:
+            f = open(fn, 'rb')
+        except IOError:
+            logging.error('File %s does not exist' % fn)
+            raise
+        with f:
+            return self.send_request('upload', args, (fn, f))
+
+    def upload_sources(self, x, y, image_width, image_height, **kwargs):
+        """
+        Upload a list of star positions instead of an image.
+
+        Only the star positions are sent so the upload is tiny and the
+        server can skip finding stars.
+
+        :param ndarray x: X coordinate of stars using the 1-indexed FITS
+            convention, brightest first.
+        :param ndarray y: Y coordinate of stars.
+        :param int image_width: Width of image stars were found in.
+        :param int image_height: Height of image stars were found in.
+        :return: Server response or None on HTTP error.
+        :rtype: dict
+        """
+        args = self._get_upload_args(x=x, y=y, image_width=image_width,
+                                     image_height=image_height, **kwargs)
+        return self.send_request('upload', args)
+
+    def submission_images(self, subid):
+        result = self.send_request('submission_images', {'subid':subid})
+        return result.get('image_ids')
+
+    def myjobs(self):
+        result = self.send_request('myjobs/')
+        return result['jobs']
+
+    def job_status(self, job_id, justdict=False):
+        result = self.send_request('jobs/%s' % job_id)
+        if justdict:
+            return result
+        return result.get('status')
+
+    def job_calib_result(self, job_id):
+        result = self.send_request('jobs/%s/calibration' % job_id)
+        return result
+
+    def sub_status(self, sub_id, justdict=False):
+        result = self.send_request('submissions/%s' % sub_id)
+        if justdict:
+            return result
+        return result.get('status')
+
+    def jobs_by_tag(self, tag, exact):
+        exact_option = 'exact=yes' if exact else ''
+        result = self.send_request(
+            'jobs_by_tag?query=%s&%s' % (quote(tag.strip()), exact_option),
+            {},
+        )
+        return result
@@ -0,0 +1,325 @@
+#
+# resident astrometry.net engine
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import glob
+import shlex
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import astropy.io.fits as pyfits
+
+from pyastrometry.PlateSolver import PlateSolver, current_job
+from pyastrometry.FITSHeader import read_header
+
+# seconds to wait for the wcs file after the solved file appears when there
+# is no timeout
+WCS_WAIT = 5.0
+
+class AstrometryNetEngine(PlateSolver):
+    """
+    Keeps an "astrometry-engine" process running so the index files are
+    loaded once instead of for every solve.
+
+    For each solve "solve-field --just-augment" extracts the stars and
+    writes an augmented xylist (.axy) file containing the solve hints and
+    output filenames - this does not load any index files.  The name of the
+    .axy file is then written to the stdin of the resident engine which is
+    started with "-f -" so it reads job filenames from stdin.
+
+    The engine does not report when a job which fails to solve finishes so
+    a job is considered failed when the solved file has not appeared before
+    the timeout.  The job is then cancelled so the engine moves on to the
+    next one.
+
+    Add "inparallel" to the astrometry.net config file to keep all of the
+    index data in memory between jobs.
+
+    :param str exec_path: Path to the "astrometry-engine" executable.
+    :param AstrometryNetLocal solve_field: Used to create the .axy files.
+    :param str config: astrometry.net config file.
+    :param float timeout: Seconds to wait for a job to solve - None for no
+        limit.
+    """
+
+    # engine handles one job at a time
+    concurrent_solves = False
+
+    def __init__(self, exec_path, solve_field, config='/etc/astrometry.cfg',
+                 timeout=30):
+        """
+        Initialize object - the engine is started on the first solve.
+
+        """
+        super().__init__(timeout=timeout)
+        self.exec_path = exec_path
+        self.solve_field = solve_field
+        self.config = config
+
+        self.engine_proc = None
+        self.workdir = None
+        self.job_count = 0
+
+        # engine handles jobs one at a time
+        self._lock = threading.Lock()
+
+    def set_exec_path(self, exec_path):
+        """
+        Set path to "astrometry-engine" executable.
+
+        :param str exec_path: Path to the astrometry-engine executable.
+        """
+        self.exec_path = exec_path
+
+    def is_running(self):
+        """
+        Test if engine process is running.
+
+        :return: True if running.
+        :rtype: bool
+        """
+        return self.engine_proc is not None and self.engine_proc.poll() is None
+
+    def start(self):
+        """
+        Start the engine process.
+
+        :return: True on success.
+        :rtype: bool
+        """
+        if self.is_running():
+            return True
+
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix='pyastrometry_engine_')
+            logging.debug(f'Created engine work dir {self.workdir}')
+
+        cmd_args = [self.exec_path, '--config', self.config, '-f', '-']
+        logging.info(f'Starting astrometry engine {cmd_args}')
+
+        try:
+            self.engine_proc = subprocess.Popen(cmd_args,
+                                                stdin=subprocess.PIPE,
+                                                stdout=subprocess.PIPE,
+                                                stderr=subprocess.STDOUT,
+                                                universal_newlines=True,
+                                                bufsize=1)
+        except FileNotFoundError:
+            logging.error(f'Could not find {self.exec_path} astrometry engine!')
+            self.engine_proc = None
+            return False
+
+        # drain output so the engine never blocks on a full pipe
+        def log_output(proc):
+            for l in proc.stdout:
+                logging.debug(f'astrometryengine: {l.strip()}')
+            logging.debug('astrometryengine: output closed')
+
+        threading.Thread(target=log_output, args=(self.engine_proc,),
+                         daemon=True).start()
+
+        return True
+
+    def stop(self):
+        """
+        Stop the engine process and remove its work files.
+        """
+        if self.engine_proc is not None:
+            logging.info('Stopping astrometry engine')
+            try:
+                self.engine_proc.stdin.close()
+                self.engine_proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.engine_proc.kill()
+                self.engine_proc.wait()
+            self.engine_proc = None
+
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    def _remove_job_files(self, job_id):
+        # keep cancel files until engine is stopped since the engine may
+        # not have reached a cancelled job yet
+        for f in glob.glob(os.path.join(self.workdir, f'job{job_id}.*')):
+            if not f.endswith('.cancel'):
+                os.unlink(f)
+
+    def solve_file(self, fname, solve_params, downsample=2, search_rad=10,
+                   extract_stars=False, timeout=None):
+        """
+        Plate solve the specified file using the resident engine.
+
+        :param str fname: Filename of the file to be solved.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param int downsample: Downsample factor for image.
+        :param float search_rad: Number of degrees to search.
+        :param bool extract_stars: If True extract stars in process instead
+            of having solve-field extract them.
+        :param float timeout: Seconds to wait for solution - defaults to
+            the value given when object was created.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        if extract_stars:
+            return self.solve_data(pyfits.getdata(fname), solve_params,
+                                   search_rad=search_rad, timeout=timeout)
+
+        return self.run_job(solve_params, search_rad, timeout, fname=fname,
+                            downsample=downsample)
+
+    def solve_data(self, data, solve_params, search_rad=10, timeout=None):
+        """
+        Plate solve image data by extracting stars and solving the star list.
+
+        :param ndarray data: Image data.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param float search_rad: Number of degrees to search.
+        :param float timeout: Seconds to wait for solution - defaults to
+            the value given when object was created.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        return self.run_job(solve_params, search_rad, timeout, data=data)
+
+    def run_job(self, solve_params, search_rad, timeout, fname=None,
+                downsample=None, data=None):
+        """
+        Create .axy file for an image file or image data and have the
+        engine solve it.
+
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param float search_rad: Number of degrees to search.
+        :param float timeout: Seconds to wait for solution.
+        :param str fname: Filename of image to solve.
+        :param int downsample: Downsample factor for image file.
+        :param ndarray data: Image data to extract stars from if fname is None.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        # an async solve may have less time left
+        remaining = self.time_remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        job = current_job()
+
+        with self._lock:
+            if not self.start():
+                return None
+
+            self.job_count += 1
+            job_id = self.job_count
+            if job_id > 2:
+                self._remove_job_files(job_id - 2)
+
+            job_base = os.path.join(self.workdir, f'job{job_id}')
+            axy_name = job_base + '.axy'
+            solved_name = job_base + '.solved'
+            wcs_name = job_base + '.wcs'
+            cancel_name = job_base + '.cancel'
+
+            if data is not None:
+                fname = job_base + '.xyls'
+                size = self.solve_field.write_star_list(data, fname)
+                if size is None:
+                    logging.error('No stars found - solve failed!')
+                    return None
+                downsample = None
+
+            cmd_line = self.solve_field.build_cmd_line(solve_params,
+                                                       downsample=downsample,
+                                                       search_rad=search_rad)
+            if data is not None:
+                cmd_line += self.solve_field.xylist_cmd_line(*size)
+            cmd_line += '--just-augment '
+            if timeout is not None:
+                cmd_line += f'--cpulimit {int(timeout)} '
+            cmd_line += f'-D {self.workdir} '
+            cmd_line += f'--axy {axy_name} '
+            cmd_line += '-N none '
+            cmd_line += f'-S {solved_name} '
+            cmd_line += f'-W {wcs_name} '
+            cmd_line += f'--cancel {cancel_name} '
+            cmd_line += ' ' + fname
+
+            cmd_args = shlex.split(cmd_line)
+
+            logging.debug(f'cmd_args for astrometry.net augment = "{cmd_args}"')
+
+            if not self.run_solver(cmd_args, 'astrometryaugment'):
+                return None
+
+            if not os.path.isfile(axy_name):
+                logging.error('No axy file - star extraction failed!')
+                return None
+
+            logging.debug(f'Sending job {axy_name} to astrometry engine')
+            try:
+                self.engine_proc.stdin.write(axy_name + '\n')
+                self.engine_proc.stdin.flush()
+            except OSError:
+                logging.error('Unable to send job to astrometry engine', exc_info=True)
+                self.stop()
+                return None
+
+            time_start = time.time()
+            while not os.path.isfile(solved_name):
+                if not self.is_running():
+                    logging.error('Astrometry engine exited unexpectedly!')
+                    self.stop()
+                    return None
+
+                if timeout is not None and time.time() - time_start > timeout:
+                    logging.error('No solved file - solve failed!')
+                    if job is not None:
+                        job.timed_out = True
+                    open(cancel_name, 'w').close()
+                    return None
+
+                if job is not None and job.cancel_event.is_set():
+                    logging.info('Solve cancelled')
+                    open(cancel_name, 'w').close()
+                    return None
+
+                time.sleep(0.05)
+
+            logging.info(f'Solved file found after '
+                         f'{time.time()-time_start:.2f} seconds')
+
+            # wcs file may be written just after the solved file
+            if timeout is None:
+                wcs_deadline = time.time() + WCS_WAIT
+            else:
+                wcs_deadline = time_start + timeout
+            wcs_header = read_header(wcs_name)
+            while wcs_header is None:
+                if time.time() > wcs_deadline:
+                    logging.error(f'Unable to read wcs file {wcs_name}')
+                    return None
+                time.sleep(0.05)
+                wcs_header = read_header(wcs_name)
+
+        return self.solve_field.solution_from_wcs_header(wcs_header, solve_params)
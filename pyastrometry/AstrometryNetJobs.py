@@ -0,0 +1,207 @@
+#
+# track astrometry.net web API jobs
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyastrometry.AstrometryNetClient import RequestError, ServerBusy
+
+class JobFailed(Exception):
+    pass
+
+class Backoff:
+    """
+    Exponential backoff delays with jitter.
+
+    :param float initial: First delay in seconds.
+    :param float maximum: Largest delay in seconds.
+    :param float factor: Delay is multiplied by this after each wait.
+    :param float jitter: Fraction of the delay which is random.
+    """
+
+    def __init__(self, initial=1.0, maximum=30.0, factor=2.0, jitter=0.5):
+        """
+        Initialize object.
+
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.reset()
+
+    def reset(self):
+        """
+        Start again from the initial delay.
+        """
+        self._delay = self.initial
+
+    def next_delay(self):
+        """
+        Get the next delay.
+
+        :return: Delay in seconds.
+        :rtype: float
+        """
+        delay = self._delay
+        self._delay = min(self.maximum, self._delay*self.factor)
+        return delay*(1 - self.jitter*random.random())
+
+class JobTracker:
+    """
+    Wait for many astrometry.net submissions at once.
+
+    Each submission is followed by a task on an asyncio event loop running
+    in a background thread.  A task polls the submission until a job is
+    started and then polls the job until it finishes, waiting an
+    exponentially growing time with random jitter between polls so
+    outstanding jobs do not all hit the server together.  The delay is reset
+    when a submission becomes a job.  If the server says it is busy all
+    tasks wait for at least the time it asks for.
+
+    The blocking client calls are run on a small thread pool so polls for
+    different jobs overlap.
+
+    :param Client client: Logged in astrometry.net client.
+    :param float initial_delay: First poll delay in seconds.
+    :param float max_delay: Largest poll delay in seconds.
+    :param int max_workers: Maximum number of requests in flight.
+    """
+
+    def __init__(self, client, initial_delay=1.0, max_delay=30.0, max_workers=4):
+        """
+        Initialize object - the event loop is started on first use.
+
+        """
+        self.client = client
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_workers = max_workers
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._busy_until = 0
+        self.outstanding = 0
+
+    def _start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='AstrometryNetJobs')
+            self._loop = asyncio.new_event_loop()
+            self._loop.set_default_executor(self._executor)
+            self._thread = threading.Thread(target=self._loop.run_forever,
+                                            name='AstrometryNetJobs', daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        """
+        Stop event loop - any outstanding jobs are cancelled.
+        """
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+        self._executor.shutdown(wait=False)
+
+    def track(self, sub_id, timeout=None):
+        """
+        Start following a submission.
+
+        :param int sub_id: Submission id from upload.
+        :param float timeout: Seconds to wait for the job - None waits
+            forever.
+        :return: Future whose result is the job calibration dict.  It raises
+            JobFailed if the job failed, TimeoutError if it did not finish in
+            time or RequestError if the server returned an error.
+        :rtype: concurrent.futures.Future
+        """
+        self._start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return asyncio.run_coroutine_threadsafe(self._track(sub_id, deadline),
+                                                self._loop)
+
+    async def _call(self, fn, *args, **kwargs):
+        # wait out any busy period the server asked for then make the call
+        # on the thread pool
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = self._busy_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await loop.run_in_executor(None, lambda: fn(*args, **kwargs))
+            except ServerBusy as err:
+                retry_after = err.retry_after if err.retry_after is not None \
+                              else self.max_delay
+                logging.warning(f'astrometry.net busy - waiting {retry_after} seconds')
+                self._busy_until = max(self._busy_until, time.monotonic() + retry_after)
+
+    async def _sleep(self, backoff, deadline, what):
+        delay = backoff.next_delay()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'timeout waiting for {what}')
+            delay = min(delay, remaining)
+        await asyncio.sleep(delay)
+
+    async def _track(self, sub_id, deadline):
+        self.outstanding += 1
+        try:
+            backoff = Backoff(initial=self.initial_delay, maximum=self.max_delay)
+
+            job_id = None
+            while job_id is None:
+                stat = await self._call(self.client.sub_status, sub_id, justdict=True)
+                if stat is None:
+                    raise RequestError(f'no status for submission {sub_id}')
+                for j in stat.get('jobs', []):
+                    if j is not None:
+                        job_id = j
+                        break
+                if job_id is None:
+                    await self._sleep(backoff, deadline, f'submission {sub_id}')
+
+            logging.info(f'Job started - id = {job_id}')
+            backoff.reset()
+
+            while True:
+                job_stat = await self._call(self.client.job_status, job_id)
+                logging.debug(f'Job {job_id} status {job_stat}')
+                if job_stat == 'success':
+                    break
+                if job_stat == 'failure':
+                    raise JobFailed(f'job {job_id} failed')
+                await self._sleep(backoff, deadline, f'job {job_id}')
+
+            return await self._call(self.client.job_calib_result, job_id)
+        finally:
+            self.outstanding -= 1
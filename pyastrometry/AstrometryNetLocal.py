@@ -18,34 +18,37 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import os
-import math
 import logging
 import subprocess
 import tempfile
-import numpy as np
-from astropy.coordinates import SkyCoord
-from astropy import units as u
-from astropy.coordinates import Angle
 
 from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.PlateSolver import PlateSolver
+from pyastrometry.StarExtractor import StarExtractor
+from pyastrometry.FITSHeader import read_header
 
-class AstrometryNetLocal:
+class AstrometryNetLocal(PlateSolver):
     """A wrapper of the astrometry.net local server  which allows
     plate solving of images.
 
     :param str exec_path: Path to the "solve-field" executable.
+    :param float timeout: Seconds allowed for a solve or None for no limit.
     """
 
-    def __init__(self, exec_path):
+    def __init__(self, exec_path, timeout=None):
         """Initialize object so it is ready to handle solve requests
 
         Parameters
         ----------
         exec_path : str
             Path to the astrometry.net executable
+        timeout : float
+            Seconds allowed for a solve or None for no limit
         """
+        super().__init__(timeout=timeout)
         self.exec_path = exec_path
         self.solve_field_revision = None
+        self.star_extractor = StarExtractor()
 
     def set_exec_path(self, exec_path):
         """
@@ -118,21 +121,19 @@ class AstrometryNetLocal:
         return rev
 
 
-    def solve_file(self, fname, solve_params, downsample=2, search_rad=10):
+    def build_cmd_line(self, solve_params, downsample=2, search_rad=10):
         """
-        Plate solve the specified file using solve-field
+        Build the "solve-field" command line options common to all solves.
+
+        The returned string does not include the output file options or
+        the name of the file to solve.
 
-        :param str fname: Filename of the file to be solved.
         :param PlateSolveParameters solve_params: Parameters for plate solver.
-        :param int downsample: Downsample factor for image.
+        :param int downsample: Downsample factor for image - None when
+            solving a star list.
         :param float search_rad: Number of degrees to search.
-
-        :returns:
-          solved_position (SkyCoord)
-             The J2000 sky coordinate of the plate solve match, or None if no
-             match was found.
-          angle (Angle)
-             Position angle of Y axis expressed as East of North.
+        :return: Command line.
+        :rtype: str
         """
 
         # determine installed version of solve-field
@@ -150,7 +151,8 @@ class AstrometryNetLocal:
 
         cmd_line = self.exec_path
         cmd_line += ' -O --no-plots --no-verify --resort'
-        cmd_line += f' --downsample {downsample}'
+        if downsample is not None:
+            cmd_line += f' --downsample {downsample}'
         # this is only needed for rev of 0.67 or earlier
         if rev <= 0.67:
             cmd_line += ' --no-fits2fits'
@@ -187,7 +189,99 @@ class AstrometryNetLocal:
 #        cmd_line += fname + ','
 #        cmd_line += f'{wait}'
 
+        return cmd_line
+
+    @staticmethod
+    def xylist_cmd_line(width, height):
+        """
+        Build the "solve-field" options needed to solve a star list.
+
+        :param int width: Width of image stars were extracted from.
+        :param int height: Height of image stars were extracted from.
+        :return: Command line.
+        :rtype: str
+        """
+        return f'--width {width} --height {height} ' \
+               '--x-column X --y-column Y --sort-column FLUX '
+
+    def write_star_list(self, data, xylist_fname):
+        """
+        Extract stars from image data and write them as an xylist.
+
+        :param ndarray data: Image data.
+        :param str xylist_fname: Output star list filename.
+        :return: Width and height of image or None if no stars were found.
+        :rtype: (int, int)
+        """
+        height, width = data.shape[-2:]
+        x, y, flux = self.star_extractor.extract(data)
+        logging.info(f'Extracted {len(x)} stars from {width} x {height} image')
+        if len(x) == 0:
+            return None
+
+        self.star_extractor.write_xylist(xylist_fname, x, y, flux, width, height)
+        return width, height
+
+    def solve_data(self, data, solve_params, search_rad=10):
+        """
+        Plate solve image data by extracting stars and solving the star list.
+
+        :param ndarray data: Image data.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param float search_rad: Number of degrees to search.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            xylist_name = os.path.join(tmpdirname, 'stars.xyls')
+            size = self.write_star_list(data, xylist_name)
+            if size is None:
+                logging.error('No stars found - solve failed!')
+                return None
+
+            cmd_line = self.build_cmd_line(solve_params, downsample=None,
+                                           search_rad=search_rad)
+            cmd_line += self.xylist_cmd_line(*size)
+            return self.run_solve_field(cmd_line, xylist_name, solve_params)
 
+    def solve_file(self, fname, solve_params, downsample=2, search_rad=10,
+                   extract_stars=False):
+        """
+        Plate solve the specified file using solve-field
+
+        :param str fname: Filename of the file to be solved.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param int downsample: Downsample factor for image.
+        :param float search_rad: Number of degrees to search.
+        :param bool extract_stars: If True extract stars in process and
+            pass solve-field a star list instead of the image.
+
+        :returns:
+          solved_position (SkyCoord)
+             The J2000 sky coordinate of the plate solve match, or None if no
+             match was found.
+          angle (Angle)
+             Position angle of Y axis expressed as East of North.
+        """
+        if extract_stars:
+            import astropy.io.fits as pyfits
+            return self.solve_data(pyfits.getdata(fname), solve_params,
+                                   search_rad=search_rad)
+
+        cmd_line = self.build_cmd_line(solve_params, downsample=downsample,
+                                       search_rad=search_rad)
+        return self.run_solve_field(cmd_line, fname, solve_params)
+
+    def run_solve_field(self, cmd_line, fname, solve_params):
+        """
+        Run "solve-field" and parse the solution.
+
+        :param str cmd_line: Options from build_cmd_line().
+        :param str fname: Filename of image or star list to solve.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
 
 #/usr/bin/solve-field -O --no-plots --no-verify --resort --no-fits2fits --do^Csample 2 -3 310.521 -4 45.3511 -5 10 --config /etc/astrometry.cfg -W /tmp/solution.wcs plate_solve_image.fits
 
@@ -195,11 +289,13 @@ class AstrometryNetLocal:
         with tempfile.TemporaryDirectory() as tmpdirname:
             logging.debug(f'Created temp dir {tmpdirname}')
 
-            # put solve-field files in this temp dir
-            new_fits_name = os.path.join(tmpdirname, "solved.fit")
+            # put solve-field files in this temp dir - solution is read from
+            # the small wcs file so skip writing a new copy of the image
             solved_name = os.path.join(tmpdirname, "solved")
+            wcs_name = os.path.join(tmpdirname, "solved.wcs")
             cmd_line += f'-D {tmpdirname} '
-            cmd_line += f'-N {new_fits_name} '
+            cmd_line += '-N none '
+            cmd_line += f'-W {wcs_name} '
             cmd_line += f'-S {solved_name} '
             cmd_line += ' ' + fname
 
@@ -209,19 +305,8 @@ class AstrometryNetLocal:
             logging.debug(f'cmd_line for astrometry.net local = "{cmd_line}"')
             logging.debug(f'cmd_args for astrometry.net local = "{cmd_args}"')
 
-            with subprocess.Popen(cmd_args,
-                                        stdin=subprocess.PIPE,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        universal_newlines=True) as net_proc:
-    #        poll_value = None
-    #        while True:
-    #            poll_value = net_proc.poll()
-    #            if poll_value is not None:
-    #                break
-
-                for l in net_proc.stdout:
-                    logging.debug(f'astromentrynetlocal: {l.strip()}')
+            if not self.run_solver(cmd_args, 'astromentrynetlocal'):
+                return None
 
             # see if solve succeeded
             if os.path.isfile(solved_name):
@@ -244,117 +329,33 @@ class AstrometryNetLocal:
     #            print(ll)
 
             # parse solution.wcs
-            from astropy import wcs
-            import astropy.io.fits as pyfits
+            wcs_header = read_header(wcs_name)
+            if wcs_header is None:
+                logging.error(f'Unable to read wcs file {wcs_name} - solve failed!')
+                return None
 
-            #import time
-            #time.sleep(5)
-
-            wcs_hdulist = pyfits.open(new_fits_name)
-            #print(wcs_hdulist)
-            #print('wcs_hdulist: ', wcs_hdulist[0], vars(wcs_hdulist[0]))
-            w = wcs.WCS(wcs_hdulist[0].header)
-            #print(w.wcs.naxis)
-            wcs_hdulist.close()
-
-        #print('wcs.wcs=', wcs)
-        #print('vars(wcs.wcs): ',vars(wcs.wcs))
-        #wcs.wcs.print_contents()
-#        print('CRPIX = ', w.wcs.crpix)
-#        print('CD = ', w.wcs.cd)
-#        print('pixel scales = ', wcs.utils.proj_plane_pixel_scales(w))
-
-        solved_ra, solved_dec = w.wcs.crval
-        logging.info(f'solved_ra solved_dec = {solved_ra} {solved_dec}')
-#        solved_scale_x, solved_scale_y = wcs.utils.proj_plane_pixel_scales(w)
-
-        #FIXME just take X scale
-#        solved_scale = solved_scale_x
-
-        # convert CD matrix
-        cd_1_1 = w.wcs.cd[0][0]
-        cd_1_2 = w.wcs.cd[0][1]
-        cd_2_1 = w.wcs.cd[1][0]
-        cd_2_2 = w.wcs.cd[1][1]
-
-        cdelt1 = math.sqrt(cd_1_1**2+cd_2_1**2)
-        cdelt2 = math.sqrt(cd_1_2**2+cd_2_2**2)
-
-        # convention is to set cdelt1 negative if det of CD is negative
-#        if cd_1_1*cd_2_2-cd_1_2*cd_2_2 < 0:
-#            cdelt1 = -cdelt1
-#
-#        logging.info(f'cdelt = {cdelt1*3600:5.2f} {cdelt2*3600:5.2f} arcsec/pixel')
-#
-#        cdel = cdelt1 - cdelt2
-#
-#        logging.debug(f'cd_1_1 cd_2_1 cd_1_2 cd_2_2 = {cd_1_1} {cd_2_1} {cd_1_2} {cd_2_2})')
-#        logging.debug(f'cdelt1 cdelt2 cdel = {cdelt1} {cdelt2} {cdel}')
-
-        # compute angle between North and the positive Y axis of sensor
-        # positive is CCW
-        crota = math.atan2(cd_2_1, cd_1_1)
-        crota_deg = np.rad2deg(crota)
-        logging.debug(f'cdelt = {cdelt1*3600:5.2f} {cdelt2*3600:5.2f} arcsec/pixel')
-        logging.debug(f'crota/crota_deg = {crota} {crota_deg}')
-
-        #  get roll angle
-        roll_angle_deg =  -crota_deg
-        logging.info(f'roll_angle_deg = {roll_angle_deg:5.2f}')
-        solved_scale = cdelt1*3600
-        solved_angle = roll_angle_deg
-
-#        ra_str = None
-#        dec_str = None
-#        ang_str = None
-#        fov_x_str = None
-#        for l in net_proc.stdout.readlines():
-#            ll = ''.join(filter(lambda x: x.isalnum() or x.isspace() or x == '.', l))
-#            print(ll)
-#            fields = ll.split()
-#            # look for ra/dec in deg first
-#            if 'center' in ll and 'deg' in ll:
-#                # should look like:
-#                # Field center RADec  2.101258 29.091103 deg
-#                print(fields)
-#                ra_str = fields[3]
-#                dec_str = fields[4]
-#            elif 'angle' in ll:
-#                # should look like:
-#                # Field rotation angle up is 1.12149 degrees E of N.
-#                ang_str = fields[5]
-#            elif 'Field size' in ll:
-#                fov_x_str = fields[2]
-#
-#        logging.info(f'{ra_str} {dec_str} {ang_str}')
-#
-#        try:
-#            solved_ra = float(ra_str)
-#            solved_dec = float(dec_str)
-#            solved_angle = float(ang_str)
-#
-#            # fov is given in arcmin so convert to arcsec
-#            fov_x = float(fov_x_str)*60.0
-#
-#            logging.info(f'solved fov = {fov_x} arcsec')
-#            if solve_params.width is not None:
-#                solved_scale = fov_x / solve_params.width
-#                logging.info(f'using given width of {solve_params.width} pixel scale is {solved_scale} arcsec/pix')
-#            else:
-#                solved_scale = None
-#                logging.warning('No width given so pixel scale not computed!')
-#
-#        except Exception as e:
-#            logging.exception('Failed to parse solution')
-#            return None
-#
-#        logging.info(f'{solved_ra} {solved_dec} {solved_angle} {solved_scale}')
+        return self.solution_from_wcs_header(wcs_header, solve_params)
 
-        radec = SkyCoord(ra=solved_ra*u.degree, dec=solved_dec*u.degree, frame='fk5', equinox='J2000')
+    def solution_from_wcs_header(self, wcs_header, solve_params):
+        """
+        Convert WCS written by solve-field into a plate solve solution.
 
-        logging.info(f"AstrometryNetLocal solved coordinates: {radec.to_string('hmsdms', sep=':')}")
-        return PlateSolveSolution(radec, pixel_scale=solved_scale,
-                                  angle=Angle(solved_angle*u.degree), binning=solve_params.bin_x)
+        :param dict wcs_header: FITS header (dict or astropy Header)
+            containing WCS of solution.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :return: Plate solve solution.
+        :rtype: PlateSolveSolution
+        """
+        solution = PlateSolveSolution.from_wcs_header(wcs_header,
+                                                      binning=solve_params.bin_x)
+
+        logging.debug(f'crpix = {solution.crpix} cd = {solution.cd.tolist()} '
+                      f'sip = {solution.sip is not None}')
+        logging.info(f'pixel scale = {solution.pixel_scale:5.2f} arcsec/pixel')
+        logging.info(f'roll_angle_deg = {solution.angle.degree:5.2f}')
+        logging.info(f"AstrometryNetLocal solved coordinates: "
+                     f"{solution.radec.to_string('hmsdms', sep=':')}")
+        return solution
 
 
 
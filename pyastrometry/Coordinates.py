@@ -0,0 +1,248 @@
+#
+# batch precession and formatting of RA/DEC positions
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+import numpy as np
+
+from astropy.time import Time
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import FK5
+
+# julian date of the unix epoch
+JD_UNIX_EPOCH = 2440587.5
+
+# epochs are rounded to this many days so frames can be reused - precession
+# over a minute is a few milliarcseconds
+EPOCH_RESOLUTION = 1.0/1440.0
+
+FK5_J2000 = FK5(equinox='J2000')
+
+# most decimal places of seconds written when formatting at full precision
+FULL_PRECISION = 8
+
+def jd_now():
+    """
+    Current julian date (UTC).
+
+    :return: Julian date.
+    :rtype: float
+    """
+    return JD_UNIX_EPOCH + time.time()/86400.0
+
+def epoch_to_jd(epoch):
+    """
+    Convert an epoch to julian date.
+
+    :param epoch: None for now, 'J2000', a julian date or a Time or
+        datetime (naive datetimes are UTC) or an array of any of these.
+    :return: Julian date(s) (UTC).
+    :rtype: float or ndarray
+    """
+    if epoch is None:
+        return jd_now()
+    if isinstance(epoch, str):
+        return Time(epoch).utc.jd
+    if isinstance(epoch, Time):
+        return epoch.utc.jd
+    if isinstance(epoch, datetime):
+        if epoch.tzinfo is None:
+            epoch = epoch.replace(tzinfo=timezone.utc)
+        return JD_UNIX_EPOCH + epoch.timestamp()/86400.0
+
+    epoch = np.asarray(epoch)
+    if epoch.dtype.kind in 'iuf':
+        return epoch.astype(np.float64) if epoch.ndim > 0 else float(epoch)
+    return np.array([epoch_to_jd(e) for e in epoch.ravel()]).reshape(epoch.shape)
+
+def round_epoch(jd):
+    """
+    Round julian date to EPOCH_RESOLUTION.
+
+    :param float jd: Julian date.
+    :return: Rounded julian date.
+    :rtype: float
+    """
+    return round(jd/EPOCH_RESOLUTION)*EPOCH_RESOLUTION
+
+@lru_cache(maxsize=64)
+def _fk5_frame_for_jd(jd):
+    return FK5(equinox=Time(jd, format='jd', scale='utc'))
+
+def fk5_frame(epoch=None):
+    """
+    FK5 frame with equinox of date.
+
+    Frames are cached so repeated conversions for the same epoch (to within
+    EPOCH_RESOLUTION) do not have to create new Time and frame objects.
+
+    :param epoch: Equinox - see :func:`epoch_to_jd`.  None for now.
+    :return: Frame.
+    :rtype: FK5
+    """
+    if isinstance(epoch, str) and epoch == 'J2000':
+        return FK5_J2000
+    jd = epoch_to_jd(epoch)
+    if np.ndim(jd) > 0:
+        # per position equinoxes broadcast against the coordinates
+        return FK5(equinox=Time(jd, format='jd', scale='utc'))
+    return _fk5_frame_for_jd(round_epoch(jd))
+
+def precess(pos, to_epoch=None):
+    """
+    Precess a sky coordinate to a new equinox.
+
+    :param SkyCoord pos: Coordinate(s) to precess.
+    :param to_epoch: Equinox to precess to - see :func:`epoch_to_jd`.
+        None for now.
+    :return: Precessed coordinate(s).
+    :rtype: SkyCoord
+    """
+    return pos.transform_to(fk5_frame(to_epoch))
+
+def precess_radec(ra, dec, to_epoch=None, from_epoch='J2000'):
+    """
+    Precess many RA/DEC positions in a single transformation.
+
+    Either epoch can be a single value or an array with one epoch per
+    position.
+
+    :param ndarray ra: RA in degrees.
+    :param ndarray dec: DEC in degrees.
+    :param to_epoch: Equinox to precess to - see :func:`epoch_to_jd`.
+        None for now.
+    :param from_epoch: Equinox of input positions.
+    :return: Precessed RA and DEC in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    pos = SkyCoord(ra=np.asarray(ra, dtype=np.float64)*u.deg,
+                   dec=np.asarray(dec, dtype=np.float64)*u.deg,
+                   frame=fk5_frame(from_epoch))
+    out = precess(pos, to_epoch)
+    return out.ra.degree, out.dec.degree
+
+def j2000_to_jnow(ra, dec, epoch=None):
+    """
+    Precess J2000 RA/DEC positions to equinox of date.
+
+    :param ndarray ra: RA in degrees.
+    :param ndarray dec: DEC in degrees.
+    :param epoch: Date - see :func:`epoch_to_jd`.  None for now.
+    :return: Precessed RA and DEC in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    return precess_radec(ra, dec, to_epoch=epoch, from_epoch='J2000')
+
+def jnow_to_j2000(ra, dec, epoch=None):
+    """
+    Precess RA/DEC positions of date to J2000.
+
+    :param ndarray ra: RA in degrees.
+    :param ndarray dec: DEC in degrees.
+    :param epoch: Date of positions - see :func:`epoch_to_jd`.  None for now.
+    :return: Precessed RA and DEC in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    return precess_radec(ra, dec, to_epoch='J2000', from_epoch=epoch)
+
+def _format_sexagesimal(value, wrap, width, precision, sep, alwayssign):
+    value = np.asarray(value, dtype=np.float64)
+    scalar = value.ndim == 0
+    value = np.atleast_1d(value)
+
+    full = precision is None
+    if full:
+        precision = FULL_PRECISION
+
+    # round once in units of the last digit so carries propagate
+    scale = 10**precision
+    total = np.round(np.abs(value)*3600*scale).astype(np.int64)
+    if wrap is not None:
+        total %= wrap*3600*scale
+    whole, frac = np.divmod(total, scale)
+    lead, rem = np.divmod(whole, 3600)
+    mins, secs = np.divmod(rem, 60)
+
+    out = np.char.zfill(lead.astype(str), width)
+    out = np.char.add(np.char.add(out, sep), np.char.zfill(mins.astype(str), 2))
+    out = np.char.add(np.char.add(out, sep), np.char.zfill(secs.astype(str), 2))
+    if precision > 0:
+        frac = np.char.zfill(frac.astype(str), precision)
+        if full:
+            # only the digits needed like Angle.to_string()
+            frac = np.char.rstrip(frac, '0')
+            out = np.where(frac == '', out, np.char.add(np.char.add(out, '.'), frac))
+        else:
+            out = np.char.add(np.char.add(out, '.'), frac)
+
+    # like Angle.to_string() negative values which round to zero keep the sign
+    negative = value < 0
+    if alwayssign:
+        out = np.char.add(np.where(negative, '-', '+'), out)
+    else:
+        out = np.char.add(np.where(negative, '-', ''), out)
+
+    return str(out[0]) if scalar else out
+
+def format_ra(ra, sep=':', precision=None):
+    """
+    Format RA as hours, minutes and seconds.
+
+    :param ndarray ra: RA in degrees.
+    :param str sep: Separator between fields.
+    :param int precision: Number of decimal places for seconds - None for
+        as many as needed up to FULL_PRECISION like Angle.to_string().
+    :return: Formatted RA(s) like "HH:MM:SS.sss".
+    :rtype: str or ndarray
+    """
+    return _format_sexagesimal(np.mod(ra, 360.0)/15.0, 24, 2,
+                               precision, sep, False)
+
+def format_dec(dec, sep=':', precision=None):
+    """
+    Format DEC as signed degrees, minutes and seconds.
+
+    :param ndarray dec: DEC in degrees.
+    :param str sep: Separator between fields.
+    :param int precision: Number of decimal places for seconds - see
+        :func:`format_ra`.
+    :return: Formatted DEC(s) like "+DD:MM:SS.ss".
+    :rtype: str or ndarray
+    """
+    return _format_sexagesimal(dec, None, 2, precision, sep, True)
+
+def format_radec(pos, sep=':', to_epoch=None, precision=None):
+    """
+    Format sky coordinates, optionally precessing them first.
+
+    :param SkyCoord pos: Coordinate(s) to format.
+    :param str sep: Separator between fields.
+    :param to_epoch: If not None precess to this equinox first - see
+        :func:`epoch_to_jd`.
+    :param int precision: Number of decimal places for seconds - see
+        :func:`format_ra`.
+    :return: Formatted RA(s) and DEC(s).
+    :rtype: (str, str) or (ndarray, ndarray)
+    """
+    if to_epoch is not None:
+        pos = precess(pos, to_epoch)
+    return (format_ra(pos.ra.degree, sep=sep, precision=precision),
+            format_dec(pos.dec.degree, sep=sep, precision=precision))
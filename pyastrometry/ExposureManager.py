@@ -0,0 +1,248 @@
+#
+# camera exposure handling
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def _init_camera_thread():
+    if os.name == 'nt':
+        # ASCOM drivers are COM objects
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pass
+
+class ExposureManager:
+    """
+    Take exposures with a camera and wait for them to complete.
+
+    Instead of checking the camera at a fixed interval the camera is polled
+    rarely early in an exposure and rapidly once the exposure is expected to
+    be done, so completion is noticed within min_poll seconds without
+    hammering the driver for long exposures.
+
+    The camera frame and binning are only set when they change so repeated
+    exposures with the same settings skip the setup.  Exposures can be run
+    on a background thread with :meth:`expose_async` so the next capture
+    can be started while the previous image is being solved.
+
+    :param cam: Camera device from pyastrobackend.
+    :param float min_poll: Shortest time in seconds between exposure checks.
+    :param float max_poll: Longest time in seconds between exposure checks.
+    """
+
+    def __init__(self, cam, min_poll=0.02, max_poll=0.5):
+        """
+        Initialize object.
+
+        """
+        self.cam = cam
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+
+        self._lock = threading.RLock()
+        self._binning = None
+        self._start_time = None
+        self._duration = None
+        self._executor = None
+
+    def configure(self, binning):
+        """
+        Set camera to full sensor frame with binning.
+
+        Nothing is sent to the camera if it is already configured with the
+        same binning.
+
+        :param int binning: Binning for both axes.
+        :return: True on success.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._binning == binning:
+                return True
+
+            try:
+                # reset frame to full sensor
+                self.cam.set_binning(1, 1)
+                result = self.cam.get_size()
+                if not result:
+                    logging.error('ExposureManager: unable to read sensor size')
+                    return False
+                width, height = result
+                self.cam.set_frame(0, 0, width, height)
+
+                # now set desired frame/binning
+                self.cam.set_binning(binning, binning)
+                self.cam.set_frame(0, 0, width/binning, height/binning)
+            except Exception:
+                logging.error('ExposureManager: error configuring camera',
+                              exc_info=True)
+                self._binning = None
+                return False
+
+            logging.debug(f'ExposureManager: sensor {width} x {height} '
+                          f'binning {binning}')
+            self._binning = binning
+            return True
+
+    def invalidate(self):
+        """
+        Forget camera configuration so the next :meth:`configure` sends it
+        to the camera again - use if something else changed the camera
+        settings.
+        """
+        with self._lock:
+            self._binning = None
+
+    def start(self, exposure):
+        """
+        Start an exposure.
+
+        :param float exposure: Exposure length in seconds.
+        :return: True if exposure started.
+        :rtype: bool
+        """
+        with self._lock:
+            try:
+                self.cam.start_exposure(exposure)
+            except Exception:
+                logging.error('ExposureManager: error starting exposure', exc_info=True)
+                return False
+
+            self._start_time = time.monotonic()
+            self._duration = exposure
+            return True
+
+    def elapsed(self):
+        """
+        Time since the current exposure started.
+
+        :return: Seconds since exposure started or None if no exposure.
+        :rtype: float
+        """
+        if self._start_time is None:
+            return None
+        return time.monotonic() - self._start_time
+
+    def next_poll_delay(self):
+        """
+        Time to wait before checking the camera again.
+
+        Half the expected time left in the exposure, then min_poll once the
+        exposure should be done, slowly relaxing towards max_poll if the
+        camera is taking a long time to download the image.
+
+        :return: Delay in seconds.
+        :rtype: float
+        """
+        remaining = self._duration - self.elapsed()
+        if remaining > 0:
+            delay = remaining/2
+        else:
+            delay = self.min_poll - remaining*0.1
+        return min(self.max_poll, max(self.min_poll, delay))
+
+    def wait(self, timeout=None, callback=None):
+        """
+        Wait for the current exposure to complete.
+
+        :param float timeout: Seconds to wait after the exposure should have
+            finished - None waits forever.
+        :param callable callback: Called as callback(elapsed, exposure)
+            between checks of the camera - for example to update a display.
+        :return: True if the exposure completed.
+        :rtype: bool
+        """
+        if self._start_time is None:
+            logging.error('ExposureManager: wait() with no exposure started')
+            return False
+
+        while True:
+            try:
+                with self._lock:
+                    done = self.cam.check_exposure()
+            except Exception:
+                logging.error('ExposureManager: error checking exposure', exc_info=True)
+                return False
+
+            if done:
+                logging.debug(f'ExposureManager: {self._duration} second exposure '
+                              f'complete after {self.elapsed():.3f} seconds')
+                self._start_time = None
+                return True
+
+            if timeout is not None and self.elapsed() > self._duration + timeout:
+                logging.error(f'ExposureManager: exposure not complete '
+                              f'{timeout} seconds after it should have finished')
+                return False
+
+            if callback is not None:
+                callback(min(self.elapsed(), self._duration), self._duration)
+
+            time.sleep(self.next_poll_delay())
+
+    def expose(self, exposure, binning=None, timeout=None, callback=None):
+        """
+        Take an exposure and wait for it to complete.
+
+        :param float exposure: Exposure length in seconds.
+        :param int binning: If not None configure camera binning first.
+        :param float timeout: See :meth:`wait`.
+        :param callable callback: See :meth:`wait`.
+        :return: True if the exposure completed.
+        :rtype: bool
+        """
+        if binning is not None and not self.configure(binning):
+            return False
+        if not self.start(exposure):
+            return False
+        return self.wait(timeout=timeout, callback=callback)
+
+    def expose_async(self, exposure, binning=None, timeout=None):
+        """
+        Take an exposure on a background thread.
+
+        Exposures are run one at a time in the order requested.
+
+        :param float exposure: Exposure length in seconds.
+        :param int binning: If not None configure camera binning first.
+        :param float timeout: See :meth:`wait`.
+        :return: Future whose result is True if the exposure completed.
+        :rtype: Future
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix='Exposure',
+                                                    initializer=_init_camera_thread)
+        return self._executor.submit(self.expose, exposure, binning, timeout)
+
+    def shutdown(self):
+        """
+        Stop background exposure thread after any queued exposures finish.
+        """
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
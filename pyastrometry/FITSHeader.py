@@ -0,0 +1,245 @@
+#
+# fast FITS primary header reader
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+# FITS headers are made of 2880 byte blocks of 80 character cards
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+# header keyword -> ImageHeader attribute
+IMAGE_HEADER_KEYWORDS = {'NAXIS' : 'naxis',
+                         'NAXIS1' : 'width',
+                         'NAXIS2' : 'height',
+                         'XBINNING' : 'bin_x',
+                         'YBINNING' : 'bin_y',
+                         'OBJCTRA' : 'objctra',
+                         'OBJCTDEC' : 'objctdec',
+                         'DATE-OBS' : 'date_obs'}
+
+# attributes which are integers
+_INT_ATTRIBUTES = ['naxis', 'width', 'height', 'bin_x', 'bin_y']
+
+class ImageHeader:
+    """
+    Values from the primary header of an image needed for plate solving.
+
+    Any value not present in the header is None.
+
+    :param int naxis: Number of axes.
+    :param int width: Width of image (NAXIS1).
+    :param int height: Height of image (NAXIS2).
+    :param int bin_x: Binning along X axis (XBINNING).
+    :param int bin_y: Binning along Y axis (YBINNING).
+    :param str objctra: RA of target (OBJCTRA) as "HH MM SS".
+    :param str objctdec: DEC of target (OBJCTDEC) as "+DD MM SS".
+    :param str date_obs: Start of exposure (DATE-OBS).
+    """
+
+    __slots__ = ('naxis', 'width', 'height', 'bin_x', 'bin_y',
+                 'objctra', 'objctdec', 'date_obs', '_radec')
+
+    def __init__(self, naxis=None, width=None, height=None, bin_x=None,
+                 bin_y=None, objctra=None, objctdec=None, date_obs=None):
+        """
+        Create header record.
+
+        """
+        self.naxis = naxis
+        self.width = width
+        self.height = height
+        self.bin_x = bin_x
+        self.bin_y = bin_y
+        self.objctra = objctra
+        self.objctdec = objctdec
+        self.date_obs = date_obs
+        self._radec = None
+
+    def __repr__(self):
+        return f'ImageHeader(naxis={self.naxis}, width={self.width}, ' \
+               f'height={self.height}, bin_x={self.bin_x}, bin_y={self.bin_y}, ' \
+               f'objctra={self.objctra!r}, objctdec={self.objctdec!r}, ' \
+               f'date_obs={self.date_obs!r})'
+
+    @classmethod
+    def from_header(cls, header):
+        """
+        Create record from an astropy FITS header.
+
+        :param Header header: FITS header.
+        :return: Header record.
+        :rtype: ImageHeader
+        """
+        info = cls()
+        for key, attr in IMAGE_HEADER_KEYWORDS.items():
+            if key in header:
+                info._set(attr, header[key])
+        return info
+
+    def _set(self, attr, value):
+        if attr in _INT_ATTRIBUTES:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                logging.error(f'ImageHeader: invalid value {value!r} for {attr}')
+                value = None
+        elif value is not None:
+            value = str(value)
+        setattr(self, attr, value)
+
+    @property
+    def radec(self):
+        """
+        Target position from OBJCTRA/OBJCTDEC - assumes J2000.
+
+        :return: Position or None if not in header or invalid.
+        :rtype: SkyCoord
+        """
+        if self._radec is None and self.objctra is not None and \
+           self.objctdec is not None:
+            try:
+                self._radec = SkyCoord(self.objctra + ' ' + self.objctdec,
+                                       frame='fk5', unit=(u.hourangle, u.deg),
+                                       equinox='J2000')
+            except Exception as err:
+                logging.error(f'ImageHeader: invalid position {self.objctra} '
+                              f'{self.objctdec} - {err}')
+        return self._radec
+
+    def image_info(self):
+        """
+        Image size and binning.
+
+        :return: Width, height, X binning and Y binning or None if any
+            are missing.
+        :rtype: (int, int, int, int)
+        """
+        retval = (self.width, self.height, self.bin_x, self.bin_y)
+        if None in retval:
+            return None
+        return retval
+
+def parse_card_value(card):
+    """
+    Parse value of a FITS header card.
+
+    :param str card: 80 character header card.
+    :return: Value as str, int, float or bool or None if card has no value.
+    """
+    if card[8:10] != '= ':
+        return None
+
+    field = card[10:].strip()
+    if field.startswith("'"):
+        # quotes inside string are doubled
+        value = ''
+        i = 1
+        while i < len(field):
+            if field[i] == "'":
+                if field[i+1:i+2] == "'":
+                    value += "'"
+                    i += 2
+                    continue
+                break
+            value += field[i]
+            i += 1
+        return value.rstrip()
+
+    field = field.split('/', 1)[0].strip()
+    if field == 'T':
+        return True
+    if field == 'F':
+        return False
+    try:
+        return int(field)
+    except ValueError:
+        pass
+    try:
+        return float(field.replace('D', 'E'))
+    except ValueError:
+        return None
+
+def _iter_header_cards(f):
+    # yields cards of primary header up to END - raises EOFError if the
+    # header is truncated
+    while True:
+        block = f.read(FITS_BLOCK_SIZE)
+        if len(block) < FITS_BLOCK_SIZE:
+            raise EOFError('no END card')
+
+        block = block.decode('ascii', errors='replace')
+        for i in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+            card = block[i:i+FITS_CARD_SIZE]
+            if card[:8].rstrip() == 'END':
+                return
+            yield card
+
+def read_image_header(fname):
+    """
+    Read the values needed for plate solving from the primary header of a
+    FITS file in a single pass.
+
+    Only the header blocks are read - the pixel data is not touched.
+
+    :param str fname: Name of FITS file.
+    :return: Header record or None if file could not be read.
+    :rtype: ImageHeader
+    """
+    info = ImageHeader()
+    try:
+        with open(fname, 'rb') as f:
+            for card in _iter_header_cards(f):
+                attr = IMAGE_HEADER_KEYWORDS.get(card[:8].rstrip())
+                if attr is not None:
+                    info._set(attr, parse_card_value(card))
+    except EOFError:
+        logging.error(f'read_image_header: {fname} has no END card')
+        return None
+    except OSError as err:
+        logging.error(f'read_image_header: error opening {fname} - {err}')
+        return None
+
+    logging.debug(f'read_image_header: {info}')
+    return info
+
+def read_header(fname):
+    """
+    Read all keyword values from the primary header of a FITS file.
+
+    Like :func:`read_image_header` only the header blocks are read so this
+    is cheap for small files such as the .wcs files from solve-field.
+
+    :param str fname: Name of FITS file.
+    :return: Keyword -> value or None if file could not be read or the
+        header is incomplete (for example still being written).
+    :rtype: dict
+    """
+    header = {}
+    try:
+        with open(fname, 'rb') as f:
+            for card in _iter_header_cards(f):
+                value = parse_card_value(card)
+                if value is not None:
+                    header[card[:8].rstrip()] = value
+    except (OSError, EOFError) as err:
+        logging.debug(f'read_header: unable to read {fname} - {err}')
+        return None
+    return header
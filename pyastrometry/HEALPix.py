@@ -0,0 +1,201 @@
+#
+# HEALPix pixel indexing
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import numpy as np
+
+# ring and longitude of the corner of each base pixel used to find centers
+_JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+_JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+def npix(nside):
+    """
+    Number of HEALPix pixels.
+
+    :param int nside: HEALPix resolution (power of 2).
+    :return: Number of pixels covering the sphere.
+    :rtype: int
+    """
+    return 12*nside*nside
+
+def pixel_size(nside):
+    """
+    Approximate size of a HEALPix pixel.
+
+    :param int nside: HEALPix resolution (power of 2).
+    :return: Square root of pixel area in degrees.
+    :rtype: float
+    """
+    return math.degrees(math.sqrt(4*math.pi/npix(nside)))
+
+def max_pixel_radius(nside):
+    """
+    Largest angular distance from the center of a HEALPix pixel to any of
+    its corners.
+
+    :param int nside: HEALPix resolution (power of 2).
+    :return: Radius in degrees.
+    :rtype: float
+    """
+    # distance between corners of the pixel at the ring where the polar
+    # caps meet the equatorial region, which has the largest pixels
+    t1 = (1 - 1/nside)**2
+    za = 2/3
+    zb = 1 - t1/3
+    phia = math.pi/(4*nside)
+    cos_ab = za*zb + math.sqrt((1 - za*za)*(1 - zb*zb))*math.cos(phia)
+    return math.degrees(math.acos(min(1.0, cos_ab)))
+
+def _spread_bits(v, nbits):
+    # move bit i of v to bit 2*i
+    out = np.zeros_like(v)
+    for i in range(nbits):
+        out |= ((v >> i) & 1) << (2*i)
+    return out
+
+def _compress_bits(v, nbits):
+    # move bit 2*i of v to bit i
+    out = np.zeros_like(v)
+    for i in range(nbits):
+        out |= ((v >> (2*i)) & 1) << i
+    return out
+
+def pix2ang_nest(nside, pix):
+    """
+    Find center of HEALPix pixels (NESTED ordering).
+
+    :param int nside: HEALPix resolution (power of 2).
+    :param ndarray pix: Pixel indices.
+    :return: RA (0 to 360) and DEC of pixel centers in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    pix = np.atleast_1d(np.asarray(pix, dtype=np.int64))
+
+    nbits = int(math.log2(nside))
+    face = pix // (nside*nside)
+    ipf = pix % (nside*nside)
+    ix = _compress_bits(ipf, nbits)
+    iy = _compress_bits(ipf >> 1, nbits)
+
+    jr = _JRLL[face]*nside - ix - iy - 1
+    north = jr < nside
+    south = jr > 3*nside
+    nr = np.where(north, jr, np.where(south, 4*nside - jr, nside))
+    z = np.where(north, 1 - nr*nr/(3*nside*nside),
+                 np.where(south, nr*nr/(3*nside*nside) - 1,
+                          (2*nside - jr)*2/(3*nside)))
+    kshift = np.where(north | south, 0, (jr - nside) & 1)
+
+    jp = (_JPLL[face]*nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4*nside, jp - 4*nside, jp)
+    jp = np.where(jp < 1, jp + 4*nside, jp)
+    phi = (jp - (kshift + 1)*0.5)*(math.pi/2/nr)
+
+    return np.degrees(phi) % 360.0, np.degrees(np.arcsin(np.clip(z, -1, 1)))
+
+def ang2pix_nest(nside, ra, dec):
+    """
+    Find HEALPix pixel (NESTED ordering) containing sky positions.
+
+    :param int nside: HEALPix resolution (power of 2).
+    :param ndarray ra: RA of positions in degrees.
+    :param ndarray dec: DEC of positions in degrees.
+    :return: Pixel index of each position.
+    :rtype: ndarray
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=np.float64))
+    dec = np.atleast_1d(np.asarray(dec, dtype=np.float64))
+
+    z = np.sin(np.radians(dec))
+    za = np.abs(z)
+    tt = np.mod(np.radians(ra), 2*np.pi)*(2/np.pi)
+
+    # equatorial region
+    temp1 = nside*(0.5 + tt)
+    temp2 = nside*z*0.75
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp = jp // nside
+    ifm = jm // nside
+    face_eq = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix_eq = jm & (nside - 1)
+    iy_eq = nside - (jp & (nside - 1)) - 1
+
+    # polar caps
+    ntt = np.minimum(tt.astype(np.int64), 3)
+    tp = tt - ntt
+    tmp = nside*np.sqrt(3*(1 - za))
+    jp_p = np.minimum((tp*tmp).astype(np.int64), nside - 1)
+    jm_p = np.minimum(((1 - tp)*tmp).astype(np.int64), nside - 1)
+    north = z >= 0
+    face_p = np.where(north, ntt, ntt + 8)
+    ix_p = np.where(north, nside - jm_p - 1, jp_p)
+    iy_p = np.where(north, nside - jp_p - 1, jm_p)
+
+    equatorial = za <= 2/3
+    face = np.where(equatorial, face_eq, face_p)
+    ix = np.where(equatorial, ix_eq, ix_p)
+    iy = np.where(equatorial, iy_eq, iy_p)
+
+    nbits = int(math.log2(nside))
+    return face*nside*nside + _spread_bits(ix, nbits) + (_spread_bits(iy, nbits) << 1)
+
+def _unit_vectors(ra, dec):
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec*np.cos(ra), cos_dec*np.sin(ra), np.sin(dec)], axis=-1)
+
+def query_disc(nside, ra, dec, radius):
+    """
+    Find HEALPix pixels (NESTED ordering) which overlap a disc.
+
+    Pixels are refined from the 12 base pixels down to nside keeping at
+    each level the pixels whose center is no further from the disc center
+    than the radius plus the largest pixel radius at that level.  The
+    result can include a few pixels just outside the disc but never misses
+    one overlapping it, including near the poles and RA 0/360.
+
+    :param int nside: HEALPix resolution (power of 2).
+    :param float ra: RA of disc center in degrees.
+    :param float dec: DEC of disc center in degrees.
+    :param float radius: Radius of disc in degrees.
+    :return: Sorted pixel indices.
+    :rtype: ndarray
+    """
+    center = _unit_vectors(ra, dec)
+
+    pix = np.arange(12, dtype=np.int64)
+    level = 1
+    while True:
+        reach = radius + max_pixel_radius(level)
+        if reach < 180:
+            # small tolerance so pixels exactly at the limit are kept
+            min_cos = math.cos(math.radians(reach)) - 1e-12
+            pix_ra, pix_dec = pix2ang_nest(level, pix)
+            pix = pix[_unit_vectors(pix_ra, pix_dec) @ center >= min_cos]
+
+        if level >= nside:
+            break
+
+        # children of a NESTED pixel are numbered 4*pixel + 0..3
+        pix = (pix[:, None]*4 + np.arange(4)).ravel()
+        level *= 2
+
+    return pix
@@ -0,0 +1,136 @@
+#
+# shrink images before sending them to a plate solver
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import io
+import logging
+import numpy as np
+import astropy.io.fits as pyfits
+
+# formats reduced images can be written in
+#
+#   fits  - 16 bit integer FITS
+#   uint8 - 8 bit integer FITS stretched between background and stars
+#   rice  - 16 bit integer FITS with Rice tile compression
+#
+REDUCED_FORMATS = ('fits', 'uint8', 'rice')
+
+def bin_image(data, factor):
+    """
+    Average blocks of factor x factor pixels.
+
+    Rows and columns which do not fill a whole block are trimmed evenly
+    from both sides so the center of the binned image is within half an
+    original pixel of the center of the original image.
+
+    :param ndarray data: 2D image data.
+    :param int factor: Binning factor.
+    :return: Binned image.
+    :rtype: ndarray (float32)
+    """
+    if factor <= 1:
+        return np.asarray(data, dtype=np.float32)
+
+    height, width = data.shape
+    bh = height // factor
+    bw = width // factor
+    y0 = (height - bh*factor) // 2
+    x0 = (width - bw*factor) // 2
+    blocks = data[y0:y0 + bh*factor, x0:x0 + bw*factor].reshape(bh, factor, bw, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+def stretch_to_uint8(data, low_percentile=10.0, high_percentile=99.9):
+    """
+    Linearly stretch image to 8 bits.
+
+    Levels are estimated from a subsample of the image.  Pixels below the
+    low percentile (sky background) become 0 and pixels above the high
+    percentile (star cores) become 255.
+
+    :param ndarray data: 2D image data.
+    :param float low_percentile: Percentile mapped to 0.
+    :param float high_percentile: Percentile mapped to 255.
+    :return: 8 bit image.
+    :rtype: ndarray (uint8)
+    """
+    step = max(1, min(data.shape) // 512)
+    low, high = np.percentile(data[::step, ::step], [low_percentile, high_percentile])
+    if high <= low:
+        high = low + 1
+    scaled = (data - np.float32(low))*np.float32(255.0/(high - low))
+    return np.clip(scaled, 0, 255, out=scaled).astype(np.uint8)
+
+def reduce_image(data, factor=1, fmt='uint8'):
+    """
+    Bin image and encode it as a FITS file in memory.
+
+    :param ndarray data: Image data - only the first plane of a 3D image
+        is used.
+    :param int factor: Binning factor.
+    :param str fmt: One of REDUCED_FORMATS.
+    :return: FITS file positioned at its start.
+    :rtype: BytesIO
+    """
+    if fmt not in REDUCED_FORMATS:
+        raise ValueError(f'reduce_image: unknown format {fmt}')
+
+    if data.ndim > 2:
+        data = data.reshape(-1, *data.shape[-2:])[0]
+    binned = bin_image(data, factor)
+
+    if fmt == 'uint8':
+        hdu = pyfits.PrimaryHDU(stretch_to_uint8(binned))
+        hdus = [hdu]
+    else:
+        # rounding to integers keeps the data compressible
+        out = np.clip(np.rint(binned), 0, 65535).astype(np.uint16)
+        if fmt == 'rice':
+            hdu = pyfits.CompImageHDU(out, compression_type='RICE_1')
+            hdus = [pyfits.PrimaryHDU(), hdu]
+        else:
+            hdu = pyfits.PrimaryHDU(out)
+            hdus = [hdu]
+
+    hdu.header['REDBIN'] = (factor, 'Binning applied before upload')
+    hdu.header['REDW'] = (data.shape[1], 'Width before binning')
+    hdu.header['REDH'] = (data.shape[0], 'Height before binning')
+
+    fileobj = io.BytesIO()
+    pyfits.HDUList(hdus).writeto(fileobj)
+    fileobj.seek(0)
+
+    logging.debug(f'reduce_image: {data.shape[1]} x {data.shape[0]} {data.dtype} '
+                  f'binned {factor} as {fmt} = {fileobj.getbuffer().nbytes} bytes')
+    return fileobj
+
+def reduce_image_file(fname, factor=1, fmt='uint8'):
+    """
+    Read an image file and reduce it - see :func:`reduce_image`.
+
+    :param str fname: FITS image filename.
+    :param int factor: Binning factor.
+    :param str fmt: One of REDUCED_FORMATS.
+    :return: FITS file or None if the image could not be read.
+    :rtype: BytesIO
+    """
+    try:
+        data = pyfits.getdata(fname)
+    except Exception as err:
+        logging.error(f'reduce_image_file: unable to read {fname} - {err}')
+        return None
+    return reduce_image(data, factor=factor, fmt=fmt)
@@ -0,0 +1,417 @@
+#
+# built in plate solver using a local star catalog
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import logging
+import numpy as np
+import astropy.io.fits as pyfits
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import Angle
+
+from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.PlateSolver import PlateSolver
+from pyastrometry.StarExtractor import StarExtractor
+from pyastrometry.TangentPlane import tan_project, tan_deproject
+
+class NativeSolver(PlateSolver):
+    """
+    Plate solver which runs in process and needs a position hint.
+
+    Stars extracted from the image are matched against catalog stars
+    around the hint position.  Triangles are formed from each star and
+    its nearest neighbors and matched using a hash of their shape (the
+    ratios of the sides).  Each matched triangle votes for a rotation and
+    offset and the most popular candidates are verified by counting how
+    many image stars land on catalog stars.  The best candidate is refined
+    with a least squares fit of an affine transform.
+
+    The pixel scale must be known to within scale_tolerance.
+
+    :param StarCatalog catalog: Catalog to match against.
+    :param StarExtractor star_extractor: Used to find stars in images.
+    """
+
+    def __init__(self, catalog, star_extractor=None):
+        """
+        Initialize solver.
+
+        """
+        super().__init__()
+        self.catalog = catalog
+
+        if star_extractor is None:
+            star_extractor = StarExtractor()
+        self.star_extractor = star_extractor
+
+        # number of brightest image stars used to form triangles
+        self.num_image_stars = 30
+
+        # number of neighbors of each star used to form triangles
+        self.num_neighbors = 7
+
+        # most catalog stars used to form triangles
+        self.max_catalog_stars = 2000
+
+        # allowed error in triangle shape (side ratios)
+        self.triangle_tolerance = 0.01
+
+        # allowed fractional error in pixel scale
+        self.scale_tolerance = 0.1
+
+        # max distance in pixels between matched image and catalog stars
+        self.match_radius = 3.0
+
+        # stars which must match for a solution to be accepted
+        self.min_matches = 8
+
+    def solve_file(self, fname, solve_params, search_rad=1.0):
+        """
+        Plate solve the specified file.
+
+        :param str fname: Filename of the file to be solved.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param float search_rad: Number of degrees from hint to search.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        return self.solve_data(pyfits.getdata(fname), solve_params,
+                               search_rad=search_rad)
+
+    def solve_data(self, data, solve_params, search_rad=1.0):
+        """
+        Plate solve image data.
+
+        :param ndarray data: Image data.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param float search_rad: Number of degrees from hint to search.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        if solve_params.radec is None or not solve_params.pixel_scale:
+            logging.error('NativeSolver: need position hint and pixel scale!')
+            return None
+
+        height, width = data.shape[-2:]
+        x, y, flux = self.star_extractor.extract(data)
+        logging.info(f'NativeSolver: extracted {len(x)} stars')
+
+        if len(x) < self.min_matches:
+            logging.error('NativeSolver: not enough stars to solve!')
+            return None
+
+        # work in pixel offsets from image center - catalog positions are
+        # scaled into nominal pixels so tolerances are all in pixels
+        cx = (width - 1)/2
+        cy = (height - 1)/2
+        img_xy = np.column_stack([x - cx, y - cy])
+
+        scale = solve_params.pixel_scale/3600.0
+        ra0 = solve_params.radec.ra.degree
+        dec0 = solve_params.radec.dec.degree
+
+        fov_rad = 0.5*math.hypot(width, height)*scale
+
+        # pick catalog stars so their density roughly matches the image stars
+        nimg = min(len(x), self.num_image_stars)
+        fov_area = width*height*scale**2
+        search_area = math.pi*(search_rad + fov_rad)**2
+        ncat = int(np.clip(1.5*nimg*search_area/fov_area, 2*nimg,
+                           self.max_catalog_stars))
+
+        cat = self.catalog.cone_search(solve_params.radec, search_rad + fov_rad,
+                                       max_stars=ncat)
+        logging.debug(f'NativeSolver: using {nimg} image and {len(cat)} catalog stars')
+
+        if len(cat) < self.min_matches:
+            logging.error('NativeSolver: not enough catalog stars near hint!')
+            return None
+
+        xi, eta = tan_project(cat['ra'], cat['dec'], ra0, dec0)
+        cat_xy = np.column_stack([xi, eta])/scale
+
+        transform = self.find_transform(img_xy[:nimg], cat_xy, img_xy)
+        if transform is None:
+            logging.error('NativeSolver: no match found - solve failed!')
+            return None
+
+        # convert similarity transform to affine in degrees
+        A, B, parity = transform
+        if parity > 0:
+            lin = np.array([[A.real, -A.imag], [A.imag, A.real]])
+        else:
+            lin = np.array([[A.real, A.imag], [A.imag, -A.real]])
+        affine = (lin*scale, np.array([B.real, B.imag])*scale)
+
+        result = self.refine(img_xy, affine, ra0, dec0, fov_rad, scale)
+        if result is None:
+            logging.error('NativeSolver: refinement failed - solve failed!')
+            return None
+
+        center_ra, center_dec, cd, nmatch = result
+
+        # same conventions as solutions from solve-field
+        solved_scale = math.hypot(cd[0][0], cd[1][0])*3600
+        roll_angle_deg = -np.rad2deg(math.atan2(cd[1][0], cd[0][0]))
+
+        logging.info(f'NativeSolver: {nmatch} stars matched')
+        logging.info(f'NativeSolver: scale = {solved_scale:5.3f} '
+                     f'angle = {roll_angle_deg:6.2f}')
+
+        radec = SkyCoord(ra=center_ra*u.degree, dec=center_dec*u.degree,
+                         frame='fk5', equinox='J2000')
+
+        logging.info(f"NativeSolver solved coordinates: "
+                     f"{radec.to_string('hmsdms', sep=':')}")
+        return PlateSolveSolution(radec, pixel_scale=solved_scale,
+                                  angle=Angle(roll_angle_deg*u.degree),
+                                  binning=solve_params.bin_x,
+                                  crval=(center_ra, center_dec),
+                                  crpix=(cx + 1, cy + 1), cd=cd)
+
+    def triangles(self, xy):
+        """
+        Form triangles from each star and pairs of its nearest neighbors.
+
+        The vertices of each triangle are ordered by the length of the
+        opposite side (longest first) so matching triangles have matching
+        vertices.
+
+        :param ndarray xy: Star positions (N x 2).
+        :return: Vertex indices (T x 3), shape invariants (T x 2) and the
+            length of the longest side (T) of each triangle.
+        :rtype: (ndarray, ndarray, ndarray)
+        """
+        nstars = len(xy)
+        k = min(self.num_neighbors, nstars - 1)
+
+        dist = np.hypot(xy[:, None, 0] - xy[None, :, 0],
+                        xy[:, None, 1] - xy[None, :, 1])
+        nbrs = np.argsort(dist, axis=1)[:, 1:k+1]
+
+        jj, ll = np.triu_indices(k, 1)
+        tri = np.column_stack([np.repeat(np.arange(nstars), len(jj)),
+                               nbrs[:, jj].ravel(), nbrs[:, ll].ravel()])
+        tri = np.unique(np.sort(tri, axis=1), axis=0)
+
+        pts = xy[tri]
+        sides = np.column_stack([np.hypot(*(pts[:, 1] - pts[:, 2]).T),
+                                 np.hypot(*(pts[:, 0] - pts[:, 2]).T),
+                                 np.hypot(*(pts[:, 0] - pts[:, 1]).T)])
+
+        order = np.argsort(-sides, axis=1)
+        sides = np.take_along_axis(sides, order, axis=1)
+        tri = np.take_along_axis(tri, order, axis=1)
+
+        a, b, c = sides.T
+        # vertex order is ambiguous for nearly isosceles triangles
+        eps = 3*self.triangle_tolerance
+        ok = (a - b > eps*a) & (b - c > eps*a) & (c > 2*self.match_radius)
+
+        return tri[ok], np.column_stack([b/a, c/a])[ok], a[ok]
+
+    def match_triangles(self, img_inv, img_size, cat_inv, cat_size):
+        """
+        Find image and catalog triangles with the same shape and size.
+
+        The catalog invariants are hashed into a grid of cells the size of
+        the tolerance and each image triangle looks in its cell and the
+        neighboring cells.
+
+        :return: Indices of matching image and catalog triangles.
+        :rtype: (ndarray, ndarray)
+        """
+        tol = self.triangle_tolerance
+        nbins = int(1/tol) + 3
+
+        cat_cells = np.floor(cat_inv/tol).astype(int) + 1
+        cat_keys = cat_cells[:, 0]*nbins + cat_cells[:, 1]
+        order = np.argsort(cat_keys)
+        sorted_keys = cat_keys[order]
+
+        img_cells = np.floor(img_inv/tol).astype(int) + 1
+
+        img_idx = []
+        cat_idx = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = (img_cells[:, 0] + dx)*nbins + img_cells[:, 1] + dy
+                lo = np.searchsorted(sorted_keys, keys, side='left')
+                hi = np.searchsorted(sorted_keys, keys, side='right')
+                cnt = hi - lo
+                starts = np.repeat(lo - np.cumsum(cnt) + cnt, cnt)
+                img_idx.append(np.repeat(np.arange(len(keys)), cnt))
+                cat_idx.append(order[starts + np.arange(cnt.sum())])
+
+        img_idx = np.concatenate(img_idx)
+        cat_idx = np.concatenate(cat_idx)
+
+        ok = np.all(np.abs(img_inv[img_idx] - cat_inv[cat_idx]) < tol, axis=1)
+        ratio = cat_size[cat_idx]/img_size[img_idx]
+        ok &= np.abs(ratio - 1) < self.scale_tolerance
+
+        return img_idx[ok], cat_idx[ok]
+
+    def count_matches(self, pred_xy, cat_xy, radius):
+        """
+        Match predicted star positions to catalog positions.
+
+        :return: Indices of matched predicted and catalog stars.
+        :rtype: (ndarray, ndarray)
+        """
+        d2 = (pred_xy[:, None, 0] - cat_xy[None, :, 0])**2 + \
+             (pred_xy[:, None, 1] - cat_xy[None, :, 1])**2
+        nearest = np.argmin(d2, axis=1)
+        nearest_d2 = d2[np.arange(len(pred_xy)), nearest]
+        close = np.flatnonzero(nearest_d2 < radius**2)
+
+        # each catalog star can only match once - keep closest
+        close = close[np.argsort(nearest_d2[close])]
+        _, first = np.unique(nearest[close], return_index=True)
+        close = close[first]
+
+        return close, nearest[close]
+
+    def find_transform(self, img_xy, cat_xy, all_img_xy):
+        """
+        Find similarity transform from image to catalog positions.
+
+        :param ndarray img_xy: Positions of brightest image stars.
+        :param ndarray cat_xy: Positions of catalog stars.
+        :param ndarray all_img_xy: Positions of all image stars used to
+            verify candidate transforms.
+        :return: Complex scale/rotation, complex offset and parity or None
+            if no transform was found.
+        :rtype: (complex, complex, int)
+        """
+        img_tri, img_inv, img_size = self.triangles(img_xy)
+        cat_tri, cat_inv, cat_size = self.triangles(cat_xy)
+
+        ii, cc = self.match_triangles(img_inv, img_size, cat_inv, cat_size)
+        logging.debug(f'NativeSolver: {len(img_tri)} image and {len(cat_tri)} '
+                      f'catalog triangles - {len(ii)} matches')
+        if len(ii) == 0:
+            return None
+
+        z = img_xy[img_tri[ii]] @ np.array([1, 1j])
+        w = cat_xy[cat_tri[cc]] @ np.array([1, 1j])
+        dw = w - w.mean(axis=1, keepdims=True)
+
+        # least squares fit for both parities and keep the better one
+        fits = []
+        for parity in (1, -1):
+            zp = z if parity > 0 else np.conj(z)
+            dz = zp - zp.mean(axis=1, keepdims=True)
+            A = np.sum(np.conj(dz)*dw, axis=1)/np.sum(np.abs(dz)**2, axis=1)
+            resid = np.sum(np.abs(dw - A[:, None]*dz)**2, axis=1)
+            B = w.mean(axis=1) - A*zp.mean(axis=1)
+            fits.append((A, B, resid))
+
+        use_neg = fits[1][2] < fits[0][2]
+        A = np.where(use_neg, fits[1][0], fits[0][0])
+        B = np.where(use_neg, fits[1][1], fits[0][1])
+        resid = np.minimum(fits[0][2], fits[1][2])
+        parity = np.where(use_neg, -1, 1)
+
+        ok = (np.abs(np.abs(A) - 1) < self.scale_tolerance) & \
+             (resid < 3*self.match_radius**2)
+        if not np.any(ok):
+            return None
+        A, B, parity = A[ok], B[ok], parity[ok]
+
+        # vote for parity, rotation and offset
+        bin_size = 10*self.match_radius
+        keys = np.column_stack([parity,
+                                np.round(np.degrees(np.angle(A))/2),
+                                np.round(B.real/bin_size),
+                                np.round(B.imag/bin_size)]).astype(int)
+        ukeys, inverse, counts = np.unique(keys, axis=0, return_inverse=True,
+                                           return_counts=True)
+        inverse = inverse.ravel()
+
+        best = None
+        best_nmatch = 0
+        for k in np.argsort(-counts)[:10]:
+            members = inverse == k
+            cand_A = np.median(A[members].real) + 1j*np.median(A[members].imag)
+            cand_B = np.median(B[members].real) + 1j*np.median(B[members].imag)
+            cand_parity = ukeys[k][0]
+
+            z_all = all_img_xy @ np.array([1, 1j])
+            if cand_parity < 0:
+                z_all = np.conj(z_all)
+            pred = cand_A*z_all + cand_B
+            pred_xy = np.column_stack([pred.real, pred.imag])
+            matched, _ = self.count_matches(pred_xy, cat_xy, self.match_radius)
+
+            logging.debug(f'NativeSolver: candidate votes={counts[k]} '
+                          f'matches={len(matched)}')
+            if len(matched) > best_nmatch:
+                best_nmatch = len(matched)
+                best = (cand_A, cand_B, cand_parity)
+
+        if best_nmatch < self.min_matches:
+            return None
+
+        return best
+
+    def refine(self, img_xy, affine, ra0, dec0, fov_rad, scale):
+        """
+        Refine transform with a least squares affine fit.
+
+        Each pass re-centers the tangent point on the current solution,
+        matches all image stars against the catalog stars in the field and
+        refits.
+
+        :return: RA/DEC of image center, CD matrix (degrees/pixel) and the
+            number of stars matched, or None if the fit fails.
+        :rtype: (float, float, ndarray, int)
+        """
+        lin, off = affine
+        nmatch = 0
+        for npass in range(3):
+            # move tangent point to current image center
+            ra0, dec0 = tan_deproject(off[0], off[1], ra0, dec0)
+            off = np.zeros(2)
+
+            center = SkyCoord(ra=ra0*u.degree, dec=dec0*u.degree,
+                              frame='fk5', equinox='J2000')
+            cat = self.catalog.cone_search(center, 1.1*fov_rad,
+                                           max_stars=4*len(img_xy))
+            if len(cat) < self.min_matches:
+                return None
+
+            xi, eta = tan_project(cat['ra'], cat['dec'], ra0, dec0)
+            cat_xieta = np.column_stack([xi, eta])
+
+            pred = img_xy @ lin.T + off
+            matched, cat_idx = self.count_matches(pred, cat_xieta,
+                                                  self.match_radius*scale)
+            nmatch = len(matched)
+            if nmatch < self.min_matches:
+                return None
+
+            design = np.column_stack([img_xy[matched], np.ones(nmatch)])
+            coef, _, _, _ = np.linalg.lstsq(design, cat_xieta[cat_idx], rcond=None)
+            lin = coef[:2].T
+            off = coef[2]
+
+        center_ra, center_dec = tan_deproject(off[0], off[1], ra0, dec0)
+
+        return float(center_ra), float(center_dec), lin, nmatch
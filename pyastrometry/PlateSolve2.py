@@ -19,13 +19,13 @@
 #
 import os
 import logging
-import subprocess
 from astropy import units as u
 from astropy.coordinates import Angle
 from astropy.coordinates import SkyCoord
 from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.PlateSolver import PlateSolver
 
-class PlateSolve2:
+class PlateSolve2(PlateSolver):
     """A wrapper of the PlateSolve2 stand alone executable which allows
     plate solving of images.
 
@@ -39,16 +39,20 @@ class PlateSolve2:
     PlateSolve2 or the operation will fail.
 
     :param str exec_path: Path to the astap executable.
+    :param float timeout: Seconds allowed for a solve or None for no limit.
    """
 
-    def __init__(self, exec_path):
+    def __init__(self, exec_path, timeout=None):
         """Initialize object so it is ready to handle solve requests
 
         Parameters
         ----------
         exec_path : str
             Path to the PlateSolve2 executable
+        timeout : float
+            Seconds allowed for a solve or None for no limit
         """
+        super().__init__(timeout=timeout)
         self.exec_path = exec_path
 
         logging.debug(f'PlateSolve2(): set exec path to {self.exec_path}')
@@ -113,16 +117,8 @@ class PlateSolve2:
 
         logging.debug(f'platesolve2 runargs = |{runargs}|')
 
-        with subprocess.Popen(runargs,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    universal_newlines=True) as ps_proc:
-
-            logging.debug('ps2_proc output:')
-            for l in ps_proc.stdout:
-                logging.debug(f'PS2: {l.strip()}')
-            logging.debug('end of output')
+        if not self.run_solver(runargs, 'PS2'):
+            return None
 
 #        poll_value = None
 #        while True:
@@ -17,16 +17,79 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import math
+import logging
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import Angle
+
+from pyastrometry.TangentPlane import tan_project, tan_deproject
+
+# iterations used to invert SIP distortion when the header has no inverse
+# polynomial - converges to well under a millipixel for typical distortion
+SIP_INVERSE_ITERATIONS = 10
+
+def _sip_polynomial(coeffs, u, v):
+    # sum of coeffs[p, q]*u**p*v**q
+    order = coeffs.shape[0] - 1
+    result = np.zeros_like(u)
+    u_pow = np.ones_like(u)
+    for p in range(order + 1):
+        v_pow = np.ones_like(v)
+        for q in range(order + 1 - p):
+            if coeffs[p, q] != 0:
+                result += coeffs[p, q]*u_pow*v_pow
+            v_pow = v_pow*v
+        u_pow = u_pow*u
+    return result
+
+def _sip_from_header(header):
+    # SIP polynomials from a header as {'a': ..., 'b': ..., 'ap': ..., 'bp': ...}
+    sip = {}
+    for name in ('A', 'B', 'AP', 'BP'):
+        order = header.get(f'{name}_ORDER')
+        if order is None:
+            continue
+        order = int(order)
+        coeffs = np.zeros((order + 1, order + 1))
+        for p in range(order + 1):
+            for q in range(order + 1 - p):
+                coeffs[p, q] = float(header.get(f'{name}_{p}_{q}', 0.0))
+        sip[name.lower()] = coeffs
+    if 'a' not in sip or 'b' not in sip:
+        return None
+    return sip
+
 class PlateSolveSolution:
     """
     Stores solution from plate solve engine
 
+    If the solver provides it the linear WCS of the image (CRVAL, CRPIX
+    and CD matrix of a TAN projection) and any SIP distortion polynomials
+    are kept as plain arrays so positions can be converted between pixels
+    and the sky for many points at once with :meth:`pixel_to_sky` and
+    :meth:`sky_to_pixel`.
+
+    Pixel coordinates are 0-indexed like numpy arrays.  CRPIX uses the
+    1-indexed FITS convention as it does in headers.
+
     :param SkyCoord radec: RA/DEC of center of image.
     :param float pixel_scale: Pixel scale in arc-seconds/pixel
     :param Angle angle: Sky roll angle of image.
+    :param int binning: Binning of image.
+    :param ndarray crval: RA/DEC of reference point in degrees.
+    :param ndarray crpix: Pixel of reference point (1-indexed).
+    :param ndarray cd: 2x2 CD matrix in degrees/pixel.
+    :param dict sip: SIP coefficient arrays 'a' and 'b' and optionally the
+        inverse 'ap' and 'bp' - indexed [p, q] for u**p*v**q.
     """
 
-    def __init__(self, radec, pixel_scale, angle, binning):
+    __slots__ = ('radec', 'pixel_scale', 'angle', 'binning',
+                 'crval', 'crpix', 'cd', 'sip', '_cd_inv')
+
+    def __init__(self, radec, pixel_scale, angle, binning,
+                 crval=None, crpix=None, cd=None, sip=None):
         """Create solution object
 
         """
@@ -34,3 +97,156 @@ class PlateSolveSolution:
         self.pixel_scale = pixel_scale
         self.angle = angle
         self.binning = binning
+
+        self.crval = None if crval is None else np.asarray(crval, dtype=np.float64)
+        self.crpix = None if crpix is None else np.asarray(crpix, dtype=np.float64)
+        self.cd = None if cd is None else np.asarray(cd, dtype=np.float64)
+        self.sip = sip
+        self._cd_inv = None
+
+    @classmethod
+    def from_wcs_header(cls, header, binning=None):
+        """
+        Create solution from the WCS in a FITS header.
+
+        The pixel scale and roll angle are derived from the CD matrix (or
+        CDELT/PC if there is no CD) and the center is CRVAL, which is the
+        image center when solve-field is run with --crpix-center.
+
+        :param dict header: FITS header (dict or astropy Header).
+        :param int binning: Binning of image.
+        :return: Solution object.
+        :rtype: PlateSolveSolution
+        """
+        crval = [float(header['CRVAL1']), float(header['CRVAL2'])]
+        crpix = [float(header.get('CRPIX1', 0.0)), float(header.get('CRPIX2', 0.0))]
+
+        if 'CD1_1' in header:
+            cd = [[float(header.get('CD1_1', 0.0)), float(header.get('CD1_2', 0.0))],
+                  [float(header.get('CD2_1', 0.0)), float(header.get('CD2_2', 0.0))]]
+        else:
+            cdelt_1 = float(header.get('CDELT1', 1.0))
+            cdelt_2 = float(header.get('CDELT2', 1.0))
+            cd = [[cdelt_1*float(header.get('PC1_1', 1.0)),
+                   cdelt_1*float(header.get('PC1_2', 0.0))],
+                  [cdelt_2*float(header.get('PC2_1', 0.0)),
+                   cdelt_2*float(header.get('PC2_2', 1.0))]]
+
+        sip = None
+        if str(header.get('CTYPE1', '')).endswith('-SIP'):
+            sip = _sip_from_header(header)
+
+        # pixel scale from length of X axis and angle between North and
+        # the positive Y axis of sensor (positive is CCW)
+        pixel_scale = math.hypot(cd[0][0], cd[1][0])*3600
+        roll_angle_deg = -math.degrees(math.atan2(cd[1][0], cd[0][0]))
+
+        radec = SkyCoord(ra=crval[0]*u.degree, dec=crval[1]*u.degree,
+                         frame='fk5', equinox='J2000')
+        return cls(radec, pixel_scale=pixel_scale, angle=Angle(roll_angle_deg*u.degree),
+                   binning=binning, crval=crval, crpix=crpix, cd=cd, sip=sip)
+
+    @property
+    def has_wcs(self):
+        """
+        True if solution includes a WCS for pixel/sky conversions.
+        """
+        return self.crval is not None and self.crpix is not None and self.cd is not None
+
+    def pixel_to_sky(self, x, y):
+        """
+        Convert pixel positions to sky positions.
+
+        :param ndarray x: X pixel coordinates (0-indexed).
+        :param ndarray y: Y pixel coordinates (0-indexed).
+        :return: RA and DEC (J2000) in degrees or None if solution has no
+            WCS.
+        :rtype: (ndarray, ndarray)
+        """
+        if not self.has_wcs:
+            logging.error('PlateSolveSolution: pixel_to_sky() needs a WCS')
+            return None
+
+        u_pix = np.asarray(x, dtype=np.float64) + 1 - self.crpix[0]
+        v_pix = np.asarray(y, dtype=np.float64) + 1 - self.crpix[1]
+        if self.sip is not None:
+            u_pix, v_pix = (u_pix + _sip_polynomial(self.sip['a'], u_pix, v_pix),
+                            v_pix + _sip_polynomial(self.sip['b'], u_pix, v_pix))
+
+        xi = self.cd[0, 0]*u_pix + self.cd[0, 1]*v_pix
+        eta = self.cd[1, 0]*u_pix + self.cd[1, 1]*v_pix
+        return tan_deproject(xi, eta, self.crval[0], self.crval[1])
+
+    def sky_to_pixel(self, ra, dec):
+        """
+        Convert sky positions to pixel positions.
+
+        :param ndarray ra: RA (J2000) in degrees.
+        :param ndarray dec: DEC (J2000) in degrees.
+        :return: X and Y pixel coordinates (0-indexed) or None if solution
+            has no WCS.
+        :rtype: (ndarray, ndarray)
+        """
+        if not self.has_wcs:
+            logging.error('PlateSolveSolution: sky_to_pixel() needs a WCS')
+            return None
+
+        if self._cd_inv is None:
+            self._cd_inv = np.linalg.inv(self.cd)
+
+        xi, eta = tan_project(ra, dec, self.crval[0], self.crval[1])
+        u_int = self._cd_inv[0, 0]*xi + self._cd_inv[0, 1]*eta
+        v_int = self._cd_inv[1, 0]*xi + self._cd_inv[1, 1]*eta
+
+        if self.sip is None:
+            u_pix, v_pix = u_int, v_int
+        elif 'ap' in self.sip and 'bp' in self.sip:
+            u_pix = u_int + _sip_polynomial(self.sip['ap'], u_int, v_int)
+            v_pix = v_int + _sip_polynomial(self.sip['bp'], u_int, v_int)
+        else:
+            # solve u + A(u, v) = u_int by fixed point iteration
+            u_pix, v_pix = u_int, v_int
+            for _ in range(SIP_INVERSE_ITERATIONS):
+                u_pix, v_pix = (u_int - _sip_polynomial(self.sip['a'], u_pix, v_pix),
+                                v_int - _sip_polynomial(self.sip['b'], u_pix, v_pix))
+
+        return u_pix - 1 + self.crpix[0], v_pix - 1 + self.crpix[1]
+
+    def to_dict(self):
+        """
+        Convert solution to a dictionary of plain python types.
+
+        :return: Dictionary suitable for storing as JSON.
+        :rtype: dict
+        """
+        d = {'ra' : self.radec.ra.degree,
+             'dec' : self.radec.dec.degree,
+             'pixel_scale' : self.pixel_scale,
+             'angle' : self.angle.degree,
+             'binning' : self.binning}
+        if self.has_wcs:
+            d['crval'] = self.crval.tolist()
+            d['crpix'] = self.crpix.tolist()
+            d['cd'] = self.cd.tolist()
+            if self.sip is not None:
+                d['sip'] = {k: v.tolist() for k, v in self.sip.items()}
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Create solution from a dictionary created by to_dict().
+
+        :param dict d: Dictionary containing solution.
+        :return: Solution object.
+        :rtype: PlateSolveSolution
+        """
+        radec = SkyCoord(ra=d['ra']*u.degree, dec=d['dec']*u.degree,
+                         frame='fk5', equinox='J2000')
+        sip = d.get('sip')
+        if sip is not None:
+            sip = {k: np.array(v) for k, v in sip.items()}
+        return cls(radec, pixel_scale=d['pixel_scale'],
+                   angle=Angle(d['angle']*u.degree), binning=d['binning'],
+                   crval=d.get('crval'), crpix=d.get('crpix'), cd=d.get('cd'),
+                   sip=sip)
@@ -0,0 +1,486 @@
+#
+# plate solver base class
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+# job of the solve running in the current thread (if any)
+_current = threading.local()
+
+class SolveJob:
+    """
+    State of a single solve shared between the thread running the solve
+    and the :class:`SolveFuture` returned to the caller.
+
+    :param float timeout: Seconds allowed for the solve or None for no limit.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        Initialize object.
+
+        """
+        self.deadline = None if timeout is None else time.time() + timeout
+        self.timed_out = False
+        self.cancel_event = threading.Event()
+        self._procs = []
+        self._children = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Time left before solve times out.
+
+        :return: Seconds remaining or None if there is no time limit.
+        :rtype: float
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0)
+
+    def add_process(self, proc):
+        """
+        Register a child process so it is killed if the solve is cancelled.
+
+        :param Popen proc: Child process.
+        """
+        with self._lock:
+            self._procs.append(proc)
+            cancelled = self.cancel_event.is_set()
+        if cancelled:
+            kill_process(proc)
+
+    def remove_process(self, proc):
+        """
+        Unregister a child process once it has exited.
+
+        :param Popen proc: Child process.
+        """
+        with self._lock:
+            if proc in self._procs:
+                self._procs.remove(proc)
+
+    def add_child(self, future):
+        """
+        Register a solve started by this solve so it is cancelled with it.
+
+        :param SolveFuture future: Future of the solve.
+        """
+        with self._lock:
+            self._children.append(future)
+            cancelled = self.cancel_event.is_set()
+        if cancelled:
+            future.cancel()
+
+    def cancel(self):
+        """
+        Cancel solve and kill any child processes.
+        """
+        with self._lock:
+            self.cancel_event.set()
+            procs = list(self._procs)
+            children = list(self._children)
+        for proc in procs:
+            kill_process(proc)
+        for future in children:
+            future.cancel()
+
+def current_job():
+    """
+    Job of the solve running in the calling thread.
+
+    :return: Job or None if not called from a solve started with
+        :func:`submit_solve`.
+    :rtype: SolveJob
+    """
+    return getattr(_current, 'job', None)
+
+def kill_process(proc):
+    """
+    Kill a child process started by :meth:`PlateSolver.run_solver` along
+    with any processes it started.
+
+    :param Popen proc: Child process.
+    """
+    if proc.poll() is not None:
+        return
+
+    try:
+        if os.name == 'posix':
+            # solver was started in its own session so kill whole group
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        # already exited
+        pass
+
+class SolveFuture(Future):
+    """
+    Future returned by :meth:`PlateSolver.solve_file_async` and
+    :func:`submit_solve`.
+
+    Unlike other futures a solve can be cancelled while it is running -
+    :meth:`cancel` kills the solver process and the future is marked
+    cancelled immediately.  The result of a solve which failed or timed out
+    is None.
+    """
+
+    def __init__(self, job):
+        """
+        Initialize object.
+
+        """
+        super().__init__()
+        self.job = job
+        self._started = False
+        self._state_lock = threading.RLock()
+
+    def cancel(self):
+        """
+        Cancel the solve and kill the solver process.
+
+        :return: False if the solve had already finished.
+        :rtype: bool
+        """
+        with self._state_lock:
+            if not super().cancel():
+                return False
+            # wake up anything waiting on the future
+            self.set_running_or_notify_cancel()
+        self.job.cancel()
+        return True
+
+    def running(self):
+        """
+        Test if solve is running.
+
+        :return: True if solve has started and not finished.
+        :rtype: bool
+        """
+        return self._started and not self.done()
+
+    def timed_out(self):
+        """
+        Test if solve was stopped because it ran out of time.
+
+        :return: True if solve timed out.
+        :rtype: bool
+        """
+        return self.job.timed_out
+
+    def _finish(self, result=None, exc=None):
+        # future stays pending while running so cancel() can succeed -
+        # only report the result if it was not cancelled meanwhile
+        with self._state_lock:
+            if self.cancelled():
+                return
+            if exc is not None:
+                self.set_exception(exc)
+            else:
+                self.set_result(result)
+
+def submit_solve(fn, *args, timeout=None, **kwargs):
+    """
+    Run a solve function in a new thread.
+
+    Any solver process started with :meth:`PlateSolver.run_solver` while
+    the function runs is killed if the solve is cancelled or takes longer
+    than the timeout.
+
+    When called from inside another solve the new solve is cancelled
+    along with it and is not allowed to run past its deadline.
+
+    :param callable fn: Function returning a PlateSolveSolution or None.
+    :param float timeout: Seconds allowed for the solve or None to use the
+        timeout of each solver.
+    :return: Future for the solve result.
+    :rtype: SolveFuture
+    """
+    parent = current_job()
+    if parent is not None and parent.deadline is not None:
+        remaining = parent.remaining()
+        timeout = remaining if timeout is None else min(timeout, remaining)
+
+    job = SolveJob(timeout)
+    future = SolveFuture(job)
+
+    if parent is not None:
+        parent.add_child(future)
+
+    def run():
+        _current.job = job
+        future._started = True
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logging.error('Solve raised exception', exc_info=True)
+            future._finish(exc=e)
+        else:
+            future._finish(result=result)
+        finally:
+            _current.job = None
+
+    threading.Thread(target=run, daemon=True).start()
+
+    return future
+
+def first_solution(futures, validate=None, timeout=None):
+    """
+    Wait for the first solve to return a valid solution and cancel the
+    others.
+
+    :param list futures: Futures of the solves.
+    :param callable validate: Function called with each solution which
+        returns False if the solution should be ignored.
+    :param float timeout: Seconds to wait or None to wait for all solves
+        to finish.
+    :return: Index of the future which returned the solution and the
+        solution or (None, None) if no valid solution was found.
+    :rtype: (int, PlateSolveSolution)
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    pending = set(futures)
+    winner = None
+
+    try:
+        while winner is None and len(pending) > 0:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            done, pending = wait(pending, timeout=remaining,
+                                 return_when=FIRST_COMPLETED)
+            if len(done) == 0:
+                logging.error('Timed out waiting for solves')
+                break
+
+            # keep order given by caller if several finish together
+            for future in sorted(done, key=futures.index):
+                if future.cancelled() or future.exception() is not None:
+                    continue
+
+                solution = future.result()
+                if solution is None:
+                    continue
+
+                if validate is not None and not validate(solution):
+                    logging.warning(f'Solve {futures.index(future)} returned '
+                                    'invalid solution - ignoring')
+                    continue
+
+                winner = future
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+
+    if winner is None:
+        return None, None
+
+    return futures.index(winner), winner.result()
+
+class PlateSolver:
+    """
+    Base class for plate solvers.
+
+    Subclasses implement :meth:`solve_file` and start any external program
+    with :meth:`run_solver` so it can be timed out and cancelled.
+
+    :param float timeout: Seconds allowed for a solve or None for no limit.
+    """
+
+    # False if solves of the same file can not run at the same time
+    concurrent_solves = True
+
+    def __init__(self, timeout=None):
+        """
+        Initialize object.
+
+        """
+        self.timeout = timeout
+
+    def set_timeout(self, timeout):
+        """
+        Set time allowed for each solve.
+
+        :param float timeout: Seconds allowed for a solve or None for no limit.
+        """
+        self.timeout = timeout
+
+    def solve_file(self, fname, solve_params, **kwargs):
+        """
+        Plate solve the specified file.
+
+        :param str fname: Filename of the file to be solved.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :return: Plate solve solution or None if solve failed.
+        :rtype: PlateSolveSolution
+        """
+        raise NotImplementedError
+
+    def solve_file_async(self, fname, solve_params, timeout=None, **kwargs):
+        """
+        Start solve of the specified file and return without waiting.
+
+        Other keyword arguments are passed to :meth:`solve_file`.
+
+        :param str fname: Filename of the file to be solved.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param float timeout: Seconds allowed for the solve - defaults to
+            the timeout of the solver.
+        :return: Future for the solve result.
+        :rtype: SolveFuture
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return submit_solve(self.solve_file, fname, solve_params,
+                            timeout=timeout, **kwargs)
+
+    def solve_file_tiered(self, fname, solve_params, search_rads,
+                          concurrent=False, **kwargs):
+        """
+        Plate solve the specified file trying progressively larger search
+        radii.
+
+        Solves with a small search radius are much faster so when the
+        position hint is good this is quicker than always searching a large
+        area.  If concurrent is True all of the search radii are tried at
+        once and the first solution found is used.  Other keyword arguments
+        are passed to :meth:`solve_file`.
+
+        :param str fname: Filename of the file to be solved.
+        :param PlateSolveParameters solve_params: Parameters for plate solver.
+        :param list search_rads: Search radii in degrees - smallest first.
+        :param bool concurrent: If True try all search radii at once.
+        :return: Plate solve solution and search radius which solved or
+            (None, None) if all failed.
+        :rtype: (PlateSolveSolution, float)
+        """
+        idx = None
+        solution = None
+        if concurrent and self.concurrent_solves and len(search_rads) > 1:
+            logging.info(f'Trying search radii {search_rads} at once')
+            futures = [submit_solve(self.solve_file, fname, solve_params,
+                                    search_rad=search_rad, **kwargs)
+                       for search_rad in search_rads]
+            idx, solution = first_solution(futures)
+        else:
+            job = current_job()
+            for i, search_rad in enumerate(search_rads):
+                logging.info(f'Trying search radius {search_rad} degrees')
+                solution = self.solve_file(fname, solve_params,
+                                           search_rad=search_rad, **kwargs)
+                if solution is not None:
+                    idx = i
+                    break
+
+                if job is not None and (job.cancel_event.is_set() or
+                                        job.remaining() == 0):
+                    break
+
+        if solution is None:
+            logging.error(f'Solve failed for all search radii {search_rads}')
+            return None, None
+
+        logging.info(f'Solved with search radius {search_rads[idx]} degrees '
+                     f'(tier {idx+1} of {len(search_rads)})')
+        return solution, search_rads[idx]
+
+    def time_remaining(self):
+        """
+        Time left for the current solve.
+
+        :return: Seconds remaining or None if there is no time limit.
+        :rtype: float
+        """
+        job = current_job()
+        if job is not None and job.deadline is not None:
+            return job.remaining()
+        return self.timeout
+
+    def run_solver(self, cmd_args, name):
+        """
+        Run a solver program and log its output.
+
+        The program is killed if it takes longer than the time remaining
+        for the solve or if the solve is cancelled.
+
+        :param cmd_args: Program and arguments as list or command line string.
+        :param str name: Name of program for log messages.
+        :return: True if the program ran to completion.
+        :rtype: bool
+        """
+        job = current_job()
+        if job is not None and job.cancel_event.is_set():
+            logging.info(f'{name} cancelled before starting')
+            return False
+
+        timeout = self.time_remaining()
+
+        try:
+            proc = subprocess.Popen(cmd_args,
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    universal_newlines=True,
+                                    start_new_session=(os.name == 'posix'))
+        except OSError:
+            logging.error(f'Unable to run {name} {cmd_args}', exc_info=True)
+            return False
+
+        if job is not None:
+            job.add_process(proc)
+
+        # read output in a thread so the wait below can time out
+        def log_output():
+            for l in proc.stdout:
+                logging.debug(f'{name}: {l.strip()}')
+
+        reader = threading.Thread(target=log_output, daemon=True)
+        reader.start()
+
+        logging.debug(f'{name} output:')
+        timed_out = False
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logging.error(f'{name} did not finish within {timeout:.1f} seconds '
+                          f'- killing')
+            timed_out = True
+            if job is not None:
+                job.timed_out = True
+            kill_process(proc)
+            proc.wait()
+        finally:
+            if job is not None:
+                job.remove_process(proc)
+
+        reader.join()
+        proc.stdout.close()
+        proc.stdin.close()
+        logging.debug('end of output')
+
+        if job is not None and job.cancel_event.is_set():
+            logging.info(f'{name} cancelled')
+            return False
+
+        return not timed_out
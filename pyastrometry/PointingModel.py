@@ -0,0 +1,343 @@
+#
+# mount pointing error model
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+
+from pyastrometry.Coordinates import jd_now
+
+# geometric terms of the model in the order they are stored
+#
+#   ME - polar axis elevation error
+#   MA - polar axis azimuth error
+#   CH - collimation error
+#   NP - HA/DEC axis non-perpendicularity
+#
+GEOMETRY_TERMS = ('ME', 'MA', 'CH', 'NP')
+
+# pointing samples
+SAMPLE_DTYPE = np.dtype([('time', 'f8'), ('ha', 'f8'), ('dec', 'f8'),
+                         ('dha', 'f8'), ('ddec', 'f8'), ('epoch', 'i4')])
+
+# tan() of declination is limited to this value so positions near the pole
+# do not dominate the fit
+MAX_DEC = 89.0
+
+POINTING_MODEL_VERSION = 1
+
+def local_sidereal_time(longitude, jd=None):
+    """
+    Local mean sidereal time.
+
+    :param float longitude: Site longitude in degrees (east positive).
+    :param float jd: Julian date (UTC) - None for now.
+    :return: Local sidereal time in degrees.
+    :rtype: float
+    """
+    if jd is None:
+        jd = jd_now()
+    gmst = 280.46061837 + 360.98564736629*(jd - 2451545.0)
+    return (gmst + longitude) % 360.0
+
+def geometry_terms(ha, dec):
+    """
+    Partial derivatives of the pointing offset for each geometric term.
+
+    :param ndarray ha: Hour angle in degrees.
+    :param ndarray dec: Declination in degrees.
+    :return: HA and DEC offset columns with one column per term in
+        GEOMETRY_TERMS.
+    :rtype: (ndarray, ndarray)
+    """
+    h = np.radians(np.asarray(ha, dtype=np.float64))
+    d = np.radians(np.clip(np.asarray(dec, dtype=np.float64), -MAX_DEC, MAX_DEC))
+    sin_h = np.sin(h)
+    cos_h = np.cos(h)
+    tan_d = np.tan(d)
+    zero = np.zeros_like(h)
+
+    dha = np.stack([sin_h*tan_d, -cos_h*tan_d, 1/np.cos(d), tan_d], axis=-1)
+    ddec = np.stack([cos_h, sin_h, zero, zero], axis=-1)
+    return dha, ddec
+
+class PointingModel:
+    """
+    Model of the difference between where the mount reports it is pointing
+    and where plate solving shows it is pointing.
+
+    Offsets are the mount position minus the solved position in hour angle
+    and declination.  They are fitted by linear least squares to the
+    classic polar axis, collimation and non-perpendicularity terms plus an
+    index (zero point) offset in each axis.
+
+    Syncing the mount shifts its zero point so every sync starts a new
+    epoch with its own index offsets while the geometric terms are shared.
+    Just after a sync the index offsets are chosen so the model predicts no
+    error at the sync position.
+
+    :param str filename: JSON file to load and save samples - None to keep
+        the model in memory only.
+    :param float max_age: Samples older than this many seconds are dropped.
+    :param int max_samples: Maximum number of samples kept.
+    :param int min_geometry_samples: Fewer samples than this only fit the
+        index offsets - None never fits the geometric terms.
+    """
+
+    def __init__(self, filename=None, max_age=None, max_samples=500,
+                 min_geometry_samples=6):
+        """
+        Create model and load samples if filename exists.
+
+        """
+        self.filename = filename
+        self.max_age = max_age
+        self.max_samples = max_samples
+        self.min_geometry_samples = min_geometry_samples
+
+        self._lock = threading.Lock()
+        self.samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+        self.syncs = {}
+        self.epoch = 0
+
+        self.geometry = np.zeros(len(GEOMETRY_TERMS))
+        self.index = {}
+
+        if filename is not None and os.path.exists(filename):
+            self.load()
+            # mount may have been synced by something else since we last ran
+            self.epoch += 1
+
+    def __len__(self):
+        return len(self.samples)
+
+    def load(self):
+        """
+        Load samples from file.
+
+        :return: True on success.
+        :rtype: bool
+        """
+        try:
+            with open(self.filename) as f:
+                info = json.load(f)
+            if info.get('version') != POINTING_MODEL_VERSION:
+                logging.error(f'PointingModel: {self.filename} has unsupported '
+                              f'version {info.get("version")}')
+                return False
+            rows = [tuple(r) for r in info['samples']]
+            samples = np.array(rows, dtype=SAMPLE_DTYPE) if rows else \
+                      np.zeros(0, dtype=SAMPLE_DTYPE)
+        except Exception:
+            logging.error(f'PointingModel: unable to load {self.filename}',
+                          exc_info=True)
+            return False
+
+        with self._lock:
+            self.samples = samples
+            self.syncs = {int(k): tuple(v) for k, v in info.get('syncs', {}).items()}
+            self.epoch = int(info.get('epoch', 0))
+            self._prune()
+            self._fit()
+
+        logging.debug(f'PointingModel: loaded {len(samples)} samples from '
+                      f'{self.filename}')
+        return True
+
+    def save(self):
+        """
+        Save samples to file.
+
+        :return: True on success.
+        :rtype: bool
+        """
+        if self.filename is None:
+            return True
+
+        with self._lock:
+            info = {'version': POINTING_MODEL_VERSION,
+                    'epoch': self.epoch,
+                    'syncs': {str(k): list(v) for k, v in self.syncs.items()},
+                    'samples': [list(r) for r in self.samples.tolist()]}
+
+        tmp_fname = self.filename + '.tmp'
+        try:
+            with open(tmp_fname, 'w') as f:
+                json.dump(info, f)
+            os.replace(tmp_fname, self.filename)
+        except OSError:
+            logging.error(f'PointingModel: unable to save {self.filename}',
+                          exc_info=True)
+            return False
+        return True
+
+    def clear(self):
+        """
+        Remove all samples.
+        """
+        with self._lock:
+            self.samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+            self.syncs = {}
+            self._fit()
+
+    def add_sample(self, ha, dec, dha, ddec):
+        """
+        Add a measured pointing offset.
+
+        :param float ha: Hour angle reported by mount in degrees.
+        :param float dec: Declination reported by mount in degrees.
+        :param float dha: Reported minus solved hour angle in degrees.
+        :param float ddec: Reported minus solved declination in degrees.
+        """
+        sample = np.array([(time.time(), ha, dec, dha, ddec, self.epoch)],
+                          dtype=SAMPLE_DTYPE)
+        with self._lock:
+            self.samples = np.concatenate([self.samples, sample])
+            self._prune()
+            self._fit()
+
+        logging.debug(f'PointingModel: sample ha={ha:.3f} dec={dec:.3f} '
+                      f'offset={dha*3600:.1f}" {ddec*3600:.1f}" - '
+                      f'{len(self.samples)} samples')
+
+    def add_measurement(self, lst, mount_ra, mount_dec, solved_ra, solved_dec):
+        """
+        Add the offset between the position reported by the mount and the
+        plate solved position.
+
+        :param float lst: Local sidereal time in degrees.
+        :param float mount_ra: RA reported by mount (equinox of date) in degrees.
+        :param float mount_dec: DEC reported by mount (equinox of date) in degrees.
+        :param float solved_ra: Solved RA (equinox of date) in degrees.
+        :param float solved_dec: Solved DEC (equinox of date) in degrees.
+        """
+        # HA increases as RA decreases so mount minus solved HA is solved
+        # minus mount RA
+        dha = (solved_ra - mount_ra + 180.0) % 360.0 - 180.0
+        self.add_sample(lst - mount_ra, mount_dec, dha, mount_dec - solved_dec)
+
+    def add_sync(self, ha, dec):
+        """
+        Record the mount being synced, which starts a new epoch.
+
+        :param float ha: Hour angle of sync position in degrees.
+        :param float dec: Declination of sync position in degrees.
+        """
+        with self._lock:
+            self.epoch += 1
+            self.syncs[self.epoch] = (ha, dec)
+            # only need syncs which epochs with samples or the current epoch use
+            used = set(self.samples['epoch'].tolist()) | {self.epoch}
+            self.syncs = {k: v for k, v in self.syncs.items() if k in used}
+
+    def _prune(self):
+        if self.max_age is not None:
+            keep = self.samples['time'] >= time.time() - self.max_age
+            self.samples = self.samples[keep]
+        if len(self.samples) > self.max_samples:
+            self.samples = self.samples[-self.max_samples:]
+
+    def _fit(self):
+        samples = self.samples
+        self.geometry = np.zeros(len(GEOMETRY_TERMS))
+        self.index = {}
+        if len(samples) == 0:
+            return
+
+        epochs, epoch_idx = np.unique(samples['epoch'], return_inverse=True)
+        nepochs = len(epochs)
+        nsamples = len(samples)
+        use_geometry = self.min_geometry_samples is not None and \
+                       nsamples >= self.min_geometry_samples
+        ngeom = len(GEOMETRY_TERMS) if use_geometry else 0
+
+        # HA rows then DEC rows - columns are geometric terms then HA and
+        # DEC index offsets for each epoch
+        a = np.zeros((2*nsamples, ngeom + 2*nepochs))
+        if use_geometry:
+            geom_ha, geom_dec = geometry_terms(samples['ha'], samples['dec'])
+            a[:nsamples, :ngeom] = geom_ha
+            a[nsamples:, :ngeom] = geom_dec
+        rows = np.arange(nsamples)
+        a[rows, ngeom + 2*epoch_idx] = 1.0
+        a[nsamples + rows, ngeom + 2*epoch_idx + 1] = 1.0
+        b = np.concatenate([samples['dha'], samples['ddec']])
+
+        params = np.linalg.lstsq(a, b, rcond=None)[0]
+        if use_geometry:
+            self.geometry = params[:ngeom]
+        for i, epoch in enumerate(epochs.tolist()):
+            self.index[epoch] = (params[ngeom + 2*i], params[ngeom + 2*i + 1])
+
+        logging.debug(f'PointingModel: geometry '
+                      f'{dict(zip(GEOMETRY_TERMS, (self.geometry*3600).round(1)))} '
+                      f'index {self.index.get(self.epoch)}')
+
+    def _geometry_offset(self, ha, dec):
+        geom_ha, geom_dec = geometry_terms(ha, dec)
+        return geom_ha @ self.geometry, geom_dec @ self.geometry
+
+    def _current_index(self):
+        if self.epoch in self.index:
+            return self.index[self.epoch]
+        if self.epoch in self.syncs:
+            # sync made the offset zero at the sync position
+            dha, ddec = self._geometry_offset(*self.syncs[self.epoch])
+            return -dha, -ddec
+        if len(self.index) > 0:
+            # no sync seen since last epoch with samples
+            return self.index[max(self.index)]
+        return 0.0, 0.0
+
+    def offset(self, ha, dec):
+        """
+        Predicted pointing offset (mount minus true position).
+
+        :param ndarray ha: Hour angle in degrees.
+        :param ndarray dec: Declination in degrees.
+        :return: Predicted HA and DEC offsets in degrees.
+        :rtype: (ndarray, ndarray)
+        """
+        with self._lock:
+            dha, ddec = self._geometry_offset(ha, dec)
+            index_ha, index_dec = self._current_index()
+        return dha + index_ha, ddec + index_dec
+
+    def corrected_position(self, ra, dec, lst):
+        """
+        Position to command the mount to so it points at ra/dec.
+
+        :param float ra: Desired RA (equinox of date) in degrees.
+        :param float dec: Desired DEC (equinox of date) in degrees.
+        :param float lst: Local sidereal time in degrees.
+        :return: RA and DEC to slew to in degrees.
+        :rtype: (float, float)
+        """
+        # offsets are for the position the mount reports so iterate until
+        # the commanded position minus its offset is the desired position
+        cmd_ra, cmd_dec = ra, dec
+        for i in range(3):
+            dha, ddec = self.offset(lst - cmd_ra, cmd_dec)
+            # HA increases as RA decreases
+            cmd_ra = (ra - dha) % 360.0
+            cmd_dec = float(np.clip(dec + ddec, -90.0, 90.0))
+        return cmd_ra, cmd_dec
@@ -0,0 +1,289 @@
+#
+# log of plate solve results
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import logging
+import threading
+import numpy as np
+
+# one fixed size record per solve - strings are stored as a hash which is
+# looked up in the string table
+LOG_DTYPE = np.dtype([('time', '<f8'),
+                      ('file', '<u8'),
+                      ('solver', '<u8'),
+                      ('ra', '<f8'),
+                      ('dec', '<f8'),
+                      ('angle', '<f4'),
+                      ('pixel_scale', '<f4'),
+                      ('binning', '<i2'),
+                      ('solved', '?'),
+                      ('duration', '<f4')])
+
+SOLUTION_LOG_VERSION = 1
+
+def string_key(s):
+    """
+    Key used to store a string in the log.
+
+    :param str s: String.
+    :return: 64 bit hash of string.
+    :rtype: int
+    """
+    digest = hashlib.blake2b(s.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+class SolutionLog:
+    """
+    Append only log of every plate solve stored as columns of numbers.
+
+    Each solve is a fixed size record appended to a binary file which is
+    memory mapped as a numpy structured array for queries, so filtering and
+    aggregating millions of solves is a few vectorized numpy operations.
+    Filenames and solver names are stored as 64 bit hashes in the records
+    and the strings are kept in a separate table - using hashes instead of
+    indices means several processes can append to the same log without
+    coordinating.
+
+    Failed solves are recorded with NaN for the position, angle and scale.
+
+    :param str dirname: Directory holding the log files (created if needed).
+    """
+
+    def __init__(self, dirname):
+        """
+        Open log - no files are created until the first append.
+
+        """
+        self.dirname = dirname
+        self.records_fname = os.path.join(dirname, 'solutions.dat')
+        self.strings_fname = os.path.join(dirname, 'strings.jsonl')
+        self.meta_fname = os.path.join(dirname, 'solutions.json')
+
+        self._lock = threading.Lock()
+        self._meta_checked = False
+        self._strings = {}
+        self._strings_pos = 0
+        self._load_strings()
+
+    def _check_meta(self):
+        # create metadata on first use or check log was written in a
+        # format we understand
+        if self._meta_checked:
+            return
+
+        if os.path.isfile(self.meta_fname):
+            with open(self.meta_fname) as f:
+                meta = json.load(f)
+            try:
+                dtype = np.dtype([tuple(field) for field in meta['dtype']])
+            except (KeyError, TypeError):
+                dtype = None
+            if meta.get('version') != SOLUTION_LOG_VERSION or dtype != LOG_DTYPE:
+                raise ValueError(f'{self.meta_fname} has unsupported format')
+        else:
+            os.makedirs(self.dirname, exist_ok=True)
+            with open(self.meta_fname, 'w') as f:
+                json.dump({'version': SOLUTION_LOG_VERSION,
+                           'dtype': LOG_DTYPE.descr}, f)
+
+        self._meta_checked = True
+
+    def _load_strings(self):
+        # read strings added since last load (possibly by other processes)
+        try:
+            with open(self.strings_fname, 'rb') as f:
+                f.seek(self._strings_pos)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # ignore a partly written last line
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            s = json.loads(line)
+            self._strings[string_key(s)] = s
+        self._strings_pos += end
+
+    def _add_string(self, s):
+        key = string_key(s)
+        if key not in self._strings:
+            with open(self.strings_fname, 'ab') as f:
+                f.write((json.dumps(s) + '\n').encode())
+            self._strings[key] = s
+        return key
+
+    def name(self, key):
+        """
+        Look up a string stored in the log.
+
+        :param int key: Value from the file or solver column.
+        :return: String or None if unknown.
+        :rtype: str
+        """
+        key = int(key)
+        if key not in self._strings:
+            with self._lock:
+                self._load_strings()
+        return self._strings.get(key)
+
+    def names(self, pattern='*'):
+        """
+        Strings in the log which match a glob pattern.
+
+        :param str pattern: Pattern as used by fnmatch.
+        :return: Key -> string for matching strings.
+        :rtype: dict
+        """
+        with self._lock:
+            self._load_strings()
+            return {k: s for k, s in self._strings.items()
+                    if fnmatch.fnmatchcase(s, pattern)}
+
+    def append(self, fname, solver, solution, duration, timestamp=None):
+        """
+        Record a solve.
+
+        :param str fname: Image solved.
+        :param str solver: Solver used.
+        :param PlateSolveSolution solution: Solution or None if solve failed.
+        :param float duration: Seconds the solve took.
+        :param float timestamp: Unix time of solve - None for now.
+        :return: True if record was written.
+        :rtype: bool
+        """
+        rec = np.zeros(1, dtype=LOG_DTYPE)
+        rec['time'] = time.time() if timestamp is None else timestamp
+        rec['duration'] = duration
+        rec['solved'] = solution is not None
+        if solution is not None:
+            rec['ra'] = solution.radec.ra.degree
+            rec['dec'] = solution.radec.dec.degree
+            rec['angle'] = solution.angle.degree
+            rec['pixel_scale'] = solution.pixel_scale
+            rec['binning'] = solution.binning if solution.binning is not None else 0
+        else:
+            rec['ra'] = rec['dec'] = rec['angle'] = rec['pixel_scale'] = np.nan
+
+        try:
+            with self._lock:
+                self._check_meta()
+                rec['file'] = self._add_string(fname)
+                rec['solver'] = self._add_string(solver)
+                # single write of a whole record to a file opened for append
+                # so records from several processes do not interleave
+                with open(self.records_fname, 'ab') as f:
+                    f.write(rec.tobytes())
+        except (OSError, ValueError) as err:
+            logging.error(f'SolutionLog: unable to record solve - {err}')
+            return False
+        return True
+
+    def records(self):
+        """
+        All records in the log.
+
+        :return: Read only memory mapped records in the order written.
+        :rtype: ndarray (LOG_DTYPE)
+        """
+        try:
+            nrec = os.path.getsize(self.records_fname) // LOG_DTYPE.itemsize
+        except OSError:
+            nrec = 0
+        if nrec == 0:
+            return np.zeros(0, dtype=LOG_DTYPE)
+        return np.memmap(self.records_fname, dtype=LOG_DTYPE, mode='r', shape=(nrec,))
+
+    def query(self, since=None, until=None, solver=None, file=None, solved=None):
+        """
+        Select records.
+
+        :param float since: Only records at or after this unix time.
+        :param float until: Only records before this unix time.
+        :param str solver: Only records from this solver.
+        :param str file: Only records for files matching this glob pattern.
+        :param bool solved: If not None only successful (True) or failed
+            (False) solves.
+        :return: Matching records.
+        :rtype: ndarray (LOG_DTYPE)
+        """
+        recs = self.records()
+        mask = np.ones(len(recs), dtype=bool)
+        if since is not None:
+            mask &= recs['time'] >= since
+        if until is not None:
+            mask &= recs['time'] < until
+        if solver is not None:
+            mask &= recs['solver'] == np.uint64(string_key(solver))
+        if file is not None:
+            keys = np.fromiter(self.names(file).keys(), dtype=np.uint64)
+            mask &= np.isin(recs['file'], keys)
+        if solved is not None:
+            mask &= recs['solved'] == solved
+        return np.asarray(recs[mask])
+
+    def summary(self, recs, by='solver'):
+        """
+        Aggregate records into groups.
+
+        :param ndarray recs: Records from :meth:`query`.
+        :param str by: Group by 'solver', 'file' or 'day' (UTC).
+        :return: One dict per group with count, number solved, mean and
+            median duration and median pixel scale of solved records.
+        :rtype: list
+        """
+        if by == 'day':
+            group_keys = (recs['time'] // 86400).astype(np.int64)
+        elif by in ('solver', 'file'):
+            group_keys = recs[by]
+        else:
+            raise ValueError(f'SolutionLog: cannot group by {by}')
+
+        groups, inverse = np.unique(group_keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(groups))
+        solved = np.bincount(inverse, weights=recs['solved'], minlength=len(groups))
+        total_time = np.bincount(inverse, weights=recs['duration'],
+                                 minlength=len(groups))
+
+        # records grouped together so medians are taken over slices
+        order = np.argsort(inverse, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        durations = recs['duration'][order]
+        scales = recs['pixel_scale'][order]
+
+        result = []
+        for i, key in enumerate(groups.tolist()):
+            grp = slice(starts[i], starts[i] + counts[i])
+            grp_scales = scales[grp]
+            grp_scales = grp_scales[~np.isnan(grp_scales)]
+            if by == 'day':
+                name = time.strftime('%Y-%m-%d', time.gmtime(key*86400))
+            else:
+                name = self.name(key)
+            result.append({by: name,
+                           'count': int(counts[i]),
+                           'solved': int(solved[i]),
+                           'mean_duration': float(total_time[i]/counts[i]),
+                           'median_duration': float(np.median(durations[grp])),
+                           'median_pixel_scale': float(np.median(grp_scales))
+                                                 if len(grp_scales) else None})
+        return result
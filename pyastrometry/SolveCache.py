@@ -0,0 +1,201 @@
+#
+# persistent cache of plate solve results
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import numpy as np
+from astropy.io import fits
+
+from pyastrometry.PlateSolveSolution import PlateSolveSolution
+
+# header keywords which change what the solvers search for so they are
+# folded into the image hash along with the pixel data
+HINT_KEYWORDS = ['OBJCTRA', 'OBJCTDEC', 'XBINNING', 'YBINNING']
+
+class SolveCache:
+    """
+    On disk cache of plate solve solutions stored in a SQLite database.
+
+    Entries are keyed by a hash of the image pixel data combined with the
+    solve parameters which affect the result.  When the number of entries
+    exceeds the limit the least recently used entries are evicted.
+
+    :param str filename: Path to the cache database file.
+    :param int max_entries: Maximum number of solutions to keep.
+    """
+
+    def __init__(self, filename, max_entries=100000):
+        """
+        Open (creating if needed) cache database.
+
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS solutions ('
+                             'key TEXT PRIMARY KEY, '
+                             'solution TEXT NOT NULL, '
+                             'last_used REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS solutions_last_used '
+                             'ON solutions (last_used)')
+
+    @staticmethod
+    def hash_image_data(data, header=None):
+        """
+        Compute hash of image pixel data.
+
+        The data is hashed in a canonical big endian layout in blocks of
+        rows so the result does not depend on how the array was created.
+
+        :param ndarray data: Image data.
+        :param Header header: Optional FITS header - position hint and
+            binning keywords are included in the hash.
+        :return: Hex digest of the hash.
+        :rtype: str
+        """
+        hasher = hashlib.sha256()
+
+        data = np.asanyarray(data)
+        hasher.update(f'{data.dtype.str[1:]} {data.shape}'.encode())
+
+        if header is not None:
+            for k in HINT_KEYWORDS:
+                hasher.update(f'{k}={header.get(k, "")};'.encode())
+
+        be_dtype = data.dtype.newbyteorder('>')
+        if data.ndim < 2:
+            hasher.update(np.ascontiguousarray(data, dtype=be_dtype).tobytes())
+        else:
+            nrows = max(1, (4*1024*1024) // max(1, data[0].nbytes))
+            for i in range(0, data.shape[0], nrows):
+                blk = np.ascontiguousarray(data[i:i+nrows], dtype=be_dtype)
+                hasher.update(blk.tobytes())
+
+        return hasher.hexdigest()
+
+    @staticmethod
+    def hash_image_file(fname):
+        """
+        Compute hash of the pixel data in the first HDU of a FITS file which
+        has image data.
+
+        Images in tile compressed or extension HDUs are found the same way
+        solvers read them.  Hint keywords are taken from that HDU falling
+        back to the primary header.
+
+        :param str fname: Name of FITS file.
+        :return: Hex digest of the hash or None if file could not be read or
+            has no image data.
+        :rtype: str
+        """
+        try:
+            with fits.open(fname) as hdulist:
+                for hdu in hdulist:
+                    if not hdu.is_image or hdu.data is None:
+                        continue
+                    header = {k: hdu.header.get(k, hdulist[0].header.get(k, ''))
+                              for k in HINT_KEYWORDS}
+                    return SolveCache.hash_image_data(hdu.data, header=header)
+        except Exception as err:
+            logging.error(f'hash_image_file: error reading {fname} - {err}')
+            return None
+
+        logging.warning(f'hash_image_file: no image data in {fname} - not caching')
+        return None
+
+    @staticmethod
+    def make_key(image_hash, params):
+        """
+        Combine image hash and solve parameters into a cache key.
+
+        :param str image_hash: Hash from hash_image_file()/hash_image_data().
+        :param dict params: Solve parameters which affect the solution.
+        :return: Cache key.
+        :rtype: str
+        """
+        params_str = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256((image_hash + params_str).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Look up solution in cache.
+
+        :param str key: Cache key from make_key().
+        :return: Cached solution or None if not found.
+        :rtype: PlateSolveSolution
+        """
+        with self._lock:
+            row = self._db.execute('SELECT solution FROM solutions WHERE key=?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute('UPDATE solutions SET last_used=? WHERE key=?',
+                                 (time.time(), key))
+
+        try:
+            return PlateSolveSolution.from_dict(json.loads(row[0]))
+        except Exception:
+            logging.error(f'SolveCache: bad entry for key {key}', exc_info=True)
+            return None
+
+    def put(self, key, solution):
+        """
+        Store solution in cache evicting old entries if needed.
+
+        :param str key: Cache key from make_key().
+        :param PlateSolveSolution solution: Solution to store.
+        """
+        sol_str = json.dumps(solution.to_dict())
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO solutions '
+                             '(key, solution, last_used) VALUES (?, ?, ?)',
+                             (key, sol_str, time.time()))
+            nentries = self._db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+            nevict = nentries - self.max_entries
+            if nevict > 0:
+                logging.debug(f'SolveCache: evicting {nevict} entries')
+                self._db.execute('DELETE FROM solutions WHERE key IN '
+                                 '(SELECT key FROM solutions '
+                                 'ORDER BY last_used ASC LIMIT ?)', (nevict,))
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        logging.info(f'SolveCache: clearing {self.filename}')
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM solutions')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def close(self):
+        """
+        Close cache database.
+        """
+        with self._lock:
+            self._db.close()
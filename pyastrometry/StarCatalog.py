@@ -0,0 +1,272 @@
+#
+# local star catalog
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import json
+import logging
+import numpy as np
+
+from pyastrometry.HEALPix import npix, ang2pix_nest, query_disc
+from pyastrometry.TangentPlane import angular_separation
+
+# layout of star records
+STAR_DTYPE = np.dtype([('ra', '<f8'), ('dec', '<f8'), ('mag', '<f4')])
+
+# files making up a catalog directory
+CATALOG_INFO_FILE = 'catalog.json'
+CATALOG_STARS_FILE = 'stars.npy'
+CATALOG_TILES_FILE = 'tiles.npy'
+
+CATALOG_FORMAT = 'pyastrometry-healpix'
+CATALOG_VERSION = 1
+
+class StarCatalog:
+    """
+    Star catalog stored in a directory created by :class:`CatalogBuilder`.
+
+    The sky is divided into HEALPix tiles (NESTED ordering) and the stars
+    are stored in a single memory mapped numpy structured array with fields
+    'ra' and 'dec' (J2000, degrees) and 'mag'.  The stars are grouped by
+    tile and sorted by magnitude within each tile.  An index of where each
+    tile starts in the star array lets a cone search read just the tiles
+    overlapping the search area and just the stars brighter than the
+    magnitude limit within each tile.
+
+    :param str location: Path to the catalog directory.
+    """
+
+    def __init__(self, location):
+        """
+        Load catalog.
+
+        """
+        self.location = location
+
+        with open(os.path.join(location, CATALOG_INFO_FILE)) as f:
+            info = json.load(f)
+
+        if info.get('format') != CATALOG_FORMAT:
+            raise ValueError(f'StarCatalog: {location} is not a star catalog')
+
+        if info.get('version') != CATALOG_VERSION:
+            raise ValueError(f'StarCatalog: {location} has unsupported '
+                             f'version {info.get("version")}')
+
+        self.nside = info['nside']
+        self.stars = np.load(os.path.join(location, CATALOG_STARS_FILE),
+                             mmap_mode='r')
+        self.tiles = np.load(os.path.join(location, CATALOG_TILES_FILE))
+
+        if len(self.tiles) != npix(self.nside) + 1 or \
+           self.tiles[-1] != len(self.stars):
+            raise ValueError(f'StarCatalog: {location} tile index does not '
+                             f'match star data')
+
+        logging.debug(f'StarCatalog: loaded {len(self.stars)} stars in '
+                      f'{npix(self.nside)} tiles from {location}')
+
+    def __len__(self):
+        return len(self.stars)
+
+    def cone_search(self, radec, radius, mag_limit=None, max_stars=None):
+        """
+        Find catalog stars within a radius of a position.
+
+        :param SkyCoord radec: Center of search (J2000).
+        :param float radius: Search radius in degrees.
+        :param float mag_limit: Only return stars brighter than this.
+        :param int max_stars: Only return this many of the brightest stars.
+        :return: Stars found sorted by magnitude (brightest first).
+        :rtype: ndarray
+        """
+        ra0 = radec.ra.degree
+        dec0 = radec.dec.degree
+
+        def inside(stars):
+            # cheap declination cut before computing separations
+            stars = np.asarray(stars)
+            stars = stars[np.abs(stars['dec'] - dec0) <= radius]
+            sep = angular_separation(ra0, dec0, stars['ra'], stars['dec'])
+            return stars[sep <= radius]
+
+        chunks = []
+        for tile in query_disc(self.nside, ra0, dec0, radius):
+            start = self.tiles[tile]
+            end = self.tiles[tile+1]
+            if start == end:
+                continue
+
+            if mag_limit is not None:
+                end = start + np.searchsorted(self.stars['mag'][start:end],
+                                              mag_limit, side='right')
+
+            if max_stars is None:
+                chunks.append(inside(self.stars[start:end]))
+                continue
+
+            # stars in a tile are brightest first so only read until
+            # max_stars of them are inside the search area
+            nfound = 0
+            pos = start
+            while pos < end and nfound < max_stars:
+                stop = min(end, pos + max(max_stars, pos - start))
+                chunk = inside(self.stars[pos:stop])
+                chunks.append(chunk)
+                nfound += len(chunk)
+                pos = stop
+
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=STAR_DTYPE)
+
+        found = np.concatenate(chunks)
+        return found[np.argsort(found['mag'], kind='stable')][:max_stars]
+
+class CatalogBuilder:
+    """
+    Create a star catalog directory for :class:`StarCatalog`.
+
+    Stars are added in chunks with :meth:`add` and written to a temporary
+    file so catalogs larger than memory can be converted.  :meth:`finish`
+    sorts the stars by tile and magnitude and writes the catalog.
+
+    :param str location: Path of catalog directory to create.
+    :param int nside: HEALPix resolution (power of 2) for tiles.
+    :param int block_size: Number of stars written at a time.
+    """
+
+    def __init__(self, location, nside=64, block_size=1000000):
+        """
+        Initialize object.
+
+        """
+        if nside < 1 or nside & (nside - 1) != 0:
+            raise ValueError(f'CatalogBuilder: nside {nside} must be a power of 2')
+
+        self.location = location
+        self.nside = nside
+        self.block_size = block_size
+        self.nstars = 0
+
+        os.makedirs(location, exist_ok=True)
+        self._stars_tmp = os.path.join(location, 'stars.tmp')
+        self._tiles_tmp = os.path.join(location, 'tiles.tmp')
+        self._stars_f = open(self._stars_tmp, 'wb')
+        self._tiles_f = open(self._tiles_tmp, 'wb')
+
+    def add(self, ra, dec, mag):
+        """
+        Add stars to catalog.
+
+        :param ndarray ra: RA of stars (J2000) in degrees.
+        :param ndarray dec: DEC of stars (J2000) in degrees.
+        :param ndarray mag: Magnitude of stars.
+        """
+        stars = np.zeros(len(ra), dtype=STAR_DTYPE)
+        stars['ra'] = np.mod(ra, 360.0)
+        stars['dec'] = dec
+        stars['mag'] = mag
+
+        tiles = ang2pix_nest(self.nside, stars['ra'], stars['dec']).astype('<i4')
+
+        stars.tofile(self._stars_f)
+        tiles.tofile(self._tiles_f)
+        self.nstars += len(stars)
+
+    def finish(self):
+        """
+        Sort stars and write catalog files.
+
+        Stars are sorted in three passes over the staged files so only
+        block_size stars (or one tile if larger) are held in memory: the
+        stars in each tile are counted, each block of stars is scattered to
+        the range of its tiles in the catalog and finally each group of
+        tiles is sorted by magnitude in place.
+        """
+        self._stars_f.close()
+        self._tiles_f.close()
+
+        ntiles = npix(self.nside)
+        if self.nstars > 0:
+            raw = np.memmap(self._stars_tmp, dtype=STAR_DTYPE, mode='r',
+                            shape=(self.nstars,))
+            tiles = np.memmap(self._tiles_tmp, dtype='<i4', mode='r',
+                              shape=(self.nstars,))
+        else:
+            raw = np.zeros(0, dtype=STAR_DTYPE)
+            tiles = np.zeros(0, dtype='<i4')
+
+        blocks = [(start, min(start + self.block_size, self.nstars))
+                  for start in range(0, self.nstars, self.block_size)]
+
+        counts = np.zeros(ntiles, dtype=np.int64)
+        for start, end in blocks:
+            counts += np.bincount(tiles[start:end], minlength=ntiles)
+
+        offsets = np.zeros(ntiles + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        stars = np.lib.format.open_memmap(os.path.join(self.location,
+                                                       CATALOG_STARS_FILE),
+                                          mode='w+', dtype=STAR_DTYPE,
+                                          shape=(self.nstars,))
+
+        logging.info(f'CatalogBuilder: grouping {self.nstars} stars by tile')
+        next_pos = offsets[:-1].copy()
+        for start, end in blocks:
+            block_tiles = np.asarray(tiles[start:end])
+            order = np.argsort(block_tiles, kind='stable')
+            sorted_tiles = block_tiles[order]
+            # position of each star within the stars of its tile in block
+            first = np.searchsorted(sorted_tiles, sorted_tiles, side='left')
+            dest = next_pos[sorted_tiles] + np.arange(len(order)) - first
+            stars[dest] = raw[start:end][order]
+            next_pos += np.bincount(block_tiles, minlength=ntiles)
+        del raw, tiles
+
+        logging.info('CatalogBuilder: sorting tiles by magnitude')
+        tile = 0
+        while tile < ntiles:
+            # as many whole tiles as fit in a block
+            last = np.searchsorted(offsets, offsets[tile] + self.block_size,
+                                   side='right') - 1
+            last = min(max(last, tile + 1), ntiles)
+            start = offsets[tile]
+            end = offsets[last]
+            if end > start:
+                block = np.array(stars[start:end])
+                block_tiles = np.repeat(np.arange(tile, last), counts[tile:last])
+                stars[start:end] = block[np.lexsort((block['mag'], block_tiles))]
+            tile = last
+        stars.flush()
+        del stars
+
+        np.save(os.path.join(self.location, CATALOG_TILES_FILE), offsets)
+
+        info = {'format': CATALOG_FORMAT,
+                'version': CATALOG_VERSION,
+                'nside': self.nside,
+                'order': 'nested',
+                'nstars': self.nstars}
+        with open(os.path.join(self.location, CATALOG_INFO_FILE), 'w') as f:
+            json.dump(info, f, indent=4)
+
+        os.unlink(self._stars_tmp)
+        os.unlink(self._tiles_tmp)
+
+        logging.info(f'CatalogBuilder: wrote {self.nstars} stars to {self.location}')
@@ -0,0 +1,242 @@
+#
+# star extraction
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import numpy as np
+import astropy.io.fits as pyfits
+
+class StarExtractor:
+    """
+    Finds stars in an image using only numpy operations.
+
+    The background and noise level are estimated with medians over a grid
+    of tiles, pixels above the detection threshold are grouped into
+    connected components and each component is centroided.
+
+    :param float sigma: Detection threshold in units of background noise.
+    :param int tile_size: Size in pixels of tiles for background estimation.
+    :param int min_pixels: Minimum number of pixels in a star.
+    :param int max_pixels: Maximum number of pixels in a star (None for no limit).
+    :param int max_stars: Maximum number of stars returned (brightest first).
+    """
+
+    def __init__(self, sigma=5.0, tile_size=64, min_pixels=3, max_pixels=None,
+                 max_stars=500):
+        """
+        Create star extractor.
+
+        """
+        self.sigma = sigma
+        self.tile_size = tile_size
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.max_stars = max_stars
+
+        # background is estimated from every Nth pixel in each direction
+        self.sample_step = 4
+
+        # if more than this fraction of the image is above threshold
+        # (nebula, clouds, moonlight) raise the threshold
+        self.max_mask_fraction = 0.02
+
+    def estimate_background(self, data):
+        """
+        Estimate background level and noise on a grid of tiles.
+
+        :param ndarray data: 2D image data.
+        :return: Background and noise for each tile along with the tile
+            size in pixels along y and x.
+        :rtype: (ndarray, ndarray, int, int)
+        """
+        step = self.sample_step
+        sub = data[::step, ::step]
+        sub_h, sub_w = sub.shape
+
+        ts = max(1, self.tile_size // step)
+        tsy = min(ts, sub_h)
+        tsx = min(ts, sub_w)
+        ny = sub_h // tsy
+        nx = sub_w // tsx
+
+        tiles = sub[:ny*tsy, :nx*tsx].reshape(ny, tsy, nx, tsx)
+        tiles = tiles.transpose(0, 2, 1, 3).reshape(ny, nx, tsy*tsx)
+
+        bkg = np.median(tiles, axis=2)
+        noise = 1.4826*np.median(np.abs(tiles - bkg[:, :, None]), axis=2)
+
+        # keep tiles which are mostly a bright object from setting noise to 0
+        noise = np.maximum(noise, max(np.median(noise), 1e-6)*0.5)
+
+        return bkg, noise, tsy*step, tsx*step
+
+    def threshold_mask_indices(self, data, thresh, tile_y, tile_x):
+        """
+        Find pixels above threshold.
+
+        :param ndarray data: 2D image data.
+        :param ndarray thresh: Threshold for each background tile.
+        :param int tile_y: Height of tiles in pixels.
+        :param int tile_x: Width of tiles in pixels.
+        :return: Sorted flat indices of pixels above threshold.
+        :rtype: ndarray
+        """
+        height, width = data.shape
+        ny, nx = thresh.shape
+        col_tile = np.minimum(np.arange(width) // tile_x, nx - 1)
+
+        indices = []
+        for i in range(ny):
+            row_start = i*tile_y
+            row_end = height if i == ny - 1 else (i + 1)*tile_y
+            band = data[row_start:row_end]
+            indices.append(np.flatnonzero(band > thresh[i][col_tile]) + row_start*width)
+
+        return np.concatenate(indices)
+
+    @staticmethod
+    def label_components(idx, width):
+        """
+        Group pixels into 8-connected components.
+
+        :param ndarray idx: Sorted flat indices of pixels.
+        :param int width: Width of image.
+        :return: Component label for each pixel.
+        :rtype: ndarray
+        """
+        npix = len(idx)
+        cols = idx % width
+
+        # only need to look forward - right, down left, down and down right
+        edges_i = []
+        edges_j = []
+        for offset, colok in [(1, cols != width - 1),
+                              (width - 1, cols != 0),
+                              (width, None),
+                              (width + 1, cols != width - 1)]:
+            cand = idx + offset
+            pos = np.minimum(np.searchsorted(idx, cand), npix - 1)
+            valid = idx[pos] == cand
+            if colok is not None:
+                valid &= colok
+            edges_i.append(np.flatnonzero(valid))
+            edges_j.append(pos[valid])
+
+        ei = np.concatenate(edges_i)
+        ej = np.concatenate(edges_j)
+
+        # propagate minimum label across edges with pointer jumping
+        labels = np.arange(npix)
+        while True:
+            lo = np.minimum(labels[ei], labels[ej])
+            new_labels = labels.copy()
+            np.minimum.at(new_labels, ei, lo)
+            np.minimum.at(new_labels, ej, lo)
+            new_labels = new_labels[new_labels]
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+
+        return labels
+
+    def extract(self, data):
+        """
+        Find stars in image.
+
+        Coordinates are 0-indexed with (0, 0) at the center of the first
+        pixel.
+
+        :param ndarray data: Image data (2D or a stack of color planes).
+        :return: x, y and background subtracted flux of stars sorted
+            brightest first.
+        :rtype: (ndarray, ndarray, ndarray)
+        """
+        data = np.asarray(data)
+        if data.ndim == 3:
+            data = data.sum(axis=0, dtype=np.float32)
+        data = data.astype(np.float32, copy=False)
+
+        height, width = data.shape
+
+        bkg, noise, tile_y, tile_x = self.estimate_background(data)
+
+        sigma = self.sigma
+        while True:
+            idx = self.threshold_mask_indices(data, bkg + sigma*noise, tile_y, tile_x)
+            if len(idx) <= self.max_mask_fraction*data.size:
+                break
+            logging.debug(f'StarExtractor: {len(idx)} pixels above {sigma} sigma '
+                          '- raising threshold')
+            sigma *= 1.5
+
+        logging.debug(f'StarExtractor: {len(idx)} pixels above {sigma} sigma')
+
+        if len(idx) == 0:
+            empty = np.zeros(0)
+            return empty, empty, empty
+
+        rows = idx // width
+        cols = idx % width
+
+        ty = np.minimum(rows // tile_y, bkg.shape[0] - 1)
+        tx = np.minimum(cols // tile_x, bkg.shape[1] - 1)
+        vals = data.ravel()[idx] - bkg[ty, tx]
+
+        labels = self.label_components(idx, width)
+        _, comp = np.unique(labels, return_inverse=True)
+
+        npix = np.bincount(comp)
+        flux = np.bincount(comp, weights=vals)
+        x = np.bincount(comp, weights=vals*cols)/flux
+        y = np.bincount(comp, weights=vals*rows)/flux
+
+        keep = npix >= self.min_pixels
+        if self.max_pixels is not None:
+            keep &= npix <= self.max_pixels
+        x, y, flux = x[keep], y[keep], flux[keep]
+
+        order = np.argsort(flux)[::-1][:self.max_stars]
+
+        logging.debug(f'StarExtractor: found {np.count_nonzero(keep)} stars')
+
+        return x[order], y[order], flux[order]
+
+    @staticmethod
+    def write_xylist(fname, x, y, flux, width, height):
+        """
+        Write star list as a FITS table in the astrometry.net xylist format.
+
+        Coordinates are converted to the 1-indexed FITS convention.
+
+        :param str fname: Output filename.
+        :param ndarray x: X coordinate of stars (0-indexed).
+        :param ndarray y: Y coordinate of stars (0-indexed).
+        :param ndarray flux: Flux of stars.
+        :param int width: Width of image.
+        :param int height: Height of image.
+        """
+        cols = [pyfits.Column(name='X', format='D', array=np.asarray(x) + 1),
+                pyfits.Column(name='Y', format='D', array=np.asarray(y) + 1),
+                pyfits.Column(name='FLUX', format='D', array=np.asarray(flux))]
+
+        pri = pyfits.PrimaryHDU()
+        pri.header['IMAGEW'] = width
+        pri.header['IMAGEH'] = height
+
+        table = pyfits.BinTableHDU.from_columns(cols)
+        pyfits.HDUList([pri, table]).writeto(fname, overwrite=True)
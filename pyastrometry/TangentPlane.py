@@ -0,0 +1,91 @@
+#
+# gnomonic (tangent plane) projection
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import numpy as np
+
+def tan_project(ra, dec, ra0, dec0):
+    """
+    Project sky positions onto the plane tangent to the sky at (ra0, dec0).
+
+    :param ndarray ra: RA of positions in degrees.
+    :param ndarray dec: DEC of positions in degrees.
+    :param float ra0: RA of tangent point in degrees.
+    :param float dec0: DEC of tangent point in degrees.
+    :return: Standard coordinates xi (positive to the East) and eta
+        (positive to the North) in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    ra0 = np.radians(ra0)
+    dec0 = np.radians(dec0)
+
+    cos_dec = np.cos(dec)
+    cos_dra = np.cos(ra - ra0)
+    cosc = np.sin(dec0)*np.sin(dec) + np.cos(dec0)*cos_dec*cos_dra
+
+    xi = cos_dec*np.sin(ra - ra0)/cosc
+    eta = (np.cos(dec0)*np.sin(dec) - np.sin(dec0)*cos_dec*cos_dra)/cosc
+
+    return np.degrees(xi), np.degrees(eta)
+
+def tan_deproject(xi, eta, ra0, dec0):
+    """
+    Convert standard coordinates on the tangent plane back to sky positions.
+
+    :param ndarray xi: Standard coordinate xi in degrees.
+    :param ndarray eta: Standard coordinate eta in degrees.
+    :param float ra0: RA of tangent point in degrees.
+    :param float dec0: DEC of tangent point in degrees.
+    :return: RA (0 to 360) and DEC of positions in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    xi = np.radians(xi)
+    eta = np.radians(eta)
+    ra0 = np.radians(ra0)
+    dec0 = np.radians(dec0)
+
+    # denom is negative for points beyond the pole so DEC uses the length
+    # of the projection onto the equator which is always positive
+    denom = np.cos(dec0) - eta*np.sin(dec0)
+    dra = np.arctan2(xi, denom)
+    dec = np.arctan2(np.sin(dec0) + eta*np.cos(dec0), np.hypot(xi, denom))
+
+    return np.degrees(ra0 + dra) % 360.0, np.degrees(dec)
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation between sky positions.
+
+    :param ndarray ra1: RA of first positions in degrees.
+    :param ndarray dec1: DEC of first positions in degrees.
+    :param ndarray ra2: RA of second positions in degrees.
+    :param ndarray dec2: DEC of second positions in degrees.
+    :return: Separation in degrees.
+    :rtype: ndarray
+    """
+    ra1 = np.radians(ra1)
+    dec1 = np.radians(dec1)
+    ra2 = np.radians(ra2)
+    dec2 = np.radians(dec2)
+
+    # haversine formula is accurate for small separations
+    hav = np.sin((dec2 - dec1)/2)**2 + \
+          np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2)**2
+    return np.degrees(2*np.arcsin(np.sqrt(np.clip(hav, 0, 1))))
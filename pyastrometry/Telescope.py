@@ -17,14 +17,19 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-from datetime import datetime
+import time
 import logging
+import threading
+from functools import lru_cache
+import numpy as np
 
-from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 from astropy.coordinates import FK5
 
+from pyastrometry.Coordinates import FK5_J2000, fk5_frame, precess
+from pyastrometry.Coordinates import JD_UNIX_EPOCH, epoch_to_jd, round_epoch
+
 #from pyastrobackend.BackendConfig import get_backend_for_os
 #
 #BACKEND = get_backend_for_os()
@@ -36,6 +41,124 @@ from astropy.coordinates import FK5
 #else:
 #    raise Exception(f'Unknown backend {BACKEND} - choose ASCOM or INDI in BackendConfig.py')
 
+@lru_cache(maxsize=8)
+def _precession_matrix_for_jd(jd):
+    # precession between FK5 equinoxes is a pure rotation so transforming
+    # the unit vectors once with astropy gives the matrix exactly
+    basis = SkyCoord(x=[1.0, 0.0, 0.0], y=[0.0, 1.0, 0.0], z=[0.0, 0.0, 1.0],
+                     representation_type='cartesian', frame=FK5_J2000)
+    out = basis.transform_to(fk5_frame(jd)).cartesian.xyz.value
+    out.setflags(write=False)
+    return out
+
+def precession_matrix(epoch=None):
+    """
+    Rotation matrix from J2000 to equinox of date.
+
+    The matrix is computed once per time bucket (EPOCH_RESOLUTION in
+    pyastrometry.Coordinates) and memoized.  The transpose rotates from
+    equinox of date back to J2000.
+
+    :param epoch: Date - see :func:`pyastrometry.Coordinates.epoch_to_jd`.
+        None for now.
+    :return: 3x3 rotation matrix applied to J2000 unit vectors.
+    :rtype: ndarray
+    """
+    return _precession_matrix_for_jd(round_epoch(epoch_to_jd(epoch)))
+
+def _rotate_radec(matrix, ra, dec):
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    vec = np.stack([cos_dec*np.cos(ra), cos_dec*np.sin(ra), np.sin(dec)])
+    x, y, z = np.tensordot(matrix, vec, axes=1)
+    return (np.degrees(np.arctan2(y, x)) % 360.0,
+            np.degrees(np.arctan2(z, np.hypot(x, y))))
+
+def precess_radec_fast(ra, dec, epoch=None, to_jnow=True):
+    """
+    Precess RA/DEC between J2000 and equinox of date with a cached
+    rotation matrix.
+
+    Agrees with the astropy FK5 transformation to well under a milliarcsecond
+    but avoids the frame machinery so it is cheap enough to call every time
+    the mount position is polled.
+
+    :param ndarray ra: RA in degrees.
+    :param ndarray dec: DEC in degrees.
+    :param epoch: Date - see :func:`pyastrometry.Coordinates.epoch_to_jd`.
+        None for now.
+    :param bool to_jnow: If True precess J2000 to JNow otherwise JNow to J2000.
+    :return: Precessed RA and DEC in degrees.
+    :rtype: (ndarray, ndarray)
+    """
+    matrix = precession_matrix(epoch)
+    if not to_jnow:
+        matrix = matrix.T
+    return _rotate_radec(matrix, ra, dec)
+
+class MountState:
+    """
+    Mount position and slew status read at one time.
+
+    :param float timestamp: Time (time.time()) the driver was read.
+    :param float ra_jnow: RA of mount (JNow) in degrees.
+    :param float dec_jnow: DEC of mount (JNow) in degrees.
+    :param float ra_j2000: RA of mount (J2000) in degrees.
+    :param float dec_j2000: DEC of mount (J2000) in degrees.
+    :param bool slewing: True if mount was slewing.
+    """
+
+    __slots__ = ('timestamp', 'ra_jnow', 'dec_jnow', 'ra_j2000', 'dec_j2000',
+                 'slewing')
+
+    def __init__(self, timestamp, ra_jnow, dec_jnow, ra_j2000, dec_j2000, slewing):
+        """
+        Create state record.
+
+        """
+        self.timestamp = timestamp
+        self.ra_jnow = ra_jnow
+        self.dec_jnow = dec_jnow
+        self.ra_j2000 = ra_j2000
+        self.dec_j2000 = dec_j2000
+        self.slewing = slewing
+
+    def __repr__(self):
+        return f'MountState(timestamp={self.timestamp}, ra_jnow={self.ra_jnow}, ' \
+               f'dec_jnow={self.dec_jnow}, ra_j2000={self.ra_j2000}, ' \
+               f'dec_j2000={self.dec_j2000}, slewing={self.slewing})'
+
+    def age(self):
+        """
+        Time since state was read.
+
+        :return: Age in seconds.
+        :rtype: float
+        """
+        return time.time() - self.timestamp
+
+    def position_j2000(self):
+        """
+        Position of mount (J2000).
+
+        :rtype: SkyCoord
+        """
+        return SkyCoord(ra=self.ra_j2000*u.degree, dec=self.dec_j2000*u.degree,
+                        frame=FK5_J2000)
+
+    def position_jnow(self):
+        """
+        Position of mount (JNow).
+
+        :rtype: SkyCoord
+        """
+        return SkyCoord(ra=self.ra_jnow*u.degree, dec=self.dec_jnow*u.degree,
+                        frame=fk5_frame(JD_UNIX_EPOCH + self.timestamp/86400.0))
+
+# cached mount state older than this many poll intervals means the poller is
+# not getting updates from the driver
+STALE_POLLS = 4
 
 #class Telescope(MountClass):
 class Telescope:
@@ -55,6 +178,21 @@ class Telescope:
         if len(args) > 0:
             self.backend = args[0]
 
+        # driver calls from the poller thread and callers are serialized
+        self._driver_lock = threading.RLock()
+
+        # latest mount state - guarded by _state_cond
+        self._state = None
+        self._state_cond = threading.Condition()
+        self._slew_subscribers = []
+        self._goto_time = 0
+
+        self._poller = None
+        self._poller_stop = threading.Event()
+        self._poller_wake = threading.Event()
+        self._poll_failed = False
+        self.poll_interval = 0.5
+
     @staticmethod
     def precess_J2000_to_JNOW(pos_J2000):
         """
@@ -65,9 +203,13 @@ class Telescope:
         :return: JNow coordiante.
         :type: SkyCoord
         """
-        time_now = Time(datetime.utcnow(), scale='utc')
-        return pos_J2000.transform_to(FK5(equinox=Time(time_now.jd,
-                                                       format='jd', scale='utc')))
+        frame = fk5_frame()
+        if not isinstance(pos_J2000.frame, FK5) or \
+           pos_J2000.equinox != FK5_J2000.equinox:
+            return precess(pos_J2000)
+        ra, dec = precess_radec_fast(pos_J2000.ra.degree, pos_J2000.dec.degree,
+                                     frame.equinox)
+        return SkyCoord(ra=ra*u.degree, dec=dec*u.degree, frame=frame)
 
     @staticmethod
     def precess_JNOW_to_J2000(pos_JNOW):
@@ -79,7 +221,11 @@ class Telescope:
         :return: J2000 coordiante.
         :type: SkyCoord
         """
-        return pos_JNOW.transform_to(FK5(equinox='J2000'))
+        if not isinstance(pos_JNOW.frame, FK5) or not pos_JNOW.equinox.isscalar:
+            return precess(pos_JNOW, 'J2000')
+        ra, dec = precess_radec_fast(pos_JNOW.ra.degree, pos_JNOW.dec.degree,
+                                     pos_JNOW.equinox, to_jnow=False)
+        return SkyCoord(ra=ra*u.degree, dec=dec*u.degree, frame=FK5_J2000)
 
     def connect_to_telescope(self, driver):
         """
@@ -116,11 +262,10 @@ class Telescope:
         """
         if not self.connected:
             return None
-        time_now = Time(datetime.utcnow(), scale='utc')
-        ra_now, dec_now = super().get_position_radec()
+        with self._driver_lock:
+            ra_now, dec_now = super().get_position_radec()
 
-        return SkyCoord(ra=ra_now*u.hour, dec=dec_now*u.degree, frame='fk5',
-                        equinox=Time(time_now.jd, format="jd", scale="utc"))
+        return SkyCoord(ra=ra_now*u.hour, dec=dec_now*u.degree, frame=fk5_frame())
 
     def get_position_j2000(self):
         """
@@ -131,8 +276,10 @@ class Telescope:
         """
         if not self.connected:
             return None
-        pos_jnow = self.get_position_jnow()
-        return self.precess_JNOW_to_J2000(pos_jnow)
+        with self._driver_lock:
+            ra_now, dec_now = super().get_position_radec()
+        ra, dec = precess_radec_fast(ra_now*15.0, dec_now, to_jnow=False)
+        return SkyCoord(ra=ra*u.degree, dec=dec*u.degree, frame=FK5_J2000)
 
     def sync(self, pos):
         """
@@ -148,11 +295,14 @@ class Telescope:
         logging.info(f'Syncing to {pos.ra.to_string(unit=u.hour, sep=":")} '
                      f'{pos.dec.to_string(unit=u.degree, sep=":")}')
         try:
-           super().sync(pos.ra.hour, pos.dec.degree)
+            with self._driver_lock:
+                super().sync(pos.ra.hour, pos.dec.degree)
         except Exception:
             logging.error('sync() Exception ->', exc_info=True)
             return False
 
+        # position cache is out of date
+        self._poller_wake.set()
         return True
 
     def goto(self, pos):
@@ -167,5 +317,278 @@ class Telescope:
             return False
         logging.info(f'Goto {pos.ra.to_string(unit=u.hour, sep=":")} '
                      f'{pos.dec.to_string(unit=u.degree, sep=":")}')
-        super().slew(pos.ra.hour, pos.dec.degree)
+        self._goto_time = time.time()
+        with self._driver_lock:
+            super().slew(pos.ra.hour, pos.dec.degree)
+        self._poller_wake.set()
         return True
+
+    def poll_state(self):
+        """
+        Read position and slew status from the driver and update the cached
+        mount state.
+
+        Slew subscribers are called if the slew status changed.
+
+        :return: New state or None if not connected or the driver failed.
+        :rtype: MountState
+        """
+        if not self.connected:
+            return None
+
+        timestamp = time.time()
+        try:
+            with self._driver_lock:
+                ra_now, dec_now = super().get_position_radec()
+                slewing = bool(super().is_slewing())
+        except Exception:
+            # only report the first of a run of failures
+            if not self._poll_failed:
+                logging.error('poll_state() Exception ->', exc_info=True)
+                self._poll_failed = True
+            return None
+
+        if self._poll_failed:
+            logging.info('poll_state(): reading mount state again')
+            self._poll_failed = False
+
+        ra_now = ra_now*15.0
+        ra_j2000, dec_j2000 = precess_radec_fast(ra_now, dec_now, to_jnow=False)
+        state = MountState(timestamp, ra_now, dec_now, float(ra_j2000),
+                           float(dec_j2000), slewing)
+
+        with self._state_cond:
+            old = self._state
+            self._state = state
+            self._state_cond.notify_all()
+            subscribers = list(self._slew_subscribers)
+
+        if old is None or old.slewing != slewing:
+            logging.debug(f'poll_state(): slewing = {slewing}')
+            for callback in subscribers:
+                try:
+                    callback(slewing, state)
+                except Exception:
+                    logging.error('Slew subscriber Exception ->', exc_info=True)
+
+        return state
+
+    def get_state(self, max_age=None):
+        """
+        Get latest mount state.
+
+        The cached state kept up to date by the poller is returned unless it
+        is older than max_age, in which case the driver is read directly.
+
+        :param float max_age: Oldest state in seconds to accept - None
+            accepts any cached state.
+        :return: Mount state or None if not available.
+        :rtype: MountState
+        """
+        with self._state_cond:
+            state = self._state
+        if state is None or (max_age is not None and state.age() > max_age):
+            state = self.poll_state()
+        return state
+
+    def get_cached_position_j2000(self, max_age=None):
+        """
+        Get RA/DEC position of mount (J2000) from the mount state cache.
+
+        :param float max_age: Oldest cached position in seconds to accept.
+        :return: RA/DEC position (J2000) or None if not available.
+        :rtype: SkyCoord
+        """
+        state = self.get_state(max_age=max_age)
+        if state is None:
+            return None
+        return state.position_j2000()
+
+    def subscribe_slew(self, callback):
+        """
+        Register a function called as callback(slewing, state) from the
+        poller thread when the mount starts or stops slewing.
+
+        :param callable callback: Function to call.
+        """
+        with self._state_cond:
+            self._slew_subscribers.append(callback)
+
+    def unsubscribe_slew(self, callback):
+        """
+        Remove a slew subscriber.
+
+        :param callable callback: Function registered with :meth:`subscribe_slew`.
+        """
+        with self._state_cond:
+            if callback in self._slew_subscribers:
+                self._slew_subscribers.remove(callback)
+
+    def is_com_driver(self):
+        """
+        Test if the mount driver is an ASCOM COM object.
+
+        COM objects can only be used from the thread which created them so
+        these drivers are not polled from a background thread.
+
+        :rtype: bool
+        """
+        return any(cls.__module__.startswith('pyastrobackend.ASCOM')
+                   for cls in type(self).__mro__)
+
+    def start_poller(self, interval=None):
+        """
+        Start background thread which polls the mount state.
+
+        Nothing is started for COM drivers - the mount is then read directly
+        when the state is needed.
+
+        :param float interval: Seconds between polls.
+        """
+        if interval is not None:
+            self.poll_interval = interval
+
+        if self.poller_running():
+            return
+
+        if self.is_com_driver():
+            logging.debug('start_poller(): COM driver so mount is not polled '
+                          'in background')
+            return
+
+        self._poller_stop.clear()
+        self._poller = threading.Thread(target=self._poll_loop,
+                                        name='MountPoller', daemon=True)
+        self._poller.start()
+        logging.debug(f'start_poller(): polling every {self.poll_interval} seconds')
+
+    def stop_poller(self):
+        """
+        Stop mount state poller thread.
+        """
+        if self._poller is None:
+            return
+        self._poller_stop.set()
+        self._poller_wake.set()
+        if self._poller is not threading.current_thread():
+            self._poller.join()
+        self._poller = None
+
+    def poller_running(self):
+        """
+        Test if the mount state poller is running.
+
+        :rtype: bool
+        """
+        return self._poller is not None and self._poller.is_alive()
+
+    def _poll_loop(self):
+        while not self._poller_stop.is_set():
+            self._poller_wake.clear()
+            if self.connected:
+                self.poll_state()
+            self._poller_wake.wait(self.poll_interval)
+
+    def wait_for_slew(self, timeout=None):
+        """
+        Wait for the last goto to finish.
+
+        Uses the mount state from the poller if it is running so this
+        returns as soon as the poller sees the slew stop, otherwise the
+        driver is polled directly.  If the poller has not updated the state
+        for STALE_POLLS poll intervals (for example because the driver
+        keeps failing in the poller thread) the driver is polled directly
+        and if that fails too the wait is given up.
+
+        :param float timeout: Seconds to wait - None waits forever.
+        :return: True if the mount is not slewing, False on timeout or if
+            the mount state cannot be read.
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        goto_time = self._goto_time
+
+        def slew_done(state):
+            return state is not None and state.timestamp >= goto_time \
+                   and not state.slewing
+
+        while True:
+            if self.poller_running():
+                with self._state_cond:
+                    state = self._state
+                    if not slew_done(state):
+                        wait_time = self.poll_interval*2
+                        if deadline is not None:
+                            wait_time = min(wait_time, deadline - time.time())
+                        if wait_time > 0:
+                            self._state_cond.wait(wait_time)
+                        state = self._state
+                if state is None or state.age() > STALE_POLLS*self.poll_interval:
+                    logging.warning('wait_for_slew(): mount state from poller is '
+                                    'stale - reading mount directly')
+                    state = self.poll_state()
+                    if state is None:
+                        logging.error('wait_for_slew(): unable to read mount state')
+                        return False
+            else:
+                state = self.poll_state()
+
+            if slew_done(state):
+                return True
+
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+            if not self.poller_running():
+                time.sleep(self.poll_interval)
+
+    def _next_state(self, after):
+        # wait for a state newer than after
+        if self.poller_running():
+            with self._state_cond:
+                if self._state is None or self._state.timestamp <= after:
+                    self._state_cond.wait(self.poll_interval*2)
+                return self._state
+        time.sleep(self.poll_interval)
+        return self.poll_state()
+
+    def wait_for_settle(self, settle_time=0.5, tolerance=2.0, timeout=10.0):
+        """
+        Wait for the mount to settle after a slew.
+
+        The mount is settled once it is not slewing and its reported
+        position has stayed within tolerance for settle_time seconds.
+
+        :param float settle_time: Seconds position must be steady.
+        :param float tolerance: Allowed movement in arcseconds.
+        :param float timeout: Seconds to wait.
+        :return: True if the mount settled, False on timeout.
+        :rtype: bool
+        """
+        deadline = time.time() + timeout
+        ref = None
+        state = self.get_state(max_age=self.poll_interval)
+
+        while True:
+            if state is not None:
+                if state.slewing:
+                    ref = None
+                elif ref is None:
+                    ref = state
+                else:
+                    dra = (state.ra_jnow - ref.ra_jnow + 180.0) % 360.0 - 180.0
+                    moved = np.hypot(dra*np.cos(np.radians(state.dec_jnow)),
+                                     state.dec_jnow - ref.dec_jnow)*3600.0
+                    if moved > tolerance:
+                        ref = state
+                    elif state.timestamp - ref.timestamp >= settle_time:
+                        logging.debug(f'wait_for_settle(): settled after '
+                                      f'{state.timestamp - ref.timestamp:.2f} seconds')
+                        return True
+
+            if time.time() >= deadline:
+                logging.warning(f'wait_for_settle(): mount not settled after '
+                                f'{timeout} seconds')
+                return False
+
+            state = self._next_state(0 if state is None else state.timestamp)
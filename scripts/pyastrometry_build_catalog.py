@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# even on windows this 'tricks' conda into wrapping script so it will
+#
+# convert a star catalog into the format used by the native solver
+#
+# Copyright 2019 Michael Fulbright
+#
+#
+#    pyastrometry is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import sys
+import csv
+import argparse
+import logging
+import numpy as np
+
+from astropy.io import fits
+
+from pyastrometry.StarCatalog import CatalogBuilder
+
+def read_csv_chunks(fname, ra_col, dec_col, mag_col, chunk_size):
+    """
+    Read star positions and magnitudes from a CSV file with a header line.
+
+    :param str fname: CSV file.
+    :param str ra_col: Name of RA column (degrees).
+    :param str dec_col: Name of DEC column (degrees).
+    :param str mag_col: Name of magnitude column.
+    :param int chunk_size: Number of rows to return at a time.
+    :return: Generator of (ra, dec, mag) arrays.
+    """
+    with open(fname, newline='') as f:
+        reader = csv.reader(f)
+        header = [h.strip() for h in next(reader)]
+        try:
+            cols = [header.index(c) for c in (ra_col, dec_col, mag_col)]
+        except ValueError:
+            logging.error(f'Columns {ra_col} {dec_col} {mag_col} not all '
+                          f'found in {fname} - columns are {header}')
+            sys.exit(1)
+
+        rows = []
+        for row in reader:
+            try:
+                rows.append([float(row[c]) for c in cols])
+            except (ValueError, IndexError):
+                # skip rows with missing values
+                continue
+
+            if len(rows) >= chunk_size:
+                yield tuple(np.array(rows).T)
+                rows = []
+
+        if len(rows) > 0:
+            yield tuple(np.array(rows).T)
+
+def read_fits_chunks(fname, ra_col, dec_col, mag_col, chunk_size):
+    """
+    Read star positions and magnitudes from the first table of a FITS file.
+
+    :param str fname: FITS file.
+    :param str ra_col: Name of RA column (degrees).
+    :param str dec_col: Name of DEC column (degrees).
+    :param str mag_col: Name of magnitude column.
+    :param int chunk_size: Number of rows to return at a time.
+    :return: Generator of (ra, dec, mag) arrays.
+    """
+    with fits.open(fname, memmap=True) as hdulist:
+        table = None
+        for hdu in hdulist:
+            if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+                table = hdu.data
+                break
+
+        if table is None:
+            logging.error(f'No table found in {fname}')
+            sys.exit(1)
+
+        for start in range(0, len(table), chunk_size):
+            rows = table[start:start+chunk_size]
+            yield (np.asarray(rows[ra_col], dtype=np.float64),
+                   np.asarray(rows[dec_col], dtype=np.float64),
+                   np.asarray(rows[mag_col], dtype=np.float32))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='Convert a CSV or FITS star '
+                                     'catalog into a catalog directory for '
+                                     'the native solver')
+    parser.add_argument('infile', type=str, help='Input catalog (.csv or .fits)')
+    parser.add_argument('outdir', type=str, help='Output catalog directory')
+    parser.add_argument('--nside', type=int, default=64,
+                        help='HEALPix resolution of tiles (power of 2)')
+    parser.add_argument('--ra-col', type=str, default='ra', help='RA column (degrees)')
+    parser.add_argument('--dec-col', type=str, default='dec',
+                        help='DEC column (degrees)')
+    parser.add_argument('--mag-col', type=str, default='mag', help='Magnitude column')
+    parser.add_argument('--mag-limit', type=float, help='Skip stars fainter than this')
+    parser.add_argument('--chunk-size', type=int, default=1000000,
+                        help='Number of stars read at a time')
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.outdir, 'catalog.json')):
+        logging.error(f'Catalog {args.outdir} already exists!')
+        sys.exit(1)
+
+    ext = os.path.splitext(args.infile)[1].lower()
+    if ext == '.csv':
+        reader = read_csv_chunks
+    elif ext in ['.fit', '.fits', '.fts']:
+        reader = read_fits_chunks
+    else:
+        logging.error(f'Unknown catalog type {ext} - must be .csv or .fits')
+        sys.exit(1)
+
+    builder = CatalogBuilder(args.outdir, nside=args.nside,
+                             block_size=args.chunk_size)
+
+    for ra, dec, mag in reader(args.infile, args.ra_col, args.dec_col,
+                               args.mag_col, args.chunk_size):
+        keep = np.isfinite(ra) & np.isfinite(dec) & np.isfinite(mag)
+        if args.mag_limit is not None:
+            keep &= mag <= args.mag_limit
+        builder.add(ra[keep], dec[keep], mag[keep])
+        logging.info(f'Read {builder.nstars} stars')
+
+    builder.finish()
@@ -21,32 +21,23 @@
 #
 import os
 import sys
+import glob
+import math
 import time
 import json
 import argparse
 import logging
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #import subprocess
-from datetime import datetime
+from datetime import datetime, timezone
 from configobj import ConfigObj
 
-from urllib.parse import urlparse, urlencode, quote
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError
-
-#from exceptions import Exception
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.application  import MIMEApplication
-
-from email.encoders import encode_noop
-
 #import astropy.io.fits as pyfits
 from astropy.io import fits
-from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import SkyCoord
-from astropy.coordinates import FK5
 from astropy.coordinates import Angle
 
 from pyastroprofile.AstroProfile import AstroProfile
@@ -73,9 +64,20 @@ from pyastrobackend.BackendConfig import get_backend_for_os, get_backend, get_ba
 #else:
 #    raise Exception(f'Unknown backend {BACKEND}')
 
-from pyastrometry.Telescope import Telescope
+from pyastrometry.Telescope import Telescope, precess_radec_fast
 
 from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.SolveCache import SolveCache
+from pyastrometry.SolutionLog import SolutionLog
+from pyastrometry.AstrometryNetClient import Client, RequestError, DEFAULT_API_URL
+from pyastrometry.AstrometryNetJobs import JobTracker, JobFailed
+from pyastrometry.ImageReduction import reduce_image_file
+from pyastrometry.StarExtractor import StarExtractor
+from pyastrometry.FITSHeader import ImageHeader, read_image_header
+from pyastrometry.PlateSolver import submit_solve, first_solution
+from pyastrometry.Coordinates import JD_UNIX_EPOCH, precess, format_radec
+from pyastrometry.ExposureManager import ExposureManager
+from pyastrometry.PointingModel import PointingModel, local_sidereal_time
 
 #if BACKEND == 'ASCOM':
 #    from pyastrometry.PlateSolve2 import PlateSolve2
@@ -83,313 +85,19 @@ from pyastrometry.PlateSolveSolution import PlateSolveSolution
 #    from pyastrometry.AstrometryNetLocal import AstrometryNetLocal
 #    from pyastrometry.ASTAP import ASTAP
 
-def json2python(data):
-    try:
-        return json.loads(data)
-    except:
-        pass
-    return None
-python2json = json.dumps
-
-class MalformedResponse(Exception):
-    pass
-class RequestError(Exception):
-    pass
-
-class Client(object):
-    default_url = 'http://nova.astrometry.net/api/'
-
-    def __init__(self, apiurl=default_url):
-        self.session = None
-        self.apiurl = apiurl
-
-    def get_url(self, service):
-        return self.apiurl + service
-
-    def send_request(self, service, args={}, file_args=None):
-        '''
-        service: string
-        args: dict
-        '''
-        if self.session is not None:
-            args.update({'session':self.session})
-        #print('Python:', args)
-        json = python2json(args)
-        #print('Sending json:', json)
-        url = self.get_url(service)
-        #print('Sending to URL:', url)
-
-        # If we're sending a file, format a multipart/form-data
-        if file_args is not None:
-            # Make a custom generator to format it the way we need.
-            from io import BytesIO
-            try:
-                # py3
-                from email.generator import BytesGenerator as TheGenerator
-            except ImportError:
-                # py2
-                from email.generator import Generator as TheGenerator
-
-            m1 = MIMEBase('text', 'plain')
-            m1.add_header('Content-disposition',
-                          'form-data; name="request-json"')
-
-            logging.debug(f"send_request: {json}")  # MSF
-
-            m1.set_payload(json)
-            m2 = MIMEApplication(file_args[1], 'octet-stream', encode_noop)
-            m2.add_header('Content-disposition',
-                          'form-data; name="file"; filename="%s"'%file_args[0])
-            mp = MIMEMultipart('form-data', None, [m1, m2])
-
-            class MyGenerator(TheGenerator):
-                def __init__(self, fp, root=True):
-                    # don't try to use super() here; in py2 Generator is not a
-                    # new-style class.  Yuck.
-                    TheGenerator.__init__(self, fp, mangle_from_=False,
-                                          maxheaderlen=0)
-                    self.root = root
-                def _write_headers(self, msg):
-                    # We don't want to write the top-level headers;
-                    # they go into Request(headers) instead.
-                    if self.root:
-                        return
-                    # We need to use \r\n line-terminator, but Generator
-                    # doesn't provide the flexibility to override, so we
-                    # have to copy-n-paste-n-modify.
-                    for h, v in msg.items():
-                        self._fp.write(('%s: %s\r\n' % (h, v)).encode())
-                    # A blank line always separates headers from body
-                    self._fp.write('\r\n'.encode())
-
-                # The _write_multipart method calls "clone" for the
-                # subparts.  We hijack that, setting root=False
-                def clone(self, fp):
-                    return MyGenerator(fp, root=False)
-
-            fp = BytesIO()
-            g = MyGenerator(fp)
-            g.flatten(mp)
-            data = fp.getvalue()
-            headers = {'Content-type': mp.get('Content-type')}
-
-        else:
-            # Else send x-www-form-encoded
-            data = {'request-json': json}
-            #print('Sending form data:', data)
-            data = urlencode(data)
-            data = data.encode('utf-8')
-            #print('Sending data:', data)
-            headers = {}
-
-        request = Request(url=url, headers=headers, data=data)
-
-        try:
-            f = urlopen(request)
-            txt = f.read()
-            #print('Got json:', txt)
-            result = json2python(txt)
-            #print('Got result:', result)
-            stat = result.get('status')
-            #print('Got status:', stat)
-            if stat == 'error':
-                errstr = result.get('errormessage', '(none)')
-                raise RequestError('server error message: ' + errstr)
-            return result
-        except HTTPError as e:
-            logging.error(f'HTTPError {e}')
-            txt = e.read()
-            open('err.html', 'wb').write(txt)
-            logging.error('Wrote error text to err.html')
-
-    def login(self, apikey):
-        args = {'apikey' : apikey}
-        result = self.send_request('login', args)
-        sess = result.get('session')
-        logging.info(f'Got session: {sess}')
-        if not sess:
-            raise RequestError('no session in result')
-        self.session = sess
-
-    def _get_upload_args(self, **kwargs):
-        args = {}
-        for key, default, typ in [('allow_commercial_use', 'd', str),
-                                  ('allow_modifications', 'd', str),
-                                  ('publicly_visible', 'y', str),
-                                  ('scale_units', None, str),
-                                  ('scale_type', None, str),
-                                  ('scale_lower', None, float),
-                                  ('scale_upper', None, float),
-                                  ('scale_est', None, float),
-                                  ('scale_err', None, float),
-                                  ('center_ra', None, float),
-                                  ('center_dec', None, float),
-                                  ('parity', None, int),
-                                  ('radius', None, float),
-                                  ('downsample_factor', None, int),
-                                  ('tweak_order', None, int),
-                                  ('crpix_center', None, bool),
-                                  ('x', None, list),
-                                  ('y', None, list),
-                                  # image_width, image_height
-                                 ]:
-            if key in kwargs:
-                val = kwargs.pop(key)
-                val = typ(val)
-                args.update({key: val})
-            elif default is not None:
-                args.update({key: default})
-        #print('Upload args:', args)
-        return args
-
-    def url_upload(self, url, **kwargs):
-        args = dict(url=url)
-        args.update(self._get_upload_args(**kwargs))
-        result = self.send_request('url_upload', args)
-        return result
-
-    def upload(self, fn=None, **kwargs):
-        args = self._get_upload_args(**kwargs)
-        file_args = None
-        if fn is not None:
-            try:
-                f = open(fn, 'rb')
-                file_args = (fn, f.read())
-            except IOError:
-                logging.error('File %s does not exist' % fn)
-                raise
-        return self.send_request('upload', args, file_args)
-
-    def submission_images(self, subid):
-        result = self.send_request('submission_images', {'subid':subid})
-        return result.get('image_ids')
-
-    def myjobs(self):
-        result = self.send_request('myjobs/')
-        return result['jobs']
-
-    def job_status(self, job_id, justdict=False):
-        result = self.send_request('jobs/%s' % job_id)
-        if justdict:
-            return result
-        stat = result.get('status')
-        # if stat == 'success':
-            # result = self.send_request('jobs/%s/calibration' % job_id)
-            # print('Calibration:', result)
-            #result = self.send_request('jobs/%s/tags' % job_id)
-            #print('Tags:', result)
-            #result = self.send_request('jobs/%s/machine_tags' % job_id)
-            #print('Machine Tags:', result)
-            #result = self.send_request('jobs/%s/objects_in_field' % job_id)
-            #print('Objects in field:', result)
-            #result = self.send_request('jobs/%s/annotations' % job_id)
-            #print('Annotations:', result)
-            #result = self.send_request('jobs/%s/info' % job_id)
-            #print('Calibration:', result)
-
-        return stat
-
-    def job_calib_result(self, job_id):
-        result = self.send_request('jobs/%s/calibration' % job_id)
-        #print('Calibration:', result)
-
-        return result
-
-    def sub_status(self, sub_id, justdict=False):
-        result = self.send_request('submissions/%s' % sub_id)
-        if justdict:
-            return result
-        return result.get('status')
-
-    def jobs_by_tag(self, tag, exact):
-        exact_option = 'exact=yes' if exact else ''
-        result = self.send_request(
-            'jobs_by_tag?query=%s&%s' % (quote(tag.strip()), exact_option),
-            {},
-        )
-        return result
-
-def read_radec_from_FITS(fname):
-    """Read RA/DEC coordinate from a FITS file header
-
-    Parameters
-    ----------
-    fname - str
-        Name of FITS file
-
-    Returns
-    -------
-    radec : SkyCoord
-        RA/DEC read from FITS header - assumes J2000.
-    """
-    hdulist = fits.open(fname)
-    prihdr = hdulist[0].header
-    hdulist.close()
-
-    try:
-        obj_ra_str = prihdr["OBJCTRA"]
-    except:
-        return None
-
-    try:
-        obj_dec_str = prihdr["OBJCTDEC"]
-    except:
-        return None
-
-    logging.debug(f"read_radec_from_FITS: {obj_ra_str} {obj_dec_str}")
-
-    try:
-        radec = SkyCoord(obj_ra_str + ' ' + obj_dec_str, frame='fk5', unit=(u.hourangle, u.deg), equinox='J2000')
-    except Exception as err:
-        logging.error(f"read_radec_from_file: {err}")
-        return None
-
-    return radec
-
-def read_image_info_from_FITS(fname):
-    """Read RA/DEC coordinate from a FITS file header
-
-    Parameters
-    ----------
-    fname - str
-        Name of FITS file
+def get_fast_temp_dir():
+    """Find directory for temporary image files which is held in memory
 
     Returns
     -------
-    width, height : int
-        Width/height of image.
-    bining_x, binning_y : int
-        Binning along X/Y axis
+    dirname : str
+        /dev/shm if it is available otherwise None so the system
+        temporary directory is used.
     """
-    try:
-        hdulist = fits.open(fname)
-    except Exception as err:
-        logging.error(f"read_image_info_from_FITS: error opening {fname} - {err}")
-        return None
-
-    prihdr = None
-    try:
-        prihdr = hdulist[0].header
-    except Exception as err:
-        logging.error(f"read_image_info_from_FITS: error opening {fname} - {err}")
-
-    hdulist.close()
-    if prihdr is None:
-        return None
-
-    keys = ['NAXIS1', 'NAXIS2', 'XBINNING', 'YBINNING']
-    retval = ()
-
-    for k in keys:
-        try:
-            retval = retval + (int(prihdr[k]),)
-        except:
-            logging.error(f"read_image_info_from_FITS: error reading key {k} from file {fname}")
-            return None
-
-    logging.debug(f"read_image_info_from_FITS: {retval}")
-
-    return retval
+    shm_dir = '/dev/shm'
+    if os.path.isdir(shm_dir) and os.access(shm_dir, os.W_OK):
+        return shm_dir
+    return None
 
 #def convert_ra_deg_to_hour(ra_deg):
 #    hour = int(ra_deg/15.0)
@@ -413,8 +121,7 @@ def precess_J2000_to_JNOW(pos_J2000):
     pos_JNOW : SkyCoord
         JNow coordinate
     """
-    time_now = Time(datetime.utcnow(), scale='utc')
-    return pos_J2000.transform_to(FK5(equinox=Time(time_now.jd, format="jd", scale="utc")))
+    return precess(pos_J2000)
 
 def precess_JNOW_to_J2000(pos_JNOW):
     """Precess J2000 coordinates to JNOW
@@ -429,7 +136,7 @@ def precess_JNOW_to_J2000(pos_JNOW):
     pos_J2000 : SkyCoord
         J2000 coordinate
     """
-    return pos_JNOW.transform_to(FK5(equinox='J2000'))
+    return precess(pos_JNOW, 'J2000')
 
 class PlateSolveParameters:
     """Contains parameters needed to prime a plate solve engine"""
@@ -469,11 +176,57 @@ class ProgramSettings:
         self.astrometry_timeout = 90
         self.astrometry_downsample_factor = 2
         self.astrometry_apikey = ''
+        # astrometry.net API - change to use a local nova server
+        self.astrometry_api_url = DEFAULT_API_URL
+        # delays between checks of astrometry.net jobs grow from min to max
+        self.astrometry_poll_min_delay = 1.0
+        self.astrometry_poll_max_delay = 30.0
+        # image sent to astrometry.net is binned by astrometry_downsample_factor
+        # and written as one of 'uint8', 'rice' or 'fits' - 'raw' sends the
+        # original file and lets the server downsample and 'stars' only sends
+        # the positions of up to astrometry_upload_max_stars stars
+        self.astrometry_upload_format = 'uint8'
+        self.astrometry_upload_max_stars = 300
         self.camera_exposure = 5
         self.camera_binning = 2
         self.precise_slew_limit = 600.0
         self.precise_slew_tries = 5
         self.max_allow_sep = 5
+        self.batch_workers = os.cpu_count() or 1
+        self.solve_cache_enabled = True
+        self.solve_cache_max_entries = 100000
+        # record every solve in the solution log for the solvelog command
+        self.solution_log_enabled = True
+        self.native_catalog_location = ''
+        self.native_search_rad_deg = 1.0
+        # seconds allowed for a solve before solver is killed - 0 for no limit
+        self.solve_timeout = 300
+        # allowed fractional error in pixel scale of solutions from race solver
+        self.race_max_scale_error = 0.1
+        # search radii (degrees) tried in turn by astrometrylocal,
+        # astrometryengine and astap - empty to use a single search
+        self.search_rad_tiers = []
+        # try all search radii at once instead of in turn
+        self.search_rad_tiers_concurrent = False
+        # seconds between reads of mount position/slew status
+        self.mount_poll_interval = 0.25
+        # mount is settled after a slew once its position has moved less than
+        # mount_settle_tolerance arcseconds for mount_settle_time seconds
+        self.mount_settle_time = 0.5
+        self.mount_settle_tolerance = 2.0
+        # seconds allowed for a slew to finish
+        self.slew_timeout = 300.0
+        # learn the mount pointing error from precise slews and correct
+        # the first slew to each target
+        self.pointing_model_enabled = True
+        # pointing model samples older than this are dropped
+        self.pointing_model_max_age_hours = 24.0
+        # site longitude in degrees (east positive) - needed to model errors
+        # which depend on hour angle, if None only fixed offsets are modeled
+        self.site_longitude = None
+        # during precise slew start each image as soon as the slew finishes
+        # instead of waiting for the mount to settle first
+        self.precise_slew_overlap_exposure = True
 
         # set some defaults based on OS as to which plate solver is the default
         if os.name == 'nt':
@@ -481,12 +234,21 @@ class ProgramSettings:
             self.platesolve2_location = "PlateSolve2.exe"
             self.platesolve2_regions = 999
             self.platesolve2_wait_time = 10
+            self.race_solvers = ['platesolve2', 'astap']
+            self.race_search_rads = []
         elif os.name == 'posix':
             self.backend = 'INDI'
             self.astrometrynetlocal_location = '/usr/bin/solve-field'
             self.astrometrynetlocal_downsample = 2
             self.astrometrynetlocal_search_rad_deg = 10
+            self.astrometrynetlocal_extract_stars = False
+            self.astrometrynetengine_location = '/usr/bin/astrometry-engine'
+            self.astrometrynetengine_timeout = 30
             self.ASTAP_location = '/usr/local/bin/astap'
+            # solvers run at the same time by race solver
+            self.race_solvers = ['astap', 'astrometrylocal']
+            # if given astrometrylocal is raced once for each search radius
+            self.race_search_rads = []
         else:
             raise Exception("Sorry: no implementation for your platform ('%s') available" % os.name)
 
@@ -580,21 +342,43 @@ class MyApp:
 
         self.camera_binning = None
 
+        self.solve_cache = None
+        self.solution_log = None
+        self.pointing_model = None
+        self.astroclient = None
+        self.astroclient_lock = threading.Lock()
+        self.astrometry_jobs = None
+        self.upload_star_extractor = None
+
+        # built in solver - loaded when selected since it reads catalog
+        self.native_solver = None
+
         # platesolve2
         if os.name == 'nt':
             from pyastrometry.PlateSolve2 import PlateSolve2
-            self.platesolve2 = PlateSolve2(self.settings.platesolve2_location)
+            self.platesolve2 = PlateSolve2(self.settings.platesolve2_location,
+                                           timeout=self.get_solve_timeout())
 
             from pyastrometry.ASTAP import ASTAP
-            self.ASTAP = ASTAP(self.settings.ASTAP_location)
+            self.ASTAP = ASTAP(self.settings.ASTAP_location,
+                               timeout=self.get_solve_timeout())
 
         # astrometry.net local
         if os.name == 'posix':
             from pyastrometry.AstrometryNetLocal import AstrometryNetLocal
+            from pyastrometry.AstrometryNetEngine import AstrometryNetEngine
             from pyastrometry.ASTAP import ASTAP
-            self.astrometrynetlocal = AstrometryNetLocal(self.settings.astrometrynetlocal_location)
+            self.astrometrynetlocal = AstrometryNetLocal(
+                self.settings.astrometrynetlocal_location,
+                timeout=self.get_solve_timeout())
             self.astrometrynetlocal.probe_solve_field_revision()
-            self.ASTAP = ASTAP(self.settings.ASTAP_location)
+            # engine is only started if the astrometryengine solver is used
+            self.astrometrynetengine = AstrometryNetEngine(
+                self.settings.astrometrynetengine_location,
+                self.astrometrynetlocal,
+                timeout=self.settings.astrometrynetengine_timeout)
+            self.ASTAP = ASTAP(self.settings.ASTAP_location,
+                               timeout=self.get_solve_timeout())
 
     def parse_commandline(self):
 
@@ -634,6 +418,14 @@ class MyApp:
         filename = argparse.ArgumentParser(add_help=False)
         filename.add_argument('filename', type=str, help='Filename to solve')
 
+        batchopts = argparse.ArgumentParser(add_help=False)
+        batchopts.add_argument('files', type=str, nargs='*',
+                               help='Files, directories or glob patterns to solve')
+        batchopts.add_argument('--filelist', type=str,
+                               help='Text file listing files to solve (one per line)')
+        batchopts.add_argument('--workers', type=int,
+                               help='Number of solves to run concurrently')
+
         getposopts = argparse.ArgumentParser(add_help=False)
         getposopts.add_argument('--outfile', type=str, help='Output JSON file with solution')
         getposopts.add_argument('--force', action='store_true', help='Overwrite output file')
@@ -644,6 +436,12 @@ class MyApp:
         solveopts.add_argument('--downsample', type=int, help='Downsampling')
         solveopts.add_argument('--outfile', type=str, help='Output JSON file with solution')
         solveopts.add_argument('--force', action='store_true', help='Overwrite output file')
+        solveopts.add_argument('--nocache', action='store_true',
+                               help='Do not use solve result cache')
+        solveopts.add_argument('--clearcache', action='store_true',
+                               help='Clear solve result cache')
+        solveopts.add_argument('--timeout', type=float,
+                               help='Seconds allowed for each solve (0 for no limit)')
 
         syncopts = argparse.ArgumentParser(add_help=False)
         syncopts.add_argument('--syncmaxsep', type=float, help='Max deviation to allow sync')
@@ -664,11 +462,43 @@ class MyApp:
 
         solveimage = subparsers.add_parser('solveimage', parents=[common, filename, solveopts])
 
+        solvebatch = subparsers.add_parser('solvebatch',
+                                           parents=[common, batchopts, solveopts])
+        solvebatch.epilog = 'Solutions are written as JSON lines to --outfile ' \
+                            + '(or stdout) as each solve completes.'
+
         syncpos = subparsers.add_parser('syncpos', parents=[common, device_common,
                                                             device_camera, device_mount,
                                                             solveopts, syncopts])
         syncpos.epilog = devopts_epilog
 
+        solvelogopts = argparse.ArgumentParser(add_help=False)
+        solvelogopts.add_argument('--since', type=str,
+                                  help='Only solves at or after this time '
+                                       '(ISO format, UTC)')
+        solvelogopts.add_argument('--until', type=str,
+                                  help='Only solves before this time '
+                                       '(ISO format, UTC)')
+        solvelogopts.add_argument('--solver', type=str,
+                                  help='Only solves by this solver')
+        solvelogopts.add_argument('--file', type=str,
+                                  help='Only solves of files matching glob pattern')
+        solvelogopts.add_argument('--solved', action='store_true',
+                                  help='Only successful solves')
+        solvelogopts.add_argument('--failed', action='store_true',
+                                  help='Only failed solves')
+        solvelogopts.add_argument('--summary', action='store_true',
+                                  help='Output statistics instead of solves')
+        solvelogopts.add_argument('--by', type=str, default='solver',
+                                  choices=['solver', 'file', 'day'],
+                                  help='Group statistics by solver, file or day')
+        solvelogopts.add_argument('--limit', type=int,
+                                  help='Only output the most recent solves')
+        solvelogopts.add_argument('--outfile', type=str,
+                                  help='Output JSON lines file')
+        solvelogopts.add_argument('--force', action='store_true',
+                                  help='Overwrite output file')
+
         slew = subparsers.add_parser('slew', parents=[common, device_common, device_mount, slewopts])
         slew.epilog = devopts_epilog
 
@@ -679,6 +509,10 @@ class MyApp:
         slewsolve.add_argument('--slewtries', type=int, help='Number of tries to reach target')
         slewsolve.epilog = devopts_epilog
 
+        solvelog = subparsers.add_parser('solvelog', parents=[common, solvelogopts])
+        solvelog.epilog = 'Solves or statistics are written as JSON lines to ' \
+                          + '--outfile (or stdout).'
+
         # run.add_argument('--fast', action='store_true', help='run only arg')
 
         parser.epilog = "--- Arguments common to all sub-parsers ---" \
@@ -841,6 +675,11 @@ class MyApp:
             logging.debug(f'Setting astrometry downsample to {args.downsample}')
             self.settings.astrometry_downsample_factor = args.downsample
 
+        if args.timeout is not None:
+            logging.debug(f'Setting solve timeout to {args.timeout}')
+            self.settings.solve_timeout = args.timeout
+            self.set_solve_timeout(self.get_solve_timeout())
+
         if args.outfile is not None:
             if os.path.isfile(args.outfile):
                 if not args.force:
@@ -860,8 +699,184 @@ class MyApp:
                 logging.error('No solver specified and no default found')
                 sys.exit(1)
 
+        uses_native = self.solver == 'native' or \
+                      (self.solver == 'race' and 'native' in self.settings.race_solvers)
+        if uses_native and self.native_solver is None:
+            if not self.open_native_solver():
+                sys.exit(1)
+
+        if self.settings.solve_cache_enabled and not args.nocache:
+            self.open_solve_cache()
+            if self.solve_cache is not None and args.clearcache:
+                self.solve_cache.clear()
+
+        if self.settings.solution_log_enabled:
+            self.open_solution_log()
+
         return args.outfile
 
+    def get_solve_timeout(self):
+        """
+        Time allowed for a solve from the solve_timeout setting.
+
+        :returns: Seconds allowed or None for no limit.
+        :rtype: float
+        """
+        if self.settings.solve_timeout is None or self.settings.solve_timeout <= 0:
+            return None
+        return self.settings.solve_timeout
+
+    def set_solve_timeout(self, timeout):
+        """
+        Set time allowed for a solve for all solvers which run a program.
+
+        The resident engine keeps its own astrometrynetengine_timeout.
+
+        :param float timeout: Seconds allowed or None for no limit.
+        """
+        for solver in ['platesolve2', 'ASTAP', 'astrometrynetlocal']:
+            if hasattr(self, solver):
+                getattr(self, solver).set_timeout(timeout)
+
+    def open_native_solver(self):
+        """
+        Load star catalog and create the built in solver.
+
+        :returns: True on success.
+        :rtype: bool
+        """
+        from pyastrometry.StarCatalog import StarCatalog
+        from pyastrometry.NativeSolver import NativeSolver
+
+        catalog_loc = self.settings.native_catalog_location
+        if not catalog_loc:
+            logging.error('native_catalog_location must be set to use native solver!')
+            return False
+
+        try:
+            catalog = StarCatalog(catalog_loc)
+        except Exception:
+            logging.error(f'Unable to load star catalog {catalog_loc}', exc_info=True)
+            return False
+
+        self.native_solver = NativeSolver(catalog)
+        return True
+
+    def open_solve_cache(self):
+        """
+        Open the persistent solve result cache stored in the config directory.
+        """
+        cache_dir = self.settings._get_config_dir()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            cache_fname = os.path.join(cache_dir, 'solve_cache.sqlite')
+            logging.debug(f'Using solve cache {cache_fname}')
+            max_entries = self.settings.solve_cache_max_entries
+            self.solve_cache = SolveCache(cache_fname, max_entries=max_entries)
+        except Exception:
+            logging.error('Unable to open solve cache - continuing without it',
+                          exc_info=True)
+            self.solve_cache = None
+
+    def open_solution_log(self):
+        """
+        Open the solution log stored in the config directory.
+
+        :returns: Solution log.
+        :rtype: SolutionLog
+        """
+        if self.solution_log is None:
+            log_dir = os.path.join(self.settings._get_config_dir(), 'solution_log')
+            logging.debug(f'Using solution log {log_dir}')
+            self.solution_log = SolutionLog(log_dir)
+        return self.solution_log
+
+    def log_solution(self, name, solved_j2000, duration):
+        """
+        Record a solve in the solution log if it is open.
+
+        :param str name: Image solved.
+        :param PlateSolveSolution solved_j2000: Solution or None if solve
+            failed.
+        :param float duration: Seconds the solve took.
+        """
+        if self.solution_log is not None:
+            self.solution_log.append(name, self.solver, solved_j2000, duration)
+
+    def open_pointing_model(self):
+        """
+        Open the pointing model stored in the config directory.
+
+        :returns: Pointing model or None if disabled.
+        :rtype: PointingModel
+        """
+        if not self.settings.pointing_model_enabled:
+            return None
+
+        if self.pointing_model is None:
+            model_dir = self.settings._get_config_dir()
+            try:
+                os.makedirs(model_dir, exist_ok=True)
+            except OSError:
+                logging.error('Unable to create config dir for pointing model',
+                              exc_info=True)
+                model_dir = None
+
+            model_fname = None
+            if model_dir is not None:
+                model_fname = os.path.join(model_dir, 'pointing_model.json')
+
+            max_age = self.settings.pointing_model_max_age_hours
+            min_geometry = 6 if self.settings.site_longitude is not None else None
+            if max_age is not None:
+                max_age = max_age*3600
+            self.pointing_model = PointingModel(model_fname, max_age=max_age,
+                                                min_geometry_samples=min_geometry)
+            logging.debug(f'Using pointing model {model_fname} with '
+                          f'{len(self.pointing_model)} samples')
+
+        return self.pointing_model
+
+    def local_sidereal_time(self, timestamp=None):
+        """
+        Local sidereal time from the site_longitude setting.
+
+        :param float timestamp: Time (time.time()) - None for now.
+        :returns: Sidereal time in degrees - 0 if site longitude is not set.
+        :rtype: float
+        """
+        if self.settings.site_longitude is None:
+            return 0.0
+        jd = None if timestamp is None else JD_UNIX_EPOCH + timestamp/86400.0
+        return local_sidereal_time(self.settings.site_longitude, jd)
+
+    def record_pointing_sample(self, mount_state, solution):
+        """
+        Add the difference between the mount position and the solved
+        position to the pointing model.
+
+        :param MountState mount_state: Mount position when image was taken.
+        :param PlateSolveSolution solution: Solved position of image.
+        """
+        model = self.open_pointing_model()
+        if model is None or mount_state is None:
+            return
+
+        epoch = JD_UNIX_EPOCH + mount_state.timestamp/86400.0
+        ra_s, dec_s = precess_radec_fast(solution.radec.ra.degree,
+                                         solution.radec.dec.degree, epoch)
+        dra = (ra_s - mount_state.ra_jnow + 180.0) % 360.0 - 180.0
+        ddec = mount_state.dec_jnow - dec_s
+        error = math.hypot(dra*math.cos(math.radians(dec_s)), ddec)
+        if error > self.settings.max_allow_sep:
+            logging.warning('Pointing error too large - not adding to pointing model')
+            return
+
+        model.add_measurement(self.local_sidereal_time(mount_state.timestamp),
+                              mount_state.ra_jnow, mount_state.dec_jnow,
+                              ra_s, dec_s)
+        model.save()
+
     def parse_filename(self, args):
         """
         Set output filename options from parsed command line arguments.
@@ -878,6 +893,54 @@ class MyApp:
         # args, unknown = parser.parse_known_args(sys.argv[2:3])
         return args.filename
 
+    def parse_batch_filenames(self, args):
+        """
+        Expand batch file arguments into a list of files to solve.
+
+        Each argument can be a filename, a directory (all FITS files in it
+        are used) or a glob pattern.  Names listed in --filelist are
+        expanded the same way.
+
+        :parameter args: Parsed command line arguments from parse_commandline().
+        :type args: Argparse.Namespace
+        :returns: Filenames to solve in the order given.
+        :rtype: list
+        """
+        logging.debug('parse_batch_filenames')
+
+        patterns = list(args.files)
+        if args.filelist is not None:
+            try:
+                with open(args.filelist, 'r') as f:
+                    patterns += [l.strip() for l in f if l.strip()]
+            except OSError as err:
+                logging.error(f'Unable to read file list {args.filelist} - {err}')
+                sys.exit(1)
+
+        fits_exts = ('.fit', '.fits', '.fts')
+        fnames = []
+        seen = set()
+        for pat in patterns:
+            if os.path.isdir(pat):
+                matches = sorted(os.path.join(pat, f) for f in os.listdir(pat)
+                                 if f.lower().endswith(fits_exts))
+            elif os.path.isfile(pat):
+                matches = [pat]
+            else:
+                matches = sorted(glob.glob(pat))
+                if len(matches) == 0:
+                    logging.warning(f'No files match {pat}')
+            for m in matches:
+                if m not in seen:
+                    seen.add(m)
+                    fnames.append(m)
+
+        if args.workers is not None:
+            logging.debug(f'Setting batch workers to {args.workers}')
+            self.settings.batch_workers = args.workers
+
+        return fnames
+
     def parse_sync(self, args):
         """
         Set sync options from parsed command line arguments.
@@ -1017,6 +1080,18 @@ class MyApp:
                 logging.info('Plate solve suceeded')
                 s = self.json_print_plate_solution(self.solved_j2000)
                 logging.info(f'{s}')
+        elif operation == 'solvebatch':
+            logging.debug('operation solvebatch')
+            outfile = self.parse_solve_params(args)
+            logging.debug(f'Using solver {self.solver}')
+            fnames = self.parse_batch_filenames(args)
+            if len(fnames) == 0:
+                logging.error('Need filenames of images to solve')
+                sys.exit(1)
+            self.run_solve_batch(fnames, outfile)
+        elif operation == 'solvelog':
+            logging.debug('operation solvelog')
+            self.run_solve_log(args)
         elif operation == 'slewsolve':
             logging.debug('operation slewsolve')
             outfile = self.parse_solve_params(args)
@@ -1036,9 +1111,10 @@ class MyApp:
                 # })
             # sys.stdout.write(s + '\n')
             logging.info('Position read from mount:')
+            ra2000, dec2000 = format_radec(pos)
             s =  json.dumps({
-                             'ra2000' : pos.ra.to_string(u.hour, sep=":", pad=True),
-                             'dec2000' : pos.dec.to_string(alwayssign=True, sep=":", pad=True),
+                             'ra2000' : ra2000,
+                             'dec2000' : dec2000,
                            })
             logging.info(f'{s}')
 
@@ -1050,7 +1126,8 @@ class MyApp:
         elif operation == 'slew':
             logging.debug('operation slew')
             self.parse_slew(args)
-            self.target_goto()
+            if not self.target_goto():
+                sys.exit(1)
         else:
             logging.error(f'Unknown operation {operation}!')
             sys.exit(1)
@@ -1058,8 +1135,15 @@ class MyApp:
         logging.info('Operation complete - exiting')
 
         if needdevs:
+            self.tel.stop_poller()
             self.backend.disconnect()
 
+        if self.astrometry_jobs is not None:
+            self.astrometry_jobs.shutdown()
+
+        if os.name == 'posix':
+            self.astrometrynetengine.stop()
+
         self.settings.write()
         sys.exit(0)
 
@@ -1095,7 +1179,10 @@ class MyApp:
         mount_dev = self.backend.newMount()
         TelescopeClass = type('Telescope', (Telescope, type(mount_dev)), {})
         self.tel = TelescopeClass(self.backend)
-        return self.tel.connect_to_telescope(self.mount_driver)
+        if not self.tel.connect_to_telescope(self.mount_driver):
+            return False
+        self.tel.start_poller(self.settings.mount_poll_interval)
+        return True
 
     def connect_camera(self):
         logging.debug(f'connect_camera: self.camera_driver = {self.camera_driver}')
@@ -1127,18 +1214,23 @@ class MyApp:
         self.cam = self.backend.newCamera()
 
         rc = self.cam.connect(self.camera_driver)
+        self.exposure = ExposureManager(self.cam)
 
         logging.debug(f'connect returned {rc}')
         return rc
 
+    def plate_solution_dict(self, sol):
+        ra2000, dec2000 = format_radec(sol.radec)
+        return {
+                'ra2000' : ra2000,
+                'dec2000' : dec2000,
+                'angle' : sol.angle.degree,
+                'pixelscale' : sol.pixel_scale,
+                'binning' : sol.binning
+               }
+
     def json_print_plate_solution(self, sol):
-        return json.dumps({
-                        'ra2000' : sol.radec.ra.to_string(u.hour, sep=":", pad=True),
-                        'dec2000' : sol.radec.dec.to_string(alwayssign=True, sep=":", pad=True),
-                        'angle' : sol.angle.degree,
-                        'pixelscale' : sol.pixel_scale,
-                        'binning' : sol.binning
-                        })
+        return json.dumps(self.plate_solution_dict(sol))
 
     def sync_pos(self):
         if self.solved_j2000 is None:
@@ -1161,7 +1253,9 @@ class MyApp:
 #        offpos.dec.degree = offpos.dec.degree - 10
 #        self.tel.sync(offpos)
 
-        sep = self.solved_j2000.radec.separation(self.tel.get_position_j2000()).degree
+        curpos = self.tel.get_cached_position_j2000(
+            max_age=2*self.settings.mount_poll_interval)
+        sep = self.solved_j2000.radec.separation(curpos).degree
         logging.info(f'Sync pos is {sep} degrees from current pos')
 
         # check if its WAY OFF
@@ -1174,69 +1268,267 @@ class MyApp:
                 logging.error('Error occurred syncing mount!')
                 sys.exit(1)
 
+            model = self.open_pointing_model()
+            if model is not None:
+                model.add_sync(self.local_sidereal_time() - solved_jnow.ra.degree,
+                               solved_jnow.dec.degree)
+                model.save()
+
     def target_precise_goto(self):
         target = self.target_j2000
         if target is None:
             logging.error('target_precise_goto(): target_j2000 is None!')
             sys.exit(1)
 
-        logging.info('Slewing to target initially!')
-        self.target_goto()
+        if not self.setup_ccd_frame_binning():
+            logging.error('target_precise_goto(): Unable to setup camera!')
+            return False
 
-        ntries = 0
-        while ntries < self.settings.precise_slew_tries:
-            solve_tries = 0
-            max_solve_tries = 3
-            curpos_j2000 = None
-            while solve_tries < max_solve_tries:
-                logging.info('Precise slew - solving current position '
-                            f'try {solve_tries+1} of {max_solve_tries}.')
+        exposure = self.settings.camera_exposure
+        overlap = self.settings.precise_slew_overlap_exposure
 
-                curpos_j2000 = self.run_solve_image()
+        # exposure started as soon as the last slew finished
+        pending = None
+
+        def finish_pending():
+            # camera must be idle before the next exposure
+            nonlocal pending
+            if pending is not None:
+                pending.result()
+                pending = None
+
+        def goto():
+            # start the next image while the mount settles
+            nonlocal pending
+            if not self.target_goto():
+                return False
+            if overlap:
+                pending = self.exposure.expose_async(exposure)
+            return True
+
+        logging.info('Slewing to target initially!')
+        if not goto():
+            return False
+
+        with tempfile.TemporaryDirectory(dir=get_fast_temp_dir()) as tmpdirname:
+            nframes = 0
+            ntries = 0
+            while ntries < self.settings.precise_slew_tries:
+                ntries += 1
+
+                settled = self.tel.wait_for_settle(
+                    settle_time=self.settings.mount_settle_time,
+                    tolerance=self.settings.mount_settle_tolerance)
+                if not settled and pending is not None:
+                    # mount was still moving during the image
+                    logging.info('Precise slew - discarding image taken '
+                                 'before mount settled')
+                    finish_pending()
+                mount_state = self.tel.get_state(
+                    max_age=self.settings.mount_poll_interval)
+
+                solve_tries = 0
+                max_solve_tries = 3
+                curpos_j2000 = None
+                while solve_tries < max_solve_tries:
+                    logging.info('Precise slew - solving current position '
+                                f'try {solve_tries+1} of {max_solve_tries}.')
+
+                    if pending is not None:
+                        exposed = pending.result()
+                        pending = None
+                    else:
+                        exposed = self.exposure.expose(exposure)
+
+                    if not exposed:
+                        solve_tries += 1
+                        logging.error('Unable to take image on '
+                                      f'try {solve_tries} of {max_solve_tries}.')
+                        continue
+
+                    nframes += 1
+                    image = self.read_camera_image(tmpdirname,
+                                                   f'precise_slew_{nframes}.fits')
+                    solve_future = submit_solve(self.solve_image, image)
+                    curpos_j2000 = solve_future.result()
+
+                    if isinstance(image, str):
+                        os.unlink(image)
+
+                    if curpos_j2000 is None:
+                        solve_tries += 1
+                        logging.error('Unable to solve current position on '
+                                      f'try {solve_tries} of {max_solve_tries}.')
+                        continue
+                    else:
+                        logging.info('Precise slew complete')
+                        radec_str = curpos_j2000.radec.to_string("hmsdms", sep=":")
+                        logging.info(f'Solved position is (J2000) {radec_str}')
+                        break
 
                 if curpos_j2000 is None:
-                    solve_tries += 1
-                    logging.error('Unable to solve current position on '
-                                  f'try {solve_tries} of {max_solve_tries}.')
-                    continue
-                else:
-                    logging.info('Precise slew complete')
-                    logging.info(f'Solved position is (J2000) '
-                                 f'{curpos_j2000.radec.to_string("hmsdms", sep=":")}')
-                    break
-
-            if curpos_j2000 is None:
-               logging.error('Precise slew failed - unable to solve current '
-                             f'position after {max_solve_tries} tries.')
-               return False
-
-            self.solved_j2000 = curpos_j2000
-            sep = self.solved_j2000.radec.separation(target).degree
-            logging.info(f'Distance from target is {sep}')
-
-            # if too far ask before making correction
-            # slew limit is in arcseconds so convert
-            if sep < self.settings.precise_slew_limit/3600.0:
-                logging.info(f'Sep {sep} < threshold {self.settings.precise_slew_limit/3600.0} so quitting')
-                return True
-#            elif sep > self.settings.max_allow_sep:
-#                logging.error(f'Error in position is {sep:6.2f} degrees > limit of {self.settings.max_allow_sep}')
-#                return
-
-            # sync
-            self.sync_pos()
-
-            time.sleep(1) # just to let things happen
-
-            # slew
-            self.target_goto()
-
-        logging.warning('fDid not reach precise slew threshold after {self.settings.precise_slew_tries}!')
+                   logging.error('Precise slew failed - unable to solve current '
+                                 f'position after {max_solve_tries} tries.')
+                   return False
+
+                self.solved_j2000 = curpos_j2000
+                self.record_pointing_sample(mount_state, curpos_j2000)
+                sep = self.solved_j2000.radec.separation(target).degree
+                logging.info(f'Distance from target is {sep}')
+
+                # if too far ask before making correction
+                # slew limit is in arcseconds so convert
+                if sep < self.settings.precise_slew_limit/3600.0:
+                    logging.info(f'Sep {sep} < threshold '
+                                 f'{self.settings.precise_slew_limit/3600.0} '
+                                 f'so quitting')
+                    return True
+
+                # sync and slew right away - the next image is started as
+                # soon as the slew finishes
+                self.sync_pos()
+                if not goto():
+                    return False
+
+        finish_pending()
+        logging.warning(f'Did not reach precise slew threshold after '
+                        f'{self.settings.precise_slew_tries}!')
         return False
 
     def run_solve_file(self, fname):
         self.solved_j2000 = self.plate_solve_file(fname)
 
+    def run_solve_batch(self, fnames, outfile=None):
+        """
+        Solve many files concurrently.
+
+        Each solver runs as an external single threaded process so the
+        solves are fanned out over a pool of worker threads which just wait
+        on the child processes.  With the astrometryonline solver the
+        workers just wait on jobs which are all polled by the shared job
+        tracker.  A JSON line is written for each file as soon as its solve
+        finishes so results stream out in completion order.
+
+        :param list fnames: Filenames to solve.
+        :param str outfile: JSON lines output file - if None use stdout.
+        :returns: Number of files which solved.
+        :rtype: int
+        """
+        nworkers = max(1, int(self.settings.batch_workers))
+        logging.info(f'Solving {len(fnames)} files using {nworkers} workers')
+
+        def solve_one(fname):
+            time_start = time.time()
+            try:
+                sol = self.plate_solve_file(fname)
+            except Exception:
+                logging.error(f'Exception solving {fname}', exc_info=True)
+                sol = None
+            return sol, time.time() - time_start
+
+        if outfile is not None:
+            out_f = open(outfile, 'w')
+        else:
+            out_f = sys.stdout
+
+        nsolved = 0
+        try:
+            with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                futures = {executor.submit(solve_one, f): f for f in fnames}
+                for fut in as_completed(futures):
+                    fname = futures[fut]
+                    sol, elapsed = fut.result()
+                    result = {'filename' : fname,
+                              'solved' : sol is not None,
+                              'elapsed' : round(elapsed, 3)}
+                    if sol is not None:
+                        nsolved += 1
+                        result.update(self.plate_solution_dict(sol))
+                    out_f.write(json.dumps(result) + '\n')
+                    out_f.flush()
+                    logging.info(f'Batch solve {fname} solved={sol is not None} '
+                                 f'({nsolved} of {len(fnames)} solved so far)')
+        finally:
+            if outfile is not None:
+                out_f.close()
+
+        logging.info(f'Batch solve complete - {nsolved} of {len(fnames)} solved')
+        return nsolved
+
+    def run_solve_log(self, args):
+        """
+        Output solves from the solution log or statistics about them.
+
+        :parameter args: Parsed command line arguments from parse_commandline().
+        :type args: Argparse.Namespace
+        :returns: Number of solves selected.
+        :rtype: int
+        """
+        def parse_time(s):
+            # times are UTC like the output unless an offset is given
+            if s is None:
+                return None
+            if s.endswith('Z'):
+                s = s[:-1] + '+00:00'
+            try:
+                t = datetime.fromisoformat(s)
+            except ValueError:
+                logging.error(f'Invalid time {s} - use ISO format like '
+                              f'2019-06-01T21:00')
+                sys.exit(1)
+            if t.tzinfo is None:
+                t = t.replace(tzinfo=timezone.utc)
+            return t.timestamp()
+
+        if args.solved and args.failed:
+            logging.error('Cannot use both --solved and --failed')
+            sys.exit(1)
+        solved = True if args.solved else (False if args.failed else None)
+
+        if args.outfile is not None and os.path.isfile(args.outfile) and \
+           not args.force:
+            logging.error(f'Output file {args.outfile} already exists - '
+                          'please remove before running')
+            sys.exit(1)
+
+        solution_log = self.open_solution_log()
+        recs = solution_log.query(since=parse_time(args.since),
+                                  until=parse_time(args.until),
+                                  solver=args.solver, file=args.file, solved=solved)
+        logging.info(f'{len(recs)} solves selected')
+
+        if args.summary:
+            rows = solution_log.summary(recs, by=args.by)
+        else:
+            if args.limit is not None:
+                recs = recs[-args.limit:] if args.limit > 0 else recs[:0]
+            rows = []
+            for rec in recs.tolist():
+                row = dict(zip(recs.dtype.names, rec))
+                row['time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                            time.gmtime(row['time']))
+                row['file'] = solution_log.name(row['file'])
+                row['solver'] = solution_log.name(row['solver'])
+                # float32 columns are rounded to the precision they hold
+                for k, digits in [('ra', 7), ('dec', 7), ('angle', 4),
+                                  ('pixel_scale', 5), ('duration', 3)]:
+                    row[k] = None if math.isnan(row[k]) else round(row[k], digits)
+                rows.append(row)
+
+        if args.outfile is not None:
+            out_f = open(args.outfile, 'w')
+        else:
+            out_f = sys.stdout
+
+        try:
+            for row in rows:
+                out_f.write(json.dumps(row) + '\n')
+        finally:
+            if args.outfile is not None:
+                out_f.close()
+
+        return len(recs)
+
     def run_solve_image(self):
         logging.info(f'Taking {self.settings.camera_exposure} second image')
 
@@ -1244,137 +1536,348 @@ class MyApp:
             logging.error('run_solve_image: Unable to setup camera!')
             return
 
-        with tempfile.TemporaryDirectory() as tmpdirname:
+        if not self.exposure.expose(self.settings.camera_exposure):
+            logging.error('run_solve_image: Exposure failed!')
+            return
 
-            #ff = os.path.join(os.getcwd(), "plate_solve_image.fits")
-            ff = os.path.join(tmpdirname, 'plate_solve_image.fits')
+        return self.solve_camera_image()
 
-            focus_expos = self.settings.camera_exposure
-
-            # reset frame to full sensor
-            self.cam.set_binning(1, 1)
-            width, height = self.cam.get_size()
-            logging.debug(f'width/height = {width, height}')
-            logging.debug(f'camera_binning = {self.camera_binning}')
-            self.cam.set_frame(0, 0, width, height)
-
-            # now set desired frame/binning
-            width = width/self.camera_binning
-            height = height/self.camera_binning
-            self.cam.set_binning(self.camera_binning, self.camera_binning)
-            self.cam.set_frame(0, 0, width, height)
-            logging.debug(f'setting binning to {self.camera_binning}')
-            self.cam.start_exposure(focus_expos)
-
-            # give things time to happen (?) I get Maxim not ready errors so slowing it down
-            #time.sleep(0.25)
-
-            elapsed = 0
-            while not self.cam.check_exposure():
-                logging.debug(f'exposure elapsed = {elapsed} of {focus_expos}')
-                time.sleep(0.5)
-                elapsed += 0.5
-                if elapsed > focus_expos:
-                    elapsed = focus_expos
-
-            # give it some time seems like Maxim isnt ready if we hit it too fast
-            #time.sleep(0.5)
+    def solve_camera_image(self):
+        """Read the last image taken from the camera and solve it.
 
-            logging.info(f'Saving image to {ff}')
+        Returns
+        -------
+        solved_j2000 : PlateSolveSolution
+            Solution or None if solve failed.
+        """
+        with tempfile.TemporaryDirectory(dir=get_fast_temp_dir()) as tmpdirname:
+            image = self.read_camera_image(tmpdirname, 'plate_solve_image.fits')
+            self.solved_j2000 = self.solve_image(image)
 
-            # add support for drivers that don't support saving image data to disk
-            if not self.cam.supports_saveimage():
-                # FIXME need better way to handle saving image to file!
-                image_data = self.cam.get_image_data()
-
-                #
-                # FIXME INDIBackend returns a FITS image
-                #       ASCOMBackend returns a numpy array
-                #       This is a temporary HACK to address this
-                #       but needs to be better handled!
-                #
-                fitsfmt = False
-                try:
-                    pri_header = image_data[0].header
-                    image_data = pri_header[0].data
-                    fitsfmt = True
-                except:
-                    pass
+        return self.solved_j2000
 
-                fits.writeto(ff, image_data, overwrite=True)
+    def read_camera_image(self, tmpdirname, name):
+        """Read the last image taken from the camera.
 
-                if not fitsfmt:
-                    # got a ndarray so make a fits doc with necessary
-                    # headers for
-                    hdulist = fits.open(ff, 'update')
+        Parameters
+        ----------
+        tmpdirname : str
+            Directory to save image in if the driver can only save to disk.
+        name : str
+            Filename to save image as.
 
-                    def set_header_keyvalue(hdulist, key, val):
-                        hdulist[0].header[key] = val
+        Returns
+        -------
+        image : PrimaryHDU or str
+            Image in memory or filename of saved image.
+        """
+        # add support for drivers that don't support saving image data to disk
+        if not self.cam.supports_saveimage():
+            return self.build_image_hdu(self.cam.get_image_data())
+
+        ff = os.path.join(tmpdirname, name)
+        logging.info(f'Saving image to {ff}')
+        self.cam.save_image_data(ff)
+        return ff
 
-                    xsize, ysize = self.cam.get_pixelsize()
-                    set_header_keyvalue(hdulist, 'XPIXSZ', xsize)
-                    set_header_keyvalue(hdulist,'YPIXSZ', ysize)
+    def solve_image(self, image):
+        """Solve image returned by read_camera_image().
 
-                    set_header_keyvalue(hdulist,'XBINNING', self.camera_binning)
-                    set_header_keyvalue(hdulist,'YBINNING', self.camera_binning)
-                    set_header_keyvalue(hdulist,'XORGSUBF', 0)
-                    set_header_keyvalue(hdulist,'YORGSUBF', 0)
+        Parameters
+        ----------
+        image : PrimaryHDU or str
+            Image in memory or filename of saved image.
+
+        Returns
+        -------
+        solution : PlateSolveSolution
+            Solution or None if solve failed.
+        """
+        if isinstance(image, str):
+            return self.plate_solve_file(image, use_cache=False, log_name='camera')
+        return self.plate_solve_image_hdu(image)
 
-                    radec = self.tel.get_position_j2000()
-                    rastr = radec.ra.to_string(u.hour, sep=" ", pad=True)
-                    decstr = radec.dec.to_string(alwayssign=True, sep=" ", pad=True)
-                    set_header_keyvalue(hdulist,'OBJCTRA', rastr)
-                    set_header_keyvalue(hdulist,'OBJCTDEC', decstr)
+    def build_image_hdu(self, image_data):
+        """Create FITS HDU with the headers needed for solving from image
+        data returned by the camera driver.
 
-                    hdulist.close()
+        Parameter
+        ---------
+        image_data : HDUList or ndarray
+            Image returned by get_image_data() - INDIBackend returns a FITS
+            image and ASCOMBackend returns a numpy array.
+
+        Returns
+        -------
+        hdu : PrimaryHDU
+            Image data and header.
+        """
+        if isinstance(image_data, fits.HDUList):
+            hdu = fits.PrimaryHDU(data=image_data[0].data, header=image_data[0].header)
+        else:
+            hdu = fits.PrimaryHDU(data=image_data)
+
+        # only add headers the driver did not already fill in
+        header = hdu.header
+
+        def set_header_keyvalue(key, val):
+            if key not in header:
+                header[key] = val
+
+        xsize, ysize = self.cam.get_pixelsize()
+        set_header_keyvalue('XPIXSZ', xsize)
+        set_header_keyvalue('YPIXSZ', ysize)
+
+        set_header_keyvalue('XBINNING', self.camera_binning)
+        set_header_keyvalue('YBINNING', self.camera_binning)
+        set_header_keyvalue('XORGSUBF', 0)
+        set_header_keyvalue('YORGSUBF', 0)
+
+        # position written by drivers is often JNow or the last target so
+        # always use the J2000 mount position the solvers expect
+        radec = self.tel.get_cached_position_j2000(
+            max_age=2*self.settings.mount_poll_interval)
+        if radec is not None:
+            header['OBJCTRA'], header['OBJCTDEC'] = format_radec(radec, sep=' ',
+                                                                 precision=2)
+        else:
+            logging.error('build_image_hdu: Unable to read mount position!')
+            for key in ['OBJCTRA', 'OBJCTDEC']:
+                if key in header:
+                    del header[key]
+
+        return hdu
+
+    def plate_solve_image_hdu(self, hdu):
+        """Solve image held in memory
+
+        The built in solver and the astrometry.net solvers with star
+        extraction enabled solve the image data directly.  Other solvers
+        need a file so the image is written once to a temporary file which
+        is kept in memory (/dev/shm) if possible.
+
+        Parameter
+        ---------
+        hdu : PrimaryHDU
+            Image data and header from build_image_hdu().
+
+        Returns
+        -------
+        pos_j2000 : PlateSolveSolution
+            Solution to plate solve or None if it failed.
+        """
+        in_memory = self.solver == 'native' or \
+                    (self.solver in ['astrometrylocal', 'astrometryengine'] and
+                     self.settings.astrometrynetlocal_extract_stars and
+                     len(self.settings.search_rad_tiers) == 0)
+
+        if in_memory:
+            info = ImageHeader.from_header(hdu.header)
+            solve_params = self.solve_params_from_image_header(info)
+            if solve_params is None:
+                return None
 
-                result = True
+            logging.info(f'Solving image data in memory with {self.solver}')
+            time_start = time.time()
+            if self.solver == 'native':
+                search_rad = self.settings.native_search_rad_deg
+                solved_j2000 = self.native_solver.solve_data(hdu.data, solve_params,
+                                                             search_rad=search_rad)
             else:
-                result = self.cam.save_image_data(ff)
+                if self.solver == 'astrometryengine':
+                    solver = self.astrometrynetengine
+                else:
+                    solver = self.astrometrynetlocal
+                search_rad = self.settings.astrometrynetlocal_search_rad_deg
+                solved_j2000 = solver.solve_data(hdu.data, solve_params,
+                                                 search_rad=search_rad)
+            self.log_solution('camera', solved_j2000, time.time() - time_start)
 
+            if solved_j2000 is None:
+                logging.error('Plate solve failed!')
+            return solved_j2000
 
-## OLD CODE
-##            if os.name == 'posix':
-##                # FIXME need better way to handle saving image to file!
-##                image_data = self.cam.get_image_data()
-##                # this is an hdulist
-##                image_data.writeto(ff, overwrite=True)
-##            else:
-##                self.cam.save_image_data(ff)
+        with tempfile.TemporaryDirectory(dir=get_fast_temp_dir()) as tmpdirname:
+            ff = os.path.join(tmpdirname, 'plate_solve_image.fits')
+            logging.info(f'Saving image to {ff}')
+            hdu.writeto(ff)
+            return self.plate_solve_file(ff, use_cache=False, log_name='camera')
 
-            self.solved_j2000 = self.plate_solve_file(ff)
+    def solve_params_for_file(self, fname):
+        """Create plate solve parameters from the header of a FITS file
 
-        return self.solved_j2000
+        Parameter
+        ---------
+        fname : str
+            Filename of image to be solved.
 
-    def setup_ccd_frame_binning(self):
-        # set camera dimensions to full frame and 1x1 binning
-        result = self.cam.get_size()
-        if not result:
-            return False
+        Returns
+        -------
+        solve_params : PlateSolveParameters
+            Parameters for plate solver or None if header was missing keys.
+        """
+        info = read_image_header(fname)
+        if info is None:
+            return None
 
-        (maxx, maxy) = result
-        logging.debug("Sensor size is %d x %d", maxx, maxy)
+        return self.solve_params_from_image_header(info)
 
-        width = maxx/self.camera_binning
-        height = maxy/self.camera_binning
+    def solve_params_from_image_header(self, info):
+        """Create plate solve parameters from image header values
 
-        logging.debug("CCD size: %d x %d ", width, height)
-        logging.debug("CCD bin : %d x %d ", self.camera_binning, self.camera_binning)
+        Parameter
+        ---------
+        info : ImageHeader
+            Position hint, image size and binning read from header.
 
-        self.cam.set_frame(0, 0, width, height)
+        Returns
+        -------
+        solve_params : PlateSolveParameters
+            Parameters for plate solver or None if header was missing keys.
+        """
+        radec_pos = info.radec
+        img_info = info.image_info()
 
-        self.cam.set_binning(self.camera_binning, self.camera_binning)
+        logging.debug(f'{img_info}')
 
+        if radec_pos is None or img_info is None:
+            logging.error(f'solve_params_from_image_header: error reading radec '
+                          f'from FITS header {radec_pos} {img_info}')
+            return None
 
-        return True
+        (img_width, img_height, img_binx, img_biny) = img_info
 
-    def plate_solve_file(self, fname):
+        # convert fov from arcsec to degrees
+        solve_params = PlateSolveParameters()
+        fov_x = self.pixel_scale_arcsecpx*img_width*img_binx/3600.0*u.deg
+        fov_y = self.pixel_scale_arcsecpx*img_height*img_biny/3600.0*u.deg
+        solve_params.pixel_scale = self.pixel_scale_arcsecpx*img_binx
+        solve_params.fov_x = Angle(fov_x)
+        solve_params.fov_y = Angle(fov_y)
+        solve_params.radec = radec_pos
+        solve_params.width = img_width
+        solve_params.height = img_height
+        solve_params.bin_x = img_binx
+        solve_params.bin_y = img_biny
+
+        logging.debug(f'solve_params_from_image_header: solve_parms = {solve_params}')
+
+        return solve_params
+
+    def setup_ccd_frame_binning(self):
+        # set camera dimensions to full frame and binning - only sent to
+        # the camera when the binning changes
+        logging.debug("CCD bin : %d x %d ", self.camera_binning, self.camera_binning)
+        return self.exposure.configure(self.camera_binning)
+
+    def solve_cache_params(self):
+        """Solve parameters which change the solution for the cache key
+
+        Returns
+        -------
+        params : dict
+            Solver name and settings which affect the result.
+        """
+        params = {'solver' : self.solver,
+                  'pixel_scale' : self.pixel_scale_arcsecpx}
+        if self.solver in ['astrometrylocal', 'astrometryengine']:
+            params['downsample'] = self.settings.astrometrynetlocal_downsample
+            params['search_rad'] = self.settings.astrometrynetlocal_search_rad_deg
+            params['extract_stars'] = self.settings.astrometrynetlocal_extract_stars
+            params['search_rad_tiers'] = list(self.settings.search_rad_tiers)
+        elif self.solver == 'astap':
+            params['search_rad_tiers'] = list(self.settings.search_rad_tiers)
+        elif self.solver == 'astrometryonline':
+            params['downsample'] = self.settings.astrometry_downsample_factor
+            params['upload_format'] = self.settings.astrometry_upload_format
+        elif self.solver == 'platesolve2':
+            params['regions'] = self.settings.platesolve2_regions
+        elif self.solver == 'native':
+            params['catalog'] = self.settings.native_catalog_location
+            params['search_rad'] = self.settings.native_search_rad_deg
+        elif self.solver == 'race':
+            params['race_solvers'] = list(self.settings.race_solvers)
+            params['race_search_rads'] = list(self.settings.race_search_rads)
+        return params
+
+    def plate_solve_file(self, fname, use_cache=True, log_name=None):
         """Solve file using user selected method
 
+        If the solve cache is enabled a stored solution for the same
+        image data and solve parameters is returned without running
+        the solver.  Each run of the solver is recorded in the solution
+        log.
+
+        Parameter
+        ---------
+        fname : str
+            Filename of image to be solved.
+        use_cache : bool
+            If False the solve cache is bypassed.
+        log_name : str
+            Name recorded in the solution log - defaults to the full path
+            of fname.
+
+        Returns
+        -------
+        pos_j2000 : PlateSolveSolution
+            Solution to plate solve or None if it failed.
+        """
+        cache_key = None
+        if use_cache and self.solve_cache is not None:
+            image_hash = SolveCache.hash_image_file(fname)
+            if image_hash is not None:
+                cache_key = SolveCache.make_key(image_hash, self.solve_cache_params())
+                solved_j2000 = self.solve_cache.get(cache_key)
+                if solved_j2000 is not None:
+                    logging.info(f'Using cached solution for {fname}')
+                    return solved_j2000
+
+        time_start = time.time()
+        solved_j2000 = self.plate_solve_file_solver(fname)
+        if log_name is None:
+            log_name = os.path.abspath(fname)
+        self.log_solution(log_name, solved_j2000, time.time() - time_start)
+
+        if cache_key is not None and solved_j2000 is not None:
+            self.solve_cache.put(cache_key, solved_j2000)
+
+        return solved_j2000
+
+    def plate_solve_file_async(self, fname, use_cache=True, timeout=None):
+        """Start solving file using user selected method and return
+        without waiting for the result.
+
+        Cancelling the returned future kills the solver program.
+
         Parameter
         ---------
         fname : str
             Filename of image to be solved.
+        use_cache : bool
+            If False the solve cache is bypassed.
+        timeout : float
+            Seconds allowed for the solve - defaults to solve_timeout setting.
+
+        Returns
+        -------
+        future : SolveFuture
+            Future for the PlateSolveSolution or None if it failed.
+        """
+        if timeout is None:
+            timeout = self.get_solve_timeout()
+        return submit_solve(self.plate_solve_file, fname, use_cache=use_cache,
+                            timeout=timeout)
+
+    def plate_solve_file_solver(self, fname, solver=None):
+        """Run the user selected solver on a file
+
+        Parameter
+        ---------
+        fname : str
+            Filename of image to be solved.
+        solver : str
+            Solver to use instead of the user selected solver.
 
         Returns
         -------
@@ -1387,46 +1890,114 @@ class MyApp:
         # import shutil
         # shutil.copyfile(fname, 'tmp_solve_file.fits')
 
-        if self.solver == 'astrometryonline':
+        if solver is None:
+            solver = self.solver
+
+        if solver == 'astrometryonline':
             return self.plate_solve_file_astrometry(fname)
         # FIXME This is ugly overloading platesolve2 radio button!
-        elif self.solver == 'astrometrylocal':
+        elif solver == 'astrometrylocal':
             return self.plate_solve_file_astromentrynetlocal(fname)
-        elif self.solver == 'platesolve2':
+        elif solver == 'astrometryengine':
+            return self.plate_solve_file_astromentrynetlocal(fname, use_engine=True)
+        elif solver == 'platesolve2':
             return self.plate_solve_file_platesolve2(fname)
-        elif self.solver == 'astap':
+        elif solver == 'astap':
             return self.plate_solve_file_ASTAP(fname)
+        elif solver == 'native':
+            return self.plate_solve_file_native(fname)
+        elif solver == 'race':
+            return self.plate_solve_file_race(fname)
         else:
             logging.error('plate_solve_file: Unknown solver selected!!')
             return None
 
-    def plate_solve_file_platesolve2(self, fname):
-        logging.info('Solving with PlateSolve2...')
+    def plate_solve_file_race(self, fname):
+        """Solve file with several solvers at once and use the first valid
+        solution.
 
-        radec_pos = read_radec_from_FITS(fname)
-        img_info = read_image_info_from_FITS(fname)
+        The solvers are given by the race_solvers setting.  If the
+        race_search_rads setting is not empty astrometrylocal is run once
+        for each search radius.  Solvers still running when a valid solution
+        is found are killed.
 
-        logging.debug(f'{img_info}')
+        Parameter
+        ---------
+        fname : str
+            Filename of image to be solved.
 
-        if radec_pos is None or img_info is None:
-            logging.error(f'plate_solve_file_platesolve2: error reading radec from FITS file {radec_pos} {img_info}')
+        Returns
+        -------
+        pos_j2000 : PlateSolveSolution
+            Solution to plate solve or None if it failed.
+        """
+        names = []
+        futures = []
+        for solver in self.settings.race_solvers:
+            if solver == 'race':
+                logging.error('plate_solve_file_race: race solver cannot race itself!')
+                continue
+
+            if solver == 'astrometrylocal' and len(self.settings.race_search_rads) > 0:
+                for search_rad in self.settings.race_search_rads:
+                    names.append(f'{solver} search_rad={search_rad}')
+                    futures.append(submit_solve(
+                        self.plate_solve_file_astromentrynetlocal,
+                        fname, search_rad=float(search_rad),
+                        timeout=self.get_solve_timeout()))
+            else:
+                names.append(solver)
+                futures.append(submit_solve(self.plate_solve_file_solver, fname,
+                                            solver=solver,
+                                            timeout=self.get_solve_timeout()))
+
+        logging.info(f'Racing solvers {names}')
+
+        time_start = time.time()
+        idx, solved_j2000 = first_solution(futures, validate=self.validate_solution)
+
+        if solved_j2000 is None:
+            logging.error('Plate solve failed for all raced solvers!')
             return None
 
-        (img_width, img_height, img_binx, img_biny) = img_info
+        logging.info(f'Race won by {names[idx]} in '
+                     f'{time.time()-time_start:.2f} seconds')
+        return solved_j2000
 
-        logging.info('Starting PlateSolve2')
+    def validate_solution(self, solved_j2000):
+        """Check plate solve solution is consistent with the pixel scale.
 
-        # convert fov from arcsec to degrees
-        solve_params = PlateSolveParameters()
-        fov_x = self.pixel_scale_arcsecpx*img_width*img_binx/3600.0*u.deg
-        fov_y = self.pixel_scale_arcsecpx*img_height*img_biny/3600.0*u.deg
-        solve_params.fov_x = Angle(fov_x)
-        solve_params.fov_y = Angle(fov_y)
-        solve_params.radec = radec_pos
-        solve_params.width = img_width
-        solve_params.height = img_height
-        solve_params.bin_x = img_binx
-        solve_params.bin_y = img_biny
+        Parameter
+        ---------
+        solved_j2000 : PlateSolveSolution
+            Solution to check.
+
+        Returns
+        -------
+        valid : bool
+            True if pixel scale is within race_max_scale_error of expected.
+        """
+        if solved_j2000.pixel_scale is None or self.pixel_scale_arcsecpx is None:
+            return True
+
+        binning = solved_j2000.binning if solved_j2000.binning else 1
+        expected = self.pixel_scale_arcsecpx*binning
+        error = abs(solved_j2000.pixel_scale - expected)/expected
+        if error > self.settings.race_max_scale_error:
+            logging.warning(f'Solution pixel scale {solved_j2000.pixel_scale:.3f} '
+                            f'does not match expected {expected:.3f}')
+            return False
+
+        return True
+
+    def plate_solve_file_platesolve2(self, fname):
+        logging.info('Solving with PlateSolve2...')
+
+        solve_params = self.solve_params_for_file(fname)
+        if solve_params is None:
+            return None
+
+        logging.info('Starting PlateSolve2')
 
         logging.debug(f'plate_solve_file_platesolve2: solve_parms = {solve_params}')
 
@@ -1443,35 +2014,19 @@ class MyApp:
     def plate_solve_file_ASTAP(self, fname):
         logging.info('Solving with ASTAP...')
 
-        radec_pos = read_radec_from_FITS(fname)
-        img_info = read_image_info_from_FITS(fname)
-
-        logging.debug(f'{img_info}')
-
-        if radec_pos is None or img_info is None:
-            logging.error(f'plate_solve_file_AASTAP: error reading radec from FITS file {radec_pos} {img_info}')
+        solve_params = self.solve_params_for_file(fname)
+        if solve_params is None:
             return None
 
-        (img_width, img_height, img_binx, img_biny) = img_info
-
         logging.info('Starting ASTAP')
 
-        # convert fov from arcsec to degrees
-        solve_params = PlateSolveParameters()
-        fov_x = self.pixel_scale_arcsecpx*img_width*img_binx/3600.0*u.deg
-        fov_y = self.pixel_scale_arcsecpx*img_height*img_biny/3600.0*u.deg
-        solve_params.fov_x = Angle(fov_x)
-        solve_params.fov_y = Angle(fov_y)
-        solve_params.radec = radec_pos
-        solve_params.width = img_width
-        solve_params.height = img_height
-        solve_params.bin_x = img_binx
-        solve_params.bin_y = img_biny
-
         logging.debug(f'plate_solve_file_ASTAP: solve_parms = {solve_params}')
 
-        solved_j2000 = self.ASTAP.solve_file(fname, solve_params,
-                                                   )
+        if len(self.settings.search_rad_tiers) > 0:
+            solved_j2000, search_rad = self.ASTAP.solve_file_tiered(
+                fname, solve_params, self.settings.search_rad_tiers)
+        else:
+            solved_j2000 = self.ASTAP.solve_file(fname, solve_params)
         if solved_j2000 is None:
             logging.error('Plate solve failed!')
             if os.name == 'posix':
@@ -1482,42 +2037,58 @@ class MyApp:
         logging.info('Plate solve succeeded')
         return solved_j2000
 
-    def plate_solve_file_astromentrynetlocal(self, fname):
-        logging.info('Solving with astrometry.net locally...')
+    def plate_solve_file_astromentrynetlocal(self, fname, use_engine=False,
+                                             search_rad=None):
+        """Solve file with astrometry.net installed locally
 
-        radec_pos = read_radec_from_FITS(fname)
-        img_info = read_image_info_from_FITS(fname)
+        Parameter
+        ---------
+        fname : str
+            Filename of image to be solved.
+        use_engine : bool
+            If True use the resident astrometry-engine process which keeps
+            the index files loaded instead of running solve-field.
+        search_rad : float
+            Number of degrees to search - defaults to
+            astrometrynetlocal_search_rad_deg setting.
 
-        logging.debug(f'{img_info}')
+        Returns
+        -------
+        pos_j2000 : PlateSolveSolution
+            Solution to plate solve or None if it failed.
+        """
+        logging.info('Solving with astrometry.net locally...')
 
-        if radec_pos is None or img_info is None:
-            logging.error(f'plate_solve_file_astromentrynetlocal: error reading radec from FITS file {radec_pos} {img_info}')
+        solve_params = self.solve_params_for_file(fname)
+        if solve_params is None:
             return None
 
-        (img_width, img_height, img_binx, img_biny) = img_info
-
         logging.info('Starting solve-field')
 
-        # convert fov from arcsec to degrees
-        solve_params = PlateSolveParameters()
-        fov_x = self.pixel_scale_arcsecpx*img_width*img_binx/3600.0*u.deg
-        fov_y = self.pixel_scale_arcsecpx*img_height*img_biny/3600.0*u.deg
-        solve_params.pixel_scale = self.pixel_scale_arcsecpx*img_binx
-        solve_params.fov_x = Angle(fov_x)
-        solve_params.fov_y = Angle(fov_y)
-        solve_params.radec = radec_pos
-        solve_params.width = img_width
-        solve_params.height = img_height
-        solve_params.bin_x = img_binx
-        solve_params.bin_y = img_biny
-
         down_val = self.settings.astrometrynetlocal_downsample
 
         logging.debug(f'plate_solve_file_astromentrynetlocal: solve_parms = {solve_params}')
 
-        solved_j2000 = self.astrometrynetlocal.solve_file(fname, solve_params,
-                                                          downsample=down_val,
-                                                          search_rad=self.settings.astrometrynetlocal_search_rad_deg)
+        if use_engine:
+            solver = self.astrometrynetengine
+        else:
+            solver = self.astrometrynetlocal
+
+        extract_stars = self.settings.astrometrynetlocal_extract_stars
+        if search_rad is None and len(self.settings.search_rad_tiers) > 0:
+            solved_j2000, search_rad = solver.solve_file_tiered(
+                fname, solve_params, self.settings.search_rad_tiers,
+                concurrent=self.settings.search_rad_tiers_concurrent,
+                downsample=down_val,
+                extract_stars=extract_stars)
+        else:
+            if search_rad is None:
+                search_rad = self.settings.astrometrynetlocal_search_rad_deg
+
+            solved_j2000 = solver.solve_file(fname, solve_params,
+                                             downsample=down_val,
+                                             search_rad=search_rad,
+                                             extract_stars=extract_stars)
 
         if solved_j2000 is None:
             logging.error('Plate solve failed!')
@@ -1526,25 +2097,139 @@ class MyApp:
         logging.info('Plate solve succeeded')
         return solved_j2000
 
-    def plate_solve_file_astrometry(self, fname):
+    def plate_solve_file_native(self, fname):
+        logging.info('Solving with built in solver...')
+
+        solve_params = self.solve_params_for_file(fname)
+        if solve_params is None:
+            return None
+
+        logging.debug(f'plate_solve_file_native: solve_parms = {solve_params}')
+
+        search_rad = self.settings.native_search_rad_deg
+        solved_j2000 = self.native_solver.solve_file(fname, solve_params,
+                                                     search_rad=search_rad)
+
+        if solved_j2000 is None:
+            logging.error('Plate solve failed!')
+            return None
+
+        logging.info('Plate solve succeeded')
+        return solved_j2000
+
+    def get_astrometry_client(self):
+        """
+        Get the astrometry.net client, logging in if needed.
+
+        One client is shared by all solves - it keeps a connection per
+        thread open and caches the login session in the config directory.
+
+        Returns
+        -------
+        client : Client
+            Logged in client or None if login failed.
+        """
+        with self.astroclient_lock:
+            if self.astroclient is None:
+                session_cache = os.path.join(self.settings._get_config_dir(),
+                                             'astrometry_session.json')
+                if not os.path.isdir(self.settings._get_config_dir()):
+                    session_cache = None
+                self.astroclient = Client(self.settings.astrometry_api_url,
+                                          session_cache_file=session_cache)
+
+            if self.astroclient.session is None:
+                logging.info('Logging into astrometry.net...')
+                try:
+                    self.astroclient.login(self.settings.astrometry_apikey)
+                except (RequestError, OSError) as e:
+                    logging.error(f'Failed to login to astromentry.net -> {e}')
+                    return None
+
+            return self.astroclient
+
+    def get_astrometry_jobs(self):
+        """
+        Get the tracker which waits for astrometry.net jobs.
 
-        # connect
-        # FIXME this might leak since we create it each plate solve attempt?
-        self.astroclient = Client()
+        One tracker is shared by all solves so polling for many outstanding
+        jobs is done together with backoff instead of one loop per job.
 
-        logging.info('Logging into astrometry.net...')
+        Returns
+        -------
+        tracker : JobTracker
+            Job tracker or None if login failed.
+        """
+        astroclient = self.get_astrometry_client()
+        if astroclient is None:
+            return None
 
+        with self.astroclient_lock:
+            if self.astrometry_jobs is None:
+                self.astrometry_jobs = JobTracker(
+                    astroclient,
+                    initial_delay=self.settings.astrometry_poll_min_delay,
+                    max_delay=self.settings.astrometry_poll_max_delay)
+            return self.astrometry_jobs
+
+    def extract_upload_sources(self, fname):
+        """
+        Find stars in an image to upload to astrometry.net.
+
+        Parameters
+        ----------
+        fname : str
+            Image filename.
+
+        Returns
+        -------
+        sources : (list, list, int, int)
+            X and Y (1-indexed, brightest first) of the stars and the image
+            width and height or None if no stars were found.
+        """
         try:
-            self.astroclient.login(self.settings.astrometry_apikey)
-        except RequestError as e:
-            logging.error(f'Failed to login to astromentry.net -> {e}')
+            data = fits.getdata(fname)
+        except Exception as e:
+            logging.error(f'extract_upload_sources: unable to read {fname} -> {e}')
+            return None
+        if data.ndim > 2:
+            data = data.reshape(-1, *data.shape[-2:])[0]
+
+        if self.upload_star_extractor is None:
+            max_stars = self.settings.astrometry_upload_max_stars
+            self.upload_star_extractor = StarExtractor(max_stars=max_stars)
+        x, y, _ = self.upload_star_extractor.extract(data)
+
+        height, width = data.shape
+        logging.info(f'Extracted {len(x)} stars from {width} x {height} image')
+        if len(x) == 0:
+            logging.error('extract_upload_sources: no stars found!')
+            return None
+        # hundredths of a pixel is plenty and keeps the request small
+        return [round(v + 1, 2) for v in x], [round(v + 1, 2) for v in y], width, height
+
+    def submit_astrometry_job(self, fname):
+        """
+        Upload an image to astrometry.net and start tracking its job.
+
+        Parameters
+        ----------
+        fname : str
+            Image filename.
+
+        Returns
+        -------
+        job : (Future, int, int)
+            Future for the job calibration, the image binning and the
+            binning applied before upload or None if the upload failed.
+        """
+        tracker = self.get_astrometry_jobs()
+        if tracker is None:
             return None
 
         time_start = time.time()
         timeout = self.settings.astrometry_timeout
 
-#        timeout = 120  # timeout in seconds
-
         logging.info('Uploading image to astrometry.net...')
 
         kwargs = {}
@@ -1553,94 +2238,107 @@ class MyApp:
 
         # if image already binned lets skip having astrometry.net downsample
         downsample = self.settings.astrometry_downsample_factor
-        img_info = read_image_info_from_FITS(fname)
+        binning = 1
+        info = read_image_header(fname)
+        img_info = None if info is None else info.image_info()
         if img_info is None:
             logging.warning('plate_solve_file_astrometry: couldnt read image info!')
         else:
             (_, _, binx, biny) = img_info
+            binning = binx
             if binx != 1 and biny != 1:
                 logging.info('plate_solve_file_astrometry: overriding downsample to 1')
                 downsample = 1
 
+        # bin and compress image here instead of uploading the raw frame
+        # or just send the stars found in it
+        fileobj = None
+        sources = None
+        reduction = 1
+        upload_format = self.settings.astrometry_upload_format
+        if upload_format == 'stars':
+            sources = self.extract_upload_sources(fname)
+            if sources is None:
+                return None
+            downsample = 1
+        elif upload_format != 'raw':
+            fileobj = reduce_image_file(fname, factor=downsample, fmt=upload_format)
+            if fileobj is None:
+                return None
+            reduction = max(1, downsample)
+            kwargs['scale_est'] = self.pixel_scale_arcsecpx*reduction
+            downsample = 1
+
         kwargs['downsample_factor'] = downsample
 
-        upres = self.astroclient.upload(fname, **kwargs)
+        try:
+            if sources is not None:
+                upres = tracker.client.upload_sources(*sources, **kwargs)
+            else:
+                upres = tracker.client.upload(fname, fileobj=fileobj, **kwargs)
+        except (RequestError, OSError) as e:
+            logging.error(f'upload failed -> {e}')
+            return None
         logging.info(f'upload result = {upres}')
 
-        if upres['status'] != 'success':
+        if upres is None or upres['status'] != 'success':
             logging.error('upload failed!')
             return None
 
         logging.info('Upload successful')
 
-        sub_id = upres['subid']
-
-        loop_count = 0
-        if sub_id is not None:
-            while True:
-                msgstr = "Checking job status"
-                for i in range(0, loop_count % 4):
-                    msgstr = msgstr + '.'
-                if (loop_count % 5) == 0:
-                    logging.debug(msgstr)
-
-                if (loop_count % 10) == 0:
-                    stat = self.astroclient.sub_status(sub_id, justdict=True)
-    #                print('Got sub status:', stat)
-                    jobs = stat.get('jobs', [])
-                    if len(jobs):
-                        for j in jobs:
-                            if j is not None:
-                                break
-                        if j is not None:
-                            logging.info(f'Selecting job id {j}')
-                            solved_id = j
-                            break
-
-                loop_count += 1
-                if loop_count > 30:
-                    loop_count = 0
-
-                if time.time() - time_start > timeout:
-                    logging.error('astrometry.net solve timeout!')
-                    return None
-
-                time.sleep(0.5)
-
-        logging.info(f'Job started - id = {solved_id}')
+        # timeout covers the upload as well as the solve
+        remaining = timeout - (time.time() - time_start)
+        future = tracker.track(upres['subid'], timeout=max(0, remaining))
+        return future, binning, reduction
 
-        while True:
-            job_stat = self.astroclient.job_status(solved_id)
-
-            if job_stat == 'success':
-                break
-
-            if time.time() - time_start > timeout:
-                logging.error('astrometry.net solve timeout!')
-                return None
-
-            time.sleep(5)
-
-        final = self.astroclient.job_status(solved_id)
-
-#        print("final job status =", final)
+    def astrometry_job_solution(self, future, binning, reduction=1):
+        """
+        Wait for an astrometry.net job and convert its calibration.
+
+        Parameters
+        ----------
+        future : Future
+            Future from :meth:`submit_astrometry_job`.
+        binning : int
+            Binning of the image.
+        reduction : int
+            Binning applied to the image before upload - the solved pixel
+            scale is divided by this to match the image.
 
-        if final != 'success':
-            logging.error("Plate solve failed!")
-            logging.error(final)
+        Returns
+        -------
+        solution : PlateSolveSolution
+            Solution or None if the solve failed.
+        """
+        try:
+            final_calib = future.result()
+        except TimeoutError:
+            logging.error('astrometry.net solve timeout!')
+            return None
+        except JobFailed as e:
+            logging.error(f'Plate solve failed! {e}')
+            return None
+        except (RequestError, OSError) as e:
+            logging.error(f'Error checking astrometry.net job -> {e}')
             return None
 
-        final_calib = self.astroclient.job_calib_result(solved_id)
         logging.info(f'final_calib = {final_calib}')
 
         logging.info(f'Plate solve succeeded')
 
         radec = SkyCoord(ra=final_calib['ra']*u.degree, dec=final_calib['dec']*u.degree, frame='fk5', equinox='J2000')
 
-        _, _, binx, _ = img_info
-        return PlateSolveSolution(radec, pixel_scale=final_calib['pixscale'],
+        return PlateSolveSolution(radec, pixel_scale=final_calib['pixscale']/reduction,
                                   angle=Angle(final_calib['orientation']*u.deg),
-                                  binning = binx)
+                                  binning=binning)
+
+    def plate_solve_file_astrometry(self, fname):
+        job = self.submit_astrometry_job(fname)
+        if job is None:
+            return None
+
+        return self.astrometry_job_solution(*job)
 
     def target_goto(self):
         target = self.target_j2000
@@ -1661,16 +2359,29 @@ class MyApp:
                       f'{target_jnow.ra.to_string(u.hour, sep=":", pad=True)} ' \
                       f'{target_jnow.dec.to_string(alwayssign=True, sep=":", pad=True)}')
 
+        model = self.open_pointing_model()
+        if model is not None:
+            ra, dec = model.corrected_position(target_jnow.ra.degree,
+                                               target_jnow.dec.degree,
+                                               self.local_sidereal_time())
+            target_jnow = SkyCoord(ra=ra*u.degree, dec=dec*u.degree,
+                                   frame=target_jnow.frame)
+            ra_str = target_jnow.ra.to_string(u.hour, sep=":", pad=True)
+            dec_str = target_jnow.dec.to_string(alwayssign=True, sep=":", pad=True)
+            logging.debug(f'target_goto()): Pointing model corrected JNOW '
+                          f'{ra_str} {dec_str}')
+
         self.tel.goto(target_jnow)
 
         logging.info("Slew started!")
 
-        while True:
-            logging.debug(f"Slewing = {self.tel.is_slewing()}")
-            if not self.tel.is_slewing():
-                logging.info("Slew done!")
-                break
-            time.sleep(1)
+        if not self.tel.wait_for_slew(timeout=self.settings.slew_timeout):
+            logging.error(f'target_goto(): Slew did not finish within '
+                          f'{self.settings.slew_timeout} seconds!')
+            return False
+
+        logging.info("Slew done!")
+        return True
 
 
 if __name__ == '__main__':
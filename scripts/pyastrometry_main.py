@@ -87,6 +87,7 @@ from pyastrometry.Telescope import Telescope
 
 
 from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.ExposureManager import ExposureManager
 if BACKEND == 'ASCOM':
     from pyastrometry.PlateSolve2 import PlateSolve2
 if BACKEND == 'INDI':
@@ -766,6 +767,7 @@ class MyApp(QtWidgets.QMainWindow):
 
         # init vars
         self.solved_j2000 = None
+        self.exposure = None
 
         self.target_j2000 = None
 
@@ -795,7 +797,11 @@ class MyApp(QtWidgets.QMainWindow):
 
     def poll_curpos_CB(self):
         if self.tel.is_connected():
-            self.set_current_position_labels(self.tel.get_position_j2000())
+            # read directly if the mount is not polled in background
+            state = self.tel.get_state(max_age=1.0)
+            if state is not None:
+                self.set_current_position_labels(state.position_j2000(),
+                                                 state.position_jnow())
         #self.set_target_position_labels(self.tel.get_target_j2000())
 
         # set button states
@@ -814,9 +820,10 @@ class MyApp(QtWidgets.QMainWindow):
     def hide_activity_bar(self):
         self.ui.statusbar.removeWidget(self.activity_bar)
 
-    def set_current_position_labels(self, pos_j2000):
+    def set_current_position_labels(self, pos_j2000, pos_jnow=None):
         self.store_skycoord_to_label(pos_j2000, self.ui.cur_ra_j2000_label, self.ui.cur_dec_j2000_label)
-        pos_jnow = precess_J2000_to_JNOW(pos_j2000)
+        if pos_jnow is None:
+            pos_jnow = precess_J2000_to_JNOW(pos_j2000)
         self.store_skycoord_to_label(pos_jnow, self.ui.cur_ra_jnow_label, self.ui.cur_dec_jnow_label)
 
     def set_solved_position_labels(self, pos_j2000):
@@ -880,6 +887,9 @@ class MyApp(QtWidgets.QMainWindow):
                                                QtWidgets.QMessageBox.Ok)
                 return
 
+            # mount is read on a background thread so the GUI never waits on it
+            self.tel.start_poller()
+
     def select_indi_camera(self):
 
         last_choice = ''
@@ -967,7 +977,8 @@ class MyApp(QtWidgets.QMainWindow):
         # convert to jnow
         solved_jnow = precess_J2000_to_JNOW(self.solved_j2000.radec)
 
-        sep = self.solved_j2000.radec.separation(self.tel.get_position_j2000()).degree
+        curpos = self.tel.get_cached_position_j2000(max_age=1)
+        sep = self.solved_j2000.radec.separation(curpos).degree
         logging.info(f"Sync pos is {sep} degrees from current pos")
 
         # get confirmation
@@ -1085,25 +1096,27 @@ class MyApp(QtWidgets.QMainWindow):
         ff = os.path.join(os.getcwd(), "plate_solve_image.fits")
 
         focus_expos = self.settings.camera_exposure
-        # reset frame to full sensor
-        self.cam.set_binning(1, 1)
-        width, height = self.cam.get_size()
-        self.cam.set_frame(0, 0, width, height)
+
+        if self.exposure is None or self.exposure.cam is not self.cam:
+            self.exposure = ExposureManager(self.cam)
+
         logging.info(f'setting binning to {self.settings.camera_binning}')
-        self.cam.set_binning(self.settings.camera_binning, self.settings.camera_binning)
-        self.cam.start_exposure(focus_expos)
+        if not self.exposure.configure(self.settings.camera_binning) or \
+           not self.exposure.start(focus_expos):
+            CriticalDialog('Could not start exposure!').exec()
+            return
 
         # give things time to happen (?) I get Maxim not ready errors so slowing it down
         time.sleep(0.25)
 
-        elapsed = 0
-        while not self.cam.check_exposure():
-            self.ui.statusbar.showMessage(f"Taking image with camera {elapsed} of {focus_expos} seconds")
+        def show_progress(elapsed, exposure):
+            self.ui.statusbar.showMessage(f"Taking image with camera "
+                                          f"{elapsed:.1f} of {exposure} seconds")
             self.app.processEvents()
-            time.sleep(0.5)
-            elapsed += 0.5
-            if elapsed > focus_expos:
-                elapsed = focus_expos
+
+        if not self.exposure.wait(callback=show_progress):
+            CriticalDialog('Error taking image!').exec()
+            return
 
         # give it some time seems like Maxim isnt ready if we hit it too fast
         time.sleep(0.5)
@@ -1549,13 +1562,11 @@ class MyApp(QtWidgets.QMainWindow):
         while True:
             self.ui.statusbar.showMessage("Slewing...")
             self.app.processEvents()
-            logging.info(f"Slewing = {self.tel.is_slewing()}")
-            if not self.tel.is_slewing():
+            if self.tel.wait_for_slew(timeout=0.1):
                 logging.info("Slew done!")
                 self.ui.statusbar.showMessage("Slew complete")
                 self.app.processEvents()
                 break
-            time.sleep(1)
 
     def edit_settings_cb(self):
         class EditDialog(QtWidgets.QDialog):
@@ -78,7 +78,8 @@ setup(
 
     entry_points={},
 
-    scripts=['scripts/pyastrometry_cli_main.py'],
+    scripts=['scripts/pyastrometry_cli_main.py',
+             'scripts/pyastrometry_build_catalog.py'],
 
     project_urls={  # Optional
 #        'Bug Reports': 'https://github.com/pypa/sampleproject/issues',
@@ -0,0 +1,156 @@
+import io
+import json
+import http.client
+from urllib.parse import parse_qs
+
+import numpy as np
+import pytest
+
+from pyastrometry.AstrometryNetClient import Client, MultipartFileBody
+
+FILE_DATA = bytes(range(256))*1000
+
+
+class FakeResponse:
+    status = 200
+    reason = 'OK'
+    headers = {}
+    will_close = False
+
+    def read(self):
+        return b'{"status": "success", "subid": 3}'
+
+
+class FakeConnection:
+    # reads the request body like http.client and drops the connection
+    # part way through the first request
+    def __init__(self, bodies, disconnect):
+        self.bodies = bodies
+        self.disconnect = disconnect
+
+    def request(self, method, path, body, headers):
+        data = body.read(5000) if hasattr(body, 'read') else body
+        if self.disconnect:
+            self.disconnect = False
+            raise http.client.RemoteDisconnected('closed')
+        if hasattr(body, 'read'):
+            data += body.read()
+        self.bodies.append((path, data, headers))
+
+    def getresponse(self):
+        return FakeResponse()
+
+    def close(self):
+        pass
+
+
+def expected_body(boundary, json_args, filename, data):
+    return (f'--{boundary}\r\n'
+            f'Content-Type: text/plain\r\n'
+            f'MIME-Version: 1.0\r\n'
+            f'Content-disposition: form-data; name="request-json"\r\n'
+            f'\r\n'
+            f'{json_args}\r\n'
+            f'--{boundary}\r\n'
+            f'Content-Type: application/octet-stream\r\n'
+            f'MIME-Version: 1.0\r\n'
+            f'Content-disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+
+
+def test_multipart_body():
+    body = MultipartFileBody('{"a": 1}', 'm31.fits', io.BytesIO(FILE_DATA))
+    expected = expected_body(body.boundary, '{"a": 1}', 'm31.fits', FILE_DATA)
+    assert len(body) == len(expected)
+    assert body.read() == expected
+    assert body.read() == b''
+    assert body.content_type == f'multipart/form-data; boundary="{body.boundary}"'
+
+
+@pytest.mark.parametrize('size', [1, 7, 100, 4096, 300000])
+def test_multipart_body_chunks(size):
+    body = MultipartFileBody('{}', 'a.fits', io.BytesIO(FILE_DATA))
+    chunks = []
+    while True:
+        chunk = body.read(size)
+        if not chunk:
+            break
+        assert len(chunk) <= size
+        chunks.append(chunk)
+    assert b''.join(chunks) == expected_body(body.boundary, '{}', 'a.fits', FILE_DATA)
+
+
+def test_multipart_body_rewind():
+    # only the data after the starting position of the file is sent
+    f = io.BytesIO(b'skip' + FILE_DATA)
+    f.seek(4)
+    body = MultipartFileBody('{}', 'a.fits', f)
+    expected = expected_body(body.boundary, '{}', 'a.fits', FILE_DATA)
+    assert len(body) == len(expected)
+
+    assert body.read(len(expected)//2) == expected[:len(expected)//2]
+    body.seek(0)
+    assert body.read() == expected
+
+    with pytest.raises(ValueError):
+        body.seek(10)
+
+
+def test_multipart_body_short_file():
+    f = io.BytesIO(FILE_DATA)
+    body = MultipartFileBody('{}', 'a.fits', f)
+    f.truncate(100)
+    with pytest.raises(IOError):
+        body.read()
+
+
+def test_upload_resent_after_disconnect(tmp_path, monkeypatch):
+    fname = tmp_path / 'm31.fits'
+    fname.write_bytes(FILE_DATA)
+
+    bodies = []
+    client = Client('http://localhost/api')
+    conns = [FakeConnection(bodies, disconnect=True), FakeConnection(bodies, False)]
+    monkeypatch.setattr(client, '_get_connection', lambda: conns[0])
+    monkeypatch.setattr(client, 'close', lambda: conns.pop(0))
+
+    assert client.upload(str(fname)) == {'status': 'success', 'subid': 3}
+
+    # the whole body is sent again on a new connection
+    assert len(bodies) == 1
+    path, data, headers = bodies[0]
+    assert path == '/api/upload'
+    boundary = headers['Content-type'].split('boundary=')[1].strip('"')
+    json_args = data.split(b'\r\n')[5].decode()
+    assert data == expected_body(boundary, json_args, str(fname), FILE_DATA)
+    assert int(headers['Content-Length']) == len(data)
+
+
+def test_upload_sources_fields(monkeypatch):
+    bodies = []
+    client = Client('http://localhost/api')
+    client.session = 'abc'
+    monkeypatch.setattr(client, '_get_connection',
+                        lambda: FakeConnection(bodies, disconnect=False))
+
+    x = np.array([1.5, 20.25, 300.0], dtype=np.float32)
+    y = np.array([2, 40, 600], dtype=np.int64)
+    result = client.upload_sources(x, y, np.int64(3000), 2000.0,
+                                   scale_est=np.float64(1.5),
+                                   scale_units='arcsecperpix', downsample_factor=1)
+    assert result['subid'] == 3
+
+    # star list sent as plain JSON numbers with no file
+    path, data, headers = bodies[0]
+    assert path == '/api/upload'
+    assert headers['Content-type'] == 'application/x-www-form-urlencoded'
+    args = json.loads(parse_qs(data.decode())['request-json'][0])
+    assert args == {'session': 'abc',
+                    'x': [1.5, 20.25, 300.0], 'y': [2.0, 40.0, 600.0],
+                    'image_width': 3000, 'image_height': 2000,
+                    'scale_est': 1.5, 'scale_units': 'arcsecperpix',
+                    'downsample_factor': 1,
+                    'allow_commercial_use': 'd', 'allow_modifications': 'd',
+                    'publicly_visible': 'y'}
+    assert isinstance(args['image_height'], int)
+    assert isinstance(args['y'][0], float)
@@ -0,0 +1,137 @@
+import time
+import threading
+
+import pytest
+
+from pyastrometry.AstrometryNetClient import RequestError, ServerBusy
+from pyastrometry.AstrometryNetJobs import Backoff, JobTracker, JobFailed
+
+
+class FakeClient:
+    # answers from lists of canned responses - an exception is raised
+    # instead of returned
+    def __init__(self, sub_status, job_status):
+        self.sub_responses = list(sub_status)
+        self.job_responses = list(job_status)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _answer(self, name, responses):
+        with self.lock:
+            self.calls.append((name, time.monotonic()))
+            answer = responses.pop(0) if len(responses) > 1 else responses[0]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def sub_status(self, sub_id, justdict=False):
+        assert justdict
+        return self._answer('sub_status', self.sub_responses)
+
+    def job_status(self, job_id):
+        assert job_id == 7
+        return self._answer('job_status', self.job_responses)
+
+    def job_calib_result(self, job_id):
+        return self._answer('job_calib_result', [{'ra': 10.0}])
+
+
+@pytest.fixture
+def tracker():
+    trackers = []
+
+    def make(client, **kwargs):
+        kwargs.setdefault('initial_delay', 0.01)
+        kwargs.setdefault('max_delay', 0.05)
+        tracker = JobTracker(client, **kwargs)
+        trackers.append(tracker)
+        return tracker
+
+    yield make
+    for t in trackers:
+        t.shutdown()
+
+
+def test_backoff_delays(monkeypatch):
+    monkeypatch.setattr('random.random', lambda: 0.0)
+    backoff = Backoff(initial=1.0, maximum=5.0, factor=2.0, jitter=0.5)
+    assert [backoff.next_delay() for _ in range(5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+    backoff.reset()
+    assert backoff.next_delay() == 1.0
+
+
+def test_backoff_jitter():
+    backoff = Backoff(initial=2.0, maximum=2.0, jitter=0.25)
+    delays = [backoff.next_delay() for _ in range(200)]
+    assert min(delays) >= 1.5
+    assert max(delays) <= 2.0
+    assert len(set(delays)) > 1
+
+
+def test_track_success(tracker):
+    client = FakeClient([{'jobs': []}, {'jobs': [None]}, {'jobs': [7]}],
+                        ['solving', 'solving', 'success'])
+    jobs = tracker(client)
+    assert jobs.track(1, timeout=10).result(timeout=10) == {'ra': 10.0}
+    assert [name for name, _ in client.calls] == \
+           ['sub_status']*3 + ['job_status']*3 + ['job_calib_result']
+    assert jobs.outstanding == 0
+
+
+def test_track_many(tracker):
+    client = FakeClient([{'jobs': [7]}], ['success'])
+    jobs = tracker(client, max_workers=2)
+    futures = [jobs.track(sub_id, timeout=10) for sub_id in range(10)]
+    assert all(f.result(timeout=10) == {'ra': 10.0} for f in futures)
+    assert jobs.outstanding == 0
+
+
+def test_track_job_failed(tracker):
+    client = FakeClient([{'jobs': [7]}], ['solving', 'failure'])
+    jobs = tracker(client)
+    with pytest.raises(JobFailed):
+        jobs.track(1, timeout=10).result(timeout=10)
+    assert jobs.outstanding == 0
+
+
+def test_track_no_status(tracker):
+    client = FakeClient([None], ['success'])
+    jobs = tracker(client)
+    with pytest.raises(RequestError):
+        jobs.track(1, timeout=10).result(timeout=10)
+    assert jobs.outstanding == 0
+
+
+def test_track_timeout(tracker):
+    client = FakeClient([{'jobs': [7]}], ['solving'])
+    jobs = tracker(client)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        jobs.track(1, timeout=0.2).result(timeout=10)
+    assert time.monotonic() - start < 2
+    assert jobs.outstanding == 0
+
+
+def test_server_busy_retry_after(tracker):
+    client = FakeClient([ServerBusy('busy', retry_after=0.3), {'jobs': [7]}],
+                        ['success'])
+    jobs = tracker(client)
+    assert jobs.track(1, timeout=10).result(timeout=10) == {'ra': 10.0}
+
+    # the call is retried once the time the server asked for has passed -
+    # allowing for the event loop clock resolution
+    (_, busy), (_, retry) = client.calls[:2]
+    assert retry - busy >= 0.29
+
+
+def test_server_busy_default_wait(tracker):
+    client = FakeClient([ServerBusy('busy'), ServerBusy('busy'), {'jobs': [7]}],
+                        ['success'])
+    jobs = tracker(client, max_delay=0.1)
+    assert jobs.track(1, timeout=10).result(timeout=10) == {'ra': 10.0}
+
+    times = [t for name, t in client.calls if name == 'sub_status']
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.09
+    assert times[2] - times[1] >= 0.09
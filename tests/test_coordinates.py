@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.coordinates import Angle, SkyCoord
+
+from pyastrometry.Coordinates import format_ra, format_dec, format_radec
+
+
+def dms(sign, d, m, s):
+    return sign*(d + m/60 + s/3600)
+
+
+def astropy_ra(ra, precision=None):
+    return Angle(ra*u.degree).to_string(u.hour, sep=':', pad=True, precision=precision)
+
+
+def astropy_dec(dec, precision=None):
+    return Angle(dec*u.degree).to_string(alwayssign=True, sep=':', pad=True,
+                                         precision=precision)
+
+
+def sample_values(seed=0):
+    # seconds kept away from 60 - see test_no_false_carry
+    rng = np.random.default_rng(seed)
+    n = 2000
+    sign = rng.choice([-1, 1], n)
+    return dms(sign, rng.integers(0, 90, n), rng.integers(0, 60, n),
+               rng.uniform(0, 59, n))
+
+
+@pytest.mark.parametrize('precision', [0, 2, 3, 5])
+def test_matches_angle_to_string(precision):
+    dec = sample_values()
+    ra = 15*np.abs(sample_values(seed=2)) % 360.0
+    assert list(format_dec(dec, precision=precision)) == \
+           [astropy_dec(d, precision) for d in dec]
+    assert list(format_ra(ra, precision=precision)) == \
+           [astropy_ra(r, precision) for r in ra]
+
+
+@pytest.mark.parametrize('value', [dms(1, 10, 59, 59.9996), dms(-1, 10, 59, 59.9996),
+                                   dms(1, 0, 0, 0.00049), dms(-1, 0, 0, 0.00049),
+                                   dms(-1, 0, 30, 0), dms(1, 89, 59, 59.99996),
+                                   0.0, 10.0])
+def test_sign_and_carry(value):
+    # carries into minutes and degrees, small negative values
+    assert format_dec(value, precision=3) == astropy_dec(value, 3)
+    assert format_ra(abs(value), precision=3) == astropy_ra(abs(value), 3)
+
+
+def test_no_false_carry():
+    # seconds just below a carry keep the minutes
+    assert format_dec(dms(1, 10, 59, 59.9994), precision=3) == '+10:59:59.999'
+    assert format_dec(dms(-1, 10, 59, 59.4), precision=0) == '-10:59:59'
+    assert format_ra(359.9999, precision=2) == '23:59:59.98'
+    assert format_ra(359.999999, precision=2) == '00:00:00.00'
+
+
+def test_full_precision():
+    # default keeps as many digits as Angle.to_string
+    for value, ra_str, dec_str in [(150.123, '10:00:29.52', '+150:07:22.8'),
+                                   (150.0, '10:00:00', '+150:00:00'),
+                                   (-0.5, '23:58:00', '-00:30:00'),
+                                   (10.00000001, '00:40:00.0000024',
+                                    '+10:00:00.000036')]:
+        assert format_ra(value) == ra_str
+        assert format_dec(value) == dec_str
+
+    dec = sample_values(seed=1)
+    matched = [s == astropy_dec(d) for s, d in zip(format_dec(dec), dec)]
+    # last of the 8 digits can differ by float rounding
+    assert np.mean(matched) > 0.99
+
+
+def test_format_radec():
+    pos = SkyCoord(ra=[150.123, 10.0]*u.degree, dec=[-20.5, 45.25]*u.degree,
+                   frame='fk5')
+    ra, dec = format_radec(pos, sep=' ', precision=1)
+    assert list(ra) == ['10 00 29.5', '00 40 00.0']
+    assert list(dec) == ['-20 30 00.0', '+45 15 00.0']
+    assert format_radec(pos[0]) == ('10:00:29.52', '-20:30:00')
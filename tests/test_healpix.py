@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from pyastrometry.HEALPix import ang2pix_nest, pix2ang_nest, query_disc, npix
+
+
+def disc_points(ra0, dec0, radius, n=200000, seed=1):
+    # random points inside a disc including its edge
+    rng = np.random.default_rng(seed)
+    d = np.radians(radius)*np.sqrt(rng.uniform(0, 1, n))
+    d[:n//10] = np.radians(radius)
+    b = rng.uniform(0, 2*np.pi, n)
+    dec0 = np.radians(dec0)
+
+    sin_dec = np.sin(dec0)*np.cos(d) + np.cos(dec0)*np.sin(d)*np.cos(b)
+    dec = np.arcsin(np.clip(sin_dec, -1, 1))
+    dra = np.arctan2(np.sin(b)*np.sin(d)*np.cos(dec0),
+                     np.cos(d) - np.sin(dec0)*sin_dec)
+    return (ra0 + np.degrees(dra)) % 360.0, np.degrees(dec)
+
+
+@pytest.mark.parametrize('nside', [1, 8, 64])
+def test_pix2ang_round_trip(nside):
+    pix = np.arange(npix(nside))
+    ra, dec = pix2ang_nest(nside, pix)
+    np.testing.assert_array_equal(ang2pix_nest(nside, ra, dec), pix)
+
+
+@pytest.mark.parametrize('ra0, dec0, radius', [(0.1, 89.5, 2.0), (180.0, -89.9, 0.5),
+                                               (359.9, 0.0, 1.0), (0.2, 45.0, 3.0),
+                                               (100.0, 20.0, 60.0)])
+@pytest.mark.parametrize('nside', [64, 256])
+def test_query_disc_covers_disc(ra0, dec0, radius, nside):
+    ra, dec = disc_points(ra0, dec0, radius)
+    needed = np.unique(ang2pix_nest(nside, ra, dec))
+    found = query_disc(nside, ra0, dec0, radius)
+    assert len(np.setdiff1d(needed, found)) == 0
+
+
+@pytest.mark.parametrize('ra0, dec0, radius', [(0.1, 89.5, 2.0), (359.9, 0.0, 1.0)])
+def test_query_disc_matches_healpy(ra0, dec0, radius):
+    hp = pytest.importorskip('healpy')
+    vec = hp.ang2vec(ra0, dec0, lonlat=True)
+    for nside in [64, 256]:
+        ref = hp.query_disc(nside, vec, np.radians(radius), nest=True,
+                            inclusive=True)
+        found = query_disc(nside, ra0, dec0, radius)
+        assert len(np.setdiff1d(ref, found)) == 0
+        # only a thin ring of extra pixels
+        assert len(found) < 1.2*len(ref)
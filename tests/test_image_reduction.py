@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+import astropy.io.fits as pyfits
+
+from pyastrometry.ImageReduction import bin_image, reduce_image, reduce_image_file
+from pyastrometry.StarExtractor import StarExtractor
+
+
+def star_field(height=900, width=1301, nstars=40, seed=4):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(30, width - 30, nstars)
+    y = rng.uniform(30, height - 30, nstars)
+    flux = 10**rng.uniform(4.5, 6, nstars)
+
+    yy, xx = np.mgrid[0:height, 0:width]
+    img = np.full((height, width), 1000.0, dtype=np.float32)
+    img += rng.normal(0, 10, img.shape).astype(np.float32)
+    s = 2.5
+    for sx, sy, f in zip(x, y, flux):
+        r2 = (xx - sx)**2 + (yy - sy)**2
+        img += (f/(2*np.pi*s*s)*np.exp(-r2/(2*s*s))).astype(np.float32)
+    return img, x, y
+
+
+def read_reduced(fileobj):
+    with pyfits.open(fileobj) as hdulist:
+        hdu = hdulist[-1]
+        return hdu.data.copy(), hdu.header.copy(), len(hdulist)
+
+
+def test_bin_image():
+    data = np.arange(8*11, dtype=np.uint16).reshape(8, 11)
+    binned = bin_image(data, 3)
+    assert binned.shape == (2, 3)
+    assert binned.dtype == np.float32
+
+    # one row and column trimmed from each side
+    assert binned[0, 0] == pytest.approx(data[1:4, 1:4].mean())
+    assert binned[1, 2] == pytest.approx(data[4:7, 7:10].mean())
+
+    unbinned = bin_image(data, 1)
+    assert unbinned.dtype == np.float32
+    np.testing.assert_array_equal(unbinned, data)
+
+
+def binned_position(x, size, factor):
+    # binned pixel coordinate of original coordinate x when the edges
+    # trimmed are split evenly
+    trim = (size - (size//factor)*factor)//2
+    return (x - trim - (factor - 1)/2)/factor
+
+
+@pytest.mark.parametrize('factor', [2, 3, 4])
+def test_reduce_geometry(factor):
+    img, x, y = star_field()
+    height, width = img.shape
+    data, header, _ = read_reduced(reduce_image(img, factor, fmt='fits'))
+    assert data.shape == (height//factor, width//factor)
+    assert (header['REDBIN'], header['REDW'], header['REDH']) == (factor, width, height)
+
+    # center of reduced image within half an original pixel of the center
+    for size, bsize in [(width, data.shape[1]), (height, data.shape[0])]:
+        assert abs(binned_position((size - 1)/2, size, factor) - (bsize - 1)/2) \
+            <= 0.5/factor
+
+    bx, by, _ = StarExtractor().extract(data.astype(np.float32))
+    ex = binned_position(x, width, factor)
+    ey = binned_position(y, height, factor)
+    d = np.hypot(bx[:, None] - ex[None, :], by[:, None] - ey[None, :])
+    match = d.argmin(axis=1)
+    good = d.min(axis=1) < 0.3
+    assert np.count_nonzero(good) >= 35
+
+    # star separations shrink by the binning so the solved pixel scale of
+    # the reduced image is factor times that of the original
+    for binned, orig in [(bx, x), (by, y)]:
+        slope, _ = np.polyfit(orig[match[good]], binned[good], 1)
+        assert 1/slope == pytest.approx(factor, rel=1e-3)
+
+
+def test_reduce_formats():
+    img, _, _ = star_field(height=300, width=400)
+    img[0, 0] = 70000
+    img[0, 1] = -5
+
+    data, header, nhdu = read_reduced(reduce_image(img, 1, fmt='fits'))
+    assert nhdu == 1 and data.dtype == np.uint16
+    assert data[0, 0] == 65535 and data[0, 1] == 0
+    assert data[100, 100] == np.rint(img[100, 100])
+
+    data, header, nhdu = read_reduced(reduce_image(img, 2, fmt='rice'))
+    assert nhdu == 2 and data.dtype == np.uint16
+    assert header['REDBIN'] == 2
+    np.testing.assert_array_equal(data, np.clip(np.rint(bin_image(img, 2)), 0, 65535))
+
+    data, header, nhdu = read_reduced(reduce_image(img, 2, fmt='uint8'))
+    assert nhdu == 1 and data.dtype == np.uint8
+    # background is black and star cores saturate
+    assert np.median(data) == 0
+    assert data.max() == 255
+
+    with pytest.raises(ValueError):
+        reduce_image(img, 2, fmt='jpeg')
+
+
+def test_reduce_color_uses_first_plane():
+    img, _, _ = star_field(height=300, width=400)
+    color = np.stack([img, img*0, img*0])
+    data, _, _ = read_reduced(reduce_image(color, 2, fmt='fits'))
+    expected, _, _ = read_reduced(reduce_image(img, 2, fmt='fits'))
+    np.testing.assert_array_equal(data, expected)
+
+
+def test_reduce_image_file(tmp_path):
+    img, _, _ = star_field(height=300, width=400)
+    fname = str(tmp_path / 'image.fits')
+    pyfits.PrimaryHDU(np.rint(img).astype(np.uint16)).writeto(fname)
+
+    data, header, _ = read_reduced(reduce_image_file(fname, 2, fmt='fits'))
+    assert data.shape == (150, 200)
+    assert reduce_image_file(str(tmp_path / 'missing.fits')) is None
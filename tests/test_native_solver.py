@@ -0,0 +1,96 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from pyastrometry.NativeSolver import NativeSolver
+from pyastrometry.StarCatalog import StarCatalog, CatalogBuilder
+from pyastrometry.TangentPlane import tan_project, tan_deproject, angular_separation
+
+WIDTH = 3000
+HEIGHT = 2000
+SCALE = 1.5
+
+
+class ListExtractor:
+    # stands in for StarExtractor with a known list of stars
+    def __init__(self, x, y, flux):
+        self.stars = (x, y, flux)
+
+    def extract(self, data):
+        return self.stars
+
+
+def make_catalog(location, ra0, dec0, nstars=4000, radius=3.0, seed=2):
+    rng = np.random.default_rng(seed)
+    d = radius*np.sqrt(rng.uniform(0, 1, nstars))
+    b = rng.uniform(0, 2*np.pi, nstars)
+    ra, dec = tan_deproject(d*np.cos(b), d*np.sin(b), ra0, dec0)
+    mag = rng.uniform(6, 14, nstars)
+
+    builder = CatalogBuilder(str(location), nside=64)
+    builder.add(ra, dec, mag)
+    builder.finish()
+    return StarCatalog(str(location)), ra, dec, mag
+
+
+def image_stars(ra, dec, mag, ra0, dec0, angle, nstars=60, seed=3):
+    # catalog stars seen through a TAN WCS with east to the left
+    th = math.radians(angle)
+    s = SCALE/3600
+    cd = s*np.array([[-math.cos(th), math.sin(th)], [math.sin(th), math.cos(th)]])
+    xi, eta = tan_project(ra, dec, ra0, dec0)
+    dx, dy = np.linalg.solve(cd, np.vstack([xi, eta]))
+    x = dx + (WIDTH - 1)/2
+    y = dy + (HEIGHT - 1)/2
+
+    inside = (x > 5) & (x < WIDTH - 5) & (y > 5) & (y < HEIGHT - 5)
+    order = np.argsort(mag[inside])[:nstars]
+    rng = np.random.default_rng(seed)
+    x = x[inside][order] + rng.normal(0, 0.2, len(order))
+    y = y[inside][order] + rng.normal(0, 0.2, len(order))
+    flux = 10**(-0.4*mag[inside][order])
+    return x, y, flux, cd
+
+
+@pytest.mark.parametrize('ra0, dec0, angle', [(151.0, 31.0, 20.0),
+                                              (0.3, -45.0, 250.0)])
+def test_solve_synthetic_field(tmp_path, ra0, dec0, angle):
+    catalog, ra, dec, mag = make_catalog(tmp_path / 'catalog', ra0, dec0)
+    x, y, flux, cd = image_stars(ra, dec, mag, ra0, dec0, angle)
+
+    solver = NativeSolver(catalog, star_extractor=ListExtractor(x, y, flux))
+    hint = SkyCoord(ra=(ra0 + 0.4)*u.degree, dec=(dec0 - 0.3)*u.degree,
+                    frame='fk5', equinox='J2000')
+    params = SimpleNamespace(radec=hint, pixel_scale=1.05*SCALE, bin_x=1)
+    sol = solver.solve_data(np.zeros((HEIGHT, WIDTH)), params, search_rad=1.0)
+
+    assert sol is not None
+    sep = angular_separation(sol.radec.ra.degree, sol.radec.dec.degree, ra0, dec0)
+    assert sep*3600 < 0.5
+    assert sol.pixel_scale == pytest.approx(SCALE, rel=1e-3)
+    expected = -math.degrees(math.atan2(cd[1][0], cd[0][0]))
+    assert (sol.angle.degree - expected + 180) % 360 - 180 == pytest.approx(0, abs=0.01)
+
+
+def test_no_match_far_from_hint(tmp_path):
+    catalog, ra, dec, mag = make_catalog(tmp_path / 'catalog', 151.0, 31.0)
+    x, y, flux, _ = image_stars(ra, dec, mag, 151.0, 31.0, 20.0)
+
+    solver = NativeSolver(catalog, star_extractor=ListExtractor(x, y, flux))
+    hint = SkyCoord(ra=160.0*u.degree, dec=31.0*u.degree, frame='fk5', equinox='J2000')
+    params = SimpleNamespace(radec=hint, pixel_scale=SCALE, bin_x=1)
+    assert solver.solve_data(np.zeros((HEIGHT, WIDTH)), params) is None
+
+
+def test_cone_search_max_stars(tmp_path):
+    catalog, _, _, _ = make_catalog(tmp_path / 'catalog', 151.0, 31.0)
+    center = SkyCoord(ra=151.5*u.degree, dec=30.0*u.degree, frame='fk5')
+    for radius in [0.5, 1.0, 2.5]:
+        full = catalog.cone_search(center, radius)
+        for n in [1, 10, 200]:
+            limited = catalog.cone_search(center, radius, max_stars=n)
+            np.testing.assert_array_equal(limited, full[:n])
@@ -0,0 +1,67 @@
+import math
+import warnings
+
+import numpy as np
+import pytest
+import astropy.io.fits as pyfits
+
+from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.TangentPlane import angular_separation
+
+
+def make_header(ra0, dec0, sip):
+    h = pyfits.Header()
+    h['CTYPE1'] = 'RA---TAN-SIP' if sip else 'RA---TAN'
+    h['CTYPE2'] = 'DEC--TAN-SIP' if sip else 'DEC--TAN'
+    h['CRVAL1'] = ra0
+    h['CRVAL2'] = dec0
+    h['CRPIX1'] = 1500.5
+    h['CRPIX2'] = 1000.5
+    th = math.radians(170)
+    s = 1.5/3600
+    cd = s*np.array([[-math.cos(th), -math.sin(th)], [-math.sin(th), math.cos(th)]])
+    for i in range(2):
+        for j in range(2):
+            h[f'CD{i+1}_{j+1}'] = cd[i][j]
+    if sip:
+        h['A_ORDER'] = 2
+        h['B_ORDER'] = 2
+        h['A_0_2'] = 2e-6
+        h['A_2_0'] = -1e-6
+        h['A_1_1'] = 3e-7
+        h['B_1_1'] = 1.5e-6
+    return h
+
+
+# fields containing the north pole, near the south pole and at RA 0
+@pytest.mark.parametrize('ra0, dec0', [(20.0, 89.7), (200.0, -89.5), (359.8, 31.0)])
+@pytest.mark.parametrize('sip', [False, True])
+def test_matches_astropy_wcs(ra0, dec0, sip):
+    wcs = pytest.importorskip('astropy.wcs')
+    header = make_header(ra0, dec0, sip)
+    sol = PlateSolveSolution.from_wcs_header(header, binning=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        w = wcs.WCS(header)
+
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 2999, 20000)
+    y = rng.uniform(0, 1999, 20000)
+
+    ra, dec = sol.pixel_to_sky(x, y)
+    assert np.all(np.abs(dec) <= 90.0)
+    ra_ref, dec_ref = w.all_pix2world(x, y, 0)
+    assert np.max(angular_separation(ra, dec, ra_ref, dec_ref))*3600 < 1e-6
+
+    xb, yb = sol.sky_to_pixel(ra_ref, dec_ref)
+    tol = 1e-3 if sip else 1e-6
+    assert np.max(np.abs(xb - x)) < tol
+    assert np.max(np.abs(yb - y)) < tol
+
+
+def test_no_wcs():
+    header = make_header(10.0, 20.0, False)
+    sol = PlateSolveSolution.from_wcs_header(header, binning=1)
+    plain = PlateSolveSolution(sol.radec, sol.pixel_scale, sol.angle, 1)
+    assert not plain.has_wcs
+    assert plain.pixel_to_sky(1.0, 2.0) is None
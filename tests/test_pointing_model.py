@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from pyastrometry.PointingModel import PointingModel, GEOMETRY_TERMS, geometry_terms
+
+# ME, MA, CH, NP and index offsets in degrees
+TRUE_GEOMETRY = np.array([300.0, -200.0, 120.0, 60.0])/3600
+TRUE_INDEX = (0.1, -0.05)
+LST = 100.0
+
+
+def true_offset(ha, dec, index=TRUE_INDEX):
+    # mount minus true position for a mount reporting ha/dec
+    dha, ddec = geometry_terms(ha, dec)
+    return dha @ TRUE_GEOMETRY + index[0], ddec @ TRUE_GEOMETRY + index[1]
+
+
+def pointing(mount_ra, mount_dec, index=TRUE_INDEX):
+    # where the mount really points when it reports mount_ra/mount_dec
+    dha, ddec = true_offset(LST - mount_ra, mount_dec, index)
+    return (mount_ra + dha) % 360.0, mount_dec - ddec
+
+
+def add_samples(model, n, index=TRUE_INDEX, seed=0):
+    rng = np.random.default_rng(seed)
+    for ha, dec in zip(rng.uniform(-90, 90, n), rng.uniform(-30, 80, n)):
+        mount_ra = (LST - ha) % 360.0
+        solved_ra, solved_dec = pointing(mount_ra, dec, index)
+        model.add_measurement(LST, mount_ra, dec, solved_ra, solved_dec)
+
+
+def slew_error(model, ra, dec, index=TRUE_INDEX):
+    # arcseconds between target and where a slew corrected by model lands
+    cmd_ra, cmd_dec = model.corrected_position(ra, dec, LST)
+    real_ra, real_dec = pointing(cmd_ra, cmd_dec, index)
+    dra = (real_ra - ra + 180.0) % 360.0 - 180.0
+    return np.hypot(dra*np.cos(np.radians(dec)), real_dec - dec)*3600
+
+
+def test_recovers_terms():
+    model = PointingModel()
+    add_samples(model, 40)
+
+    for name, fit, true in zip(GEOMETRY_TERMS, model.geometry, TRUE_GEOMETRY):
+        assert fit*3600 == pytest.approx(true*3600, abs=0.01), name
+    np.testing.assert_allclose(model.index[model.epoch], TRUE_INDEX, atol=1e-6)
+
+
+def test_corrected_position_cancels_error():
+    model = PointingModel()
+    uncorrected = slew_error(model, 50.0, 20.0)
+    assert uncorrected > 300
+
+    add_samples(model, 40)
+    for ra, dec in [(50.0, 20.0), (150.0, 60.0), (10.0, -20.0), (359.0, 75.0)]:
+        assert slew_error(model, ra, dec) < 0.01
+
+
+def test_index_only_with_few_samples():
+    model = PointingModel(min_geometry_samples=6)
+    add_samples(model, 3)
+    assert np.all(model.geometry == 0)
+    assert model.offset(-40.0, 20.0) == pytest.approx(model.offset(60.0, 70.0))
+
+
+def test_sync_starts_new_epoch():
+    model = PointingModel()
+    add_samples(model, 40)
+
+    # syncing at a position changes the index offsets so the mount reports
+    # the true position there
+    sync_ra, sync_dec = 80.0, 30.0
+    real_ra, real_dec = pointing(sync_ra, sync_dec)
+    geom_ha, geom_dec = true_offset(LST - real_ra, real_dec, index=(0.0, 0.0))
+    synced_index = (-geom_ha, -geom_dec)
+    model.add_sync(LST - real_ra, real_dec)
+
+    for ra, dec in [(80.0, 30.0), (120.0, 50.0), (30.0, -10.0)]:
+        assert slew_error(model, ra, dec, synced_index) < 0.01
+
+    # samples after the sync refine the new index offsets
+    add_samples(model, 10, synced_index, seed=1)
+    np.testing.assert_allclose(model.index[model.epoch], synced_index, atol=1e-6)
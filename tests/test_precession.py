@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.coordinates import SkyCoord, FK5
+from astropy.time import Time
+
+from pyastrometry.Telescope import precess_radec_fast
+from pyastrometry.TangentPlane import angular_separation
+
+EPOCHS = ['1990-01-01T00:00:00', '2019-06-01T21:00:00', '2025-12-31T12:00:00']
+
+
+def positions():
+    ra, dec = np.meshgrid(np.linspace(0, 345, 24),
+                          [-89.99, -89.5, -60, -20, 0, 20, 60, 89.5, 89.99])
+    return ra.ravel(), dec.ravel()
+
+
+@pytest.mark.parametrize('epoch', EPOCHS)
+def test_j2000_to_jnow_matches_astropy(epoch):
+    epoch = Time(epoch, scale='utc')
+    ra, dec = positions()
+    ref = SkyCoord(ra=ra*u.deg, dec=dec*u.deg, frame=FK5(equinox='J2000'))
+    ref = ref.transform_to(FK5(equinox=epoch))
+
+    ra_now, dec_now = precess_radec_fast(ra, dec, epoch)
+    sep = angular_separation(ra_now, dec_now, ref.ra.degree, ref.dec.degree)
+    assert np.max(sep)*3600 < 1e-3
+
+
+@pytest.mark.parametrize('epoch', EPOCHS)
+def test_jnow_to_j2000_matches_astropy(epoch):
+    epoch = Time(epoch, scale='utc')
+    ra, dec = positions()
+    ref = SkyCoord(ra=ra*u.deg, dec=dec*u.deg, frame=FK5(equinox=epoch))
+    ref = ref.transform_to(FK5(equinox='J2000'))
+
+    ra_j2000, dec_j2000 = precess_radec_fast(ra, dec, epoch, to_jnow=False)
+    sep = angular_separation(ra_j2000, dec_j2000, ref.ra.degree, ref.dec.degree)
+    assert np.max(sep)*3600 < 1e-3
+
+
+def test_round_trip():
+    ra, dec = positions()
+    ra_now, dec_now = precess_radec_fast(ra, dec, '2019-06-01T21:00:00')
+    ra2, dec2 = precess_radec_fast(ra_now, dec_now, '2019-06-01T21:00:00',
+                                   to_jnow=False)
+    assert np.max(angular_separation(ra, dec, ra2, dec2))*3600 < 1e-6
@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.coordinates import SkyCoord, Angle
+
+from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.SolutionLog import SolutionLog
+
+# 2019-06-01T00:00:00Z
+DAY = 1559347200.0
+
+
+def make_solution(ra, scale=1.5):
+    radec = SkyCoord(ra=ra*u.degree, dec=20.0*u.degree, frame='fk5', equinox='J2000')
+    return PlateSolveSolution(radec, pixel_scale=scale, angle=Angle(10*u.degree),
+                              binning=2)
+
+
+@pytest.fixture
+def solution_log(tmp_path):
+    log = SolutionLog(str(tmp_path / 'log'))
+    log.append('/data/m31_1.fits', 'astap', make_solution(10.0), 2.0, DAY + 100)
+    log.append('/data/m31_2.fits', 'astap', None, 4.0, DAY + 200)
+    log.append('/data/m42_1.fits', 'native', make_solution(80.0, 1.6), 0.5, DAY + 300)
+    log.append('camera', 'native', make_solution(81.0, 1.7), 1.5, DAY + 86400 + 10)
+    return log
+
+
+def test_empty_log(tmp_path):
+    log = SolutionLog(str(tmp_path / 'log'))
+    assert len(log.records()) == 0
+    assert len(log.query(solver='astap', file='*.fits')) == 0
+    assert log.summary(log.query()) == []
+    assert log.name(12345) is None
+
+
+def test_append_records(solution_log):
+    recs = solution_log.records()
+    assert len(recs) == 4
+    assert [solution_log.name(k) for k in recs['solver']] == \
+           ['astap', 'astap', 'native', 'native']
+    assert recs['ra'][0] == pytest.approx(10.0)
+    assert recs['binning'][0] == 2
+
+    failed = recs[1]
+    assert not failed['solved']
+    assert np.isnan(failed['ra']) and np.isnan(failed['pixel_scale'])
+    assert failed['duration'] == pytest.approx(4.0)
+
+
+def test_query(solution_log):
+    assert len(solution_log.query(solver='astap')) == 2
+    assert len(solution_log.query(solver='unknown')) == 0
+    assert len(solution_log.query(solved=True)) == 3
+    assert len(solution_log.query(solved=False)) == 1
+    assert len(solution_log.query(since=DAY + 200)) == 3
+    assert len(solution_log.query(until=DAY + 200)) == 1
+    assert len(solution_log.query(since=DAY + 200, solver='native')) == 2
+
+
+def test_query_file_glob(solution_log):
+    recs = solution_log.query(file='*/m31_*.fits')
+    assert [solution_log.name(k) for k in recs['file']] == \
+           ['/data/m31_1.fits', '/data/m31_2.fits']
+    assert len(solution_log.query(file='camera')) == 1
+    assert len(solution_log.query(file='*.fit')) == 0
+    assert len(solution_log.query(file='*m42*', solved=False)) == 0
+
+
+def test_summary(solution_log):
+    by_solver = {row['solver']: row
+                 for row in solution_log.summary(solution_log.query())}
+    assert by_solver['astap']['count'] == 2
+    assert by_solver['astap']['solved'] == 1
+    assert by_solver['astap']['mean_duration'] == pytest.approx(3.0)
+    assert by_solver['astap']['median_pixel_scale'] == pytest.approx(1.5)
+    assert by_solver['native']['median_pixel_scale'] == pytest.approx(1.65)
+
+    by_day = solution_log.summary(solution_log.query(), by='day')
+    assert [(row['day'], row['count']) for row in by_day] == \
+           [('2019-06-01', 3), ('2019-06-02', 1)]
+
+    failed = solution_log.summary(solution_log.query(solved=False), by='file')
+    assert failed == [{'file': '/data/m31_2.fits', 'count': 1, 'solved': 0,
+                       'mean_duration': 4.0, 'median_duration': 4.0,
+                       'median_pixel_scale': None}]
+
+    with pytest.raises(ValueError):
+        solution_log.summary(solution_log.query(), by='angle')
+
+
+def test_shared_between_instances(solution_log):
+    # strings added by another process are picked up when needed
+    other = SolutionLog(solution_log.dirname)
+    other.append('/data/new.fits', 'astrometrylocal', None, 9.0, DAY + 500)
+
+    recs = solution_log.query(file='/data/new.fits')
+    assert len(recs) == 1
+    assert solution_log.name(recs['solver'][0]) == 'astrometrylocal'
+
+
+def test_rejects_unknown_format(tmp_path):
+    log = SolutionLog(str(tmp_path / 'log'))
+    log.append('a.fits', 'astap', None, 1.0)
+    with open(log.meta_fname, 'w') as f:
+        json.dump({'version': 99, 'dtype': []}, f)
+
+    log = SolutionLog(str(tmp_path / 'log'))
+    assert not log.append('b.fits', 'astap', None, 1.0)
@@ -0,0 +1,131 @@
+import time
+
+import numpy as np
+import pytest
+import astropy.io.fits as pyfits
+from astropy import units as u
+from astropy.coordinates import SkyCoord, Angle
+
+from pyastrometry.PlateSolveSolution import PlateSolveSolution
+from pyastrometry.SolveCache import SolveCache
+
+
+def write_image(fname, data, compressed=False, extension=False):
+    header = pyfits.Header()
+    header['OBJCTRA'] = '10 00 00'
+    header['OBJCTDEC'] = '+20 00 00'
+    if compressed:
+        hdus = [pyfits.PrimaryHDU(header=header), pyfits.CompImageHDU(data)]
+    elif extension:
+        hdus = [pyfits.PrimaryHDU(header=header), pyfits.ImageHDU(data)]
+    else:
+        hdus = [pyfits.PrimaryHDU(data, header=header)]
+    pyfits.HDUList(hdus).writeto(fname)
+
+
+def test_hash_uses_image_data(tmp_path):
+    rng = np.random.default_rng(0)
+    frame1 = rng.integers(0, 1000, (64, 64)).astype(np.int16)
+    frame2 = rng.integers(0, 1000, (64, 64)).astype(np.int16)
+
+    for kind in [{}, {'compressed': True}, {'extension': True}]:
+        name = '_'.join(kind) or 'primary'
+        fname1 = str(tmp_path / f'{name}1.fits')
+        fname2 = str(tmp_path / f'{name}2.fits')
+        write_image(fname1, frame1, **kind)
+        write_image(fname2, frame2, **kind)
+
+        hash1 = SolveCache.hash_image_file(fname1)
+        hash2 = SolveCache.hash_image_file(fname2)
+        assert hash1 is not None
+        assert hash1 != hash2
+        header = pyfits.getheader(fname1)
+        assert hash1 == SolveCache.hash_image_data(frame1, header=header)
+
+
+def test_hash_no_image_data(tmp_path):
+    fname = str(tmp_path / 'empty.fits')
+    pyfits.PrimaryHDU().writeto(fname)
+    assert SolveCache.hash_image_file(fname) is None
+
+
+def make_solution(ra, dec=20.0):
+    radec = SkyCoord(ra=ra*u.degree, dec=dec*u.degree, frame='fk5', equinox='J2000')
+    return PlateSolveSolution(radec, pixel_scale=1.52, angle=Angle(171.5*u.degree),
+                              binning=2)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SolveCache(str(tmp_path / 'cache.sqlite'), max_entries=3)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # entries put in quick succession get distinct last_used times
+    now = [1000.0]
+
+    def tick():
+        now[0] += 1.0
+        return now[0]
+
+    monkeypatch.setattr(time, 'time', tick)
+
+
+def test_put_get_round_trip(cache):
+    key = SolveCache.make_key('abc', {'solver': 'native'})
+    assert cache.get(key) is None
+
+    cache.put(key, make_solution(150.25))
+    sol = cache.get(key)
+    assert sol.radec.ra.degree == pytest.approx(150.25)
+    assert sol.radec.dec.degree == pytest.approx(20.0)
+    assert sol.pixel_scale == pytest.approx(1.52)
+    assert sol.angle.degree == pytest.approx(171.5)
+    assert sol.binning == 2
+
+
+def test_persists_after_reopen(tmp_path):
+    fname = str(tmp_path / 'cache.sqlite')
+    cache = SolveCache(fname)
+    cache.put('key', make_solution(10.0))
+    cache.close()
+
+    cache = SolveCache(fname)
+    assert cache.get('key').radec.ra.degree == pytest.approx(10.0)
+    cache.close()
+
+
+def test_evicts_least_recently_used(cache, clock):
+    for i in range(3):
+        cache.put(f'key{i}', make_solution(10.0*i))
+
+    # key0 is now the most recently used so key1 goes first
+    assert cache.get('key0') is not None
+    cache.put('key3', make_solution(30.0))
+
+    assert len(cache) == 3
+    assert cache.get('key1') is None
+    for key in ['key0', 'key2', 'key3']:
+        assert cache.get(key) is not None
+
+
+def test_clear(cache):
+    cache.put('key', make_solution(10.0))
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get('key') is None
+
+
+def test_key_depends_on_params():
+    params = {'solver': 'astrometrylocal', 'pixel_scale': 1.5,
+              'downsample': 2, 'search_rad': 10}
+    key = SolveCache.make_key('abc', params)
+
+    assert key == SolveCache.make_key('abc', dict(reversed(list(params.items()))))
+    assert key != SolveCache.make_key('abd', params)
+    for name, value in [('solver', 'astap'), ('pixel_scale', 1.6),
+                        ('downsample', 4), ('search_rad', 5)]:
+        assert key != SolveCache.make_key('abc', {**params, name: value})
@@ -0,0 +1,81 @@
+import numpy as np
+import astropy.io.fits as pyfits
+
+from pyastrometry.StarExtractor import StarExtractor
+
+
+def synthetic_field(nstars=60, height=800, width=1200, fwhm=3.0, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(10, width - 10, nstars)
+    y = rng.uniform(10, height - 10, nstars)
+    flux = 10**rng.uniform(3.5, 5.5, nstars)
+
+    img = rng.normal(1000, 20, (height, width)).astype(np.float32)
+    # background gradient
+    img += np.linspace(0, 200, width, dtype=np.float32)[None, :]
+
+    s = fwhm/2.355
+    r = int(4*s) + 1
+    for sx, sy, f in zip(x, y, flux):
+        ix = int(sx)
+        iy = int(sy)
+        yy, xx = np.mgrid[iy-r:iy+r+1, ix-r:ix+r+1]
+        img[iy-r:iy+r+1, ix-r:ix+r+1] += \
+            f/(2*np.pi*s*s)*np.exp(-((xx - sx)**2 + (yy - sy)**2)/(2*s*s))
+    return img, x, y, flux
+
+
+def nearest(x, y, ref_x, ref_y):
+    d = np.hypot(x[:, None] - ref_x[None, :], y[:, None] - ref_y[None, :])
+    return d.argmin(axis=1), d.min(axis=1)
+
+
+def test_finds_stars():
+    img, x, y, flux = synthetic_field()
+    ex, ey, eflux = StarExtractor().extract(img)
+
+    # nearly every star found to well under a pixel - a few overlap
+    _, dist = nearest(x, y, ex, ey)
+    assert np.count_nonzero(dist < 0.5) >= 55
+
+    # no spurious detections and brightest first
+    _, dist = nearest(ex, ey, x, y)
+    assert np.all(dist < 3)
+    assert np.all(np.diff(eflux) <= 0)
+
+
+def test_flux_order_matches_input():
+    img, x, y, flux = synthetic_field()
+    ex, ey, eflux = StarExtractor(max_stars=10).extract(img)
+    assert len(ex) == 10
+
+    idx, _ = nearest(ex, ey, x, y)
+    brightest = np.argsort(flux)[::-1][:10]
+    assert len(np.intersect1d(idx, brightest)) >= 9
+
+
+def test_color_planes():
+    img, x, y, _ = synthetic_field()
+    ex, ey, _ = StarExtractor().extract(np.stack([img/3, img/3, img/3]))
+    _, dist = nearest(x, y, ex, ey)
+    assert np.count_nonzero(dist < 0.5) >= 55
+
+
+def test_blank_image():
+    rng = np.random.default_rng(2)
+    img = rng.normal(1000, 20, (400, 600)).astype(np.float32)
+    x, y, flux = StarExtractor().extract(img)
+    assert len(x) == 0
+
+
+def test_write_xylist(tmp_path):
+    fname = str(tmp_path / 'stars.xyls')
+    StarExtractor.write_xylist(fname, np.array([0.0, 10.5]), np.array([2.0, 3.25]),
+                               np.array([100.0, 50.0]), 1200, 800)
+    with pyfits.open(fname) as hdulist:
+        assert hdulist[0].header['IMAGEW'] == 1200
+        assert hdulist[0].header['IMAGEH'] == 800
+        table = hdulist[1].data
+        np.testing.assert_array_equal(table['X'], [1.0, 11.5])
+        np.testing.assert_array_equal(table['Y'], [3.0, 4.25])
+        np.testing.assert_array_equal(table['FLUX'], [100.0, 50.0])
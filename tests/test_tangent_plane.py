@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from pyastrometry.TangentPlane import tan_project, tan_deproject, angular_separation
+
+
+@pytest.mark.parametrize('ra0, dec0', [(10.0, 0.0), (200.0, 45.0), (0.5, 88.0),
+                                       (123.0, -87.5), (359.9, 89.9)])
+def test_round_trip(ra0, dec0):
+    rng = np.random.default_rng(1)
+    xi = rng.uniform(-3, 3, 500)
+    eta = rng.uniform(-3, 3, 500)
+
+    ra, dec = tan_deproject(xi, eta, ra0, dec0)
+    assert np.all(np.abs(dec) <= 90.0)
+
+    xi2, eta2 = tan_project(ra, dec, ra0, dec0)
+    np.testing.assert_allclose(xi2, xi, atol=1e-9)
+    np.testing.assert_allclose(eta2, eta, atol=1e-9)
+
+
+def test_deproject_past_pole():
+    # points north of the tangent point beyond the pole come back down the
+    # other side at RA + 180
+    dist = np.degrees(np.arctan(np.radians(3.0)))
+    ra, dec = tan_deproject(np.array([0.0]), np.array([3.0]), 40.0, 88.0)
+    assert dec[0] == pytest.approx(180.0 - 88.0 - dist)
+    assert ra[0] == pytest.approx(220.0)
+
+
+def test_matches_astropy_wcs():
+    wcs = pytest.importorskip('astropy.wcs')
+    w = wcs.WCS(naxis=2)
+    w.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    w.wcs.crval = [75.0, -89.0]
+    w.wcs.crpix = [1.0, 1.0]
+    w.wcs.cd = [[-1.0, 0.0], [0.0, 1.0]]
+
+    xi, eta = np.meshgrid(np.linspace(-4, 4, 17), np.linspace(-4, 4, 17))
+    xi = xi.ravel()
+    eta = eta.ravel()
+    ra_ref, dec_ref = w.all_pix2world(-xi, eta, 0)
+    ra, dec = tan_deproject(xi, eta, 75.0, -89.0)
+
+    sep = angular_separation(ra, dec, ra_ref, dec_ref)
+    assert np.max(sep) < 1e-9